@@ -0,0 +1,148 @@
+"""
+All rights reserved to cnvrg.io
+     http://www.cnvrg.io
+
+cnvrg.io - AI library
+
+ann.py
+==============================================================================
+"""
+import numpy as np
+from sklearn.base import BaseEstimator, ClassifierMixin
+from sklearn.cluster import KMeans
+from sklearn.metrics import pairwise_distances
+
+
+class IVFKNeighborsClassifier(BaseEstimator, ClassifierMixin):
+	"""
+	Approximate k-nearest-neighbors classifier over an inverted file (IVF) index - the training set is clustered by
+	k-means into n_lists lists, and a query is compared only to the members of its n_probe nearest lists instead of
+	to the whole training set. Same fit/kneighbors/predict/predict_proba interface as KNeighborsClassifier.
+	"""
+	def __init__(self, n_neighbors=5, weights='uniform', p=2, n_lists=None, n_probe=8, batch_size=1024,
+				 random_state=0):
+		"""
+		:param n_neighbors: int. number of neighbors.
+		:param weights: string. 'uniform' or 'distance' (see KNeighborsClassifier).
+		:param p: int. power of the Minkowski metric (2 is Euclidean).
+		:param n_lists: int or None. number of k-means lists. None means sqrt(number of training examples).
+		:param n_probe: int. number of lists searched per query. More lists - higher recall, slower queries.
+		:param batch_size: int. number of queries searched together.
+		:param random_state: int. seed of the k-means.
+		"""
+		self.n_neighbors = n_neighbors
+		self.weights = weights
+		self.p = p
+		self.n_lists = n_lists
+		self.n_probe = n_probe
+		self.batch_size = batch_size
+		self.random_state = random_state
+
+	def fit(self, X, y):
+		X = np.ascontiguousarray(X, dtype=np.float32)
+		n_lists = self.n_lists if self.n_lists is not None else max(1, int(np.sqrt(len(X))))
+		n_lists = min(n_lists, len(X))
+
+		# The centroids are learned over a sample of the training set (k-means converges long before the full data).
+		rng = np.random.RandomState(self.random_state)
+		sample = X[rng.choice(len(X), min(len(X), 256 * n_lists), replace=False)]
+		kmeans = KMeans(n_clusters=n_lists, n_init=1, random_state=self.random_state).fit(sample)
+		assignment = kmeans.predict(X)
+
+		# The index - the training set sorted by list, list l is rows list_offsets_[l]:list_offsets_[l + 1].
+		order = np.argsort(assignment, kind='stable')
+		self.classes_, encoded_y = np.unique(y, return_inverse=True)
+		self.centroids_ = kmeans.cluster_centers_.astype(np.float32)
+		self.data_ = X[order]
+		self.labels_ = encoded_y[order]
+		self.ids_ = order
+		self.list_offsets_ = np.concatenate([[0], np.cumsum(np.bincount(assignment, minlength=n_lists))])
+		return self
+
+	def _distances(self, queries, points):
+		if self.p == 2:
+			# |q - x|^2 = |q|^2 - 2 q.x + |x|^2
+			distances = (queries ** 2).sum(axis=1)[:, None] - 2 * queries.dot(points.T) + (points ** 2).sum(axis=1)
+			return np.sqrt(np.maximum(distances, 0))
+		return pairwise_distances(queries, points, metric='minkowski', p=self.p)
+
+	def _search_batch(self, queries, n_neighbors):
+		n_queries = len(queries)
+		best_distances = np.full((n_queries, n_neighbors), np.inf, dtype=np.float32)
+		best_rows = np.full((n_queries, n_neighbors), -1, dtype=np.int64)
+
+		n_probe = min(self.n_probe, len(self.centroids_))
+		centroid_distances = self._distances(queries, self.centroids_)
+		probes = np.argpartition(centroid_distances, n_probe - 1, axis=1)[:, :n_probe]
+
+		# List by list - every list is compared to all the queries which probe it at once.
+		for lst in np.unique(probes):
+			start, end = self.list_offsets_[lst], self.list_offsets_[lst + 1]
+			if start == end:
+				continue
+			query_rows = np.nonzero((probes == lst).any(axis=1))[0]
+			distances = self._distances(queries[query_rows], self.data_[start:end])
+			rows = np.broadcast_to(np.arange(start, end), distances.shape)
+
+			merged_distances = np.hstack([best_distances[query_rows], distances])
+			merged_rows = np.hstack([best_rows[query_rows], rows])
+			top = np.argpartition(merged_distances, n_neighbors - 1, axis=1)[:, :n_neighbors] \
+				if merged_distances.shape[1] > n_neighbors else np.arange(merged_distances.shape[1])[None, :]
+			best_distances[query_rows] = np.take_along_axis(merged_distances, top, axis=1)
+			best_rows[query_rows] = np.take_along_axis(merged_rows, top, axis=1)
+
+		order = np.argsort(best_distances, axis=1)
+		return np.take_along_axis(best_distances, order, axis=1), np.take_along_axis(best_rows, order, axis=1)
+
+	def _kneighbors_rows(self, X, n_neighbors):
+		X = np.ascontiguousarray(X, dtype=np.float32)
+		distances, rows = [], []
+		for start in range(0, len(X), self.batch_size):
+			batch_distances, batch_rows = self._search_batch(X[start:start + self.batch_size], n_neighbors)
+			distances.append(batch_distances)
+			rows.append(batch_rows)
+		return np.vstack(distances), np.vstack(rows)
+
+	def kneighbors(self, X, n_neighbors=None, return_distance=True):
+		"""
+		:return: (distances, indices) as KNeighborsClassifier.kneighbors - indices are rows of the training set
+		(-1 if fewer than n_neighbors candidates were found in the probed lists).
+		"""
+		n_neighbors = n_neighbors if n_neighbors is not None else self.n_neighbors
+		distances, rows = self._kneighbors_rows(X, n_neighbors)
+		indices = np.where(rows >= 0, self.ids_[np.maximum(rows, 0)], -1)
+		return (distances, indices) if return_distance else indices
+
+	def predict_proba(self, X):
+		distances, rows = self._kneighbors_rows(X, self.n_neighbors)
+		found = rows >= 0
+		if self.weights == 'distance':
+			with np.errstate(divide='ignore'):
+				weights = 1. / distances
+			# Exact matches get all the weight (as in KNeighborsClassifier).
+			exact = np.isinf(weights)
+			weights = np.where(exact.any(axis=1)[:, None], exact.astype(float), weights)
+		else:
+			weights = np.ones(distances.shape)
+		weights = np.where(found, weights, 0.)
+
+		proba = np.zeros((len(rows), len(self.classes_)))
+		labels = self.labels_[np.maximum(rows, 0)]
+		for cls in range(len(self.classes_)):
+			proba[:, cls] = (weights * (labels == cls)).sum(axis=1)
+		normalizer = proba.sum(axis=1, keepdims=True)
+		normalizer[normalizer == 0] = 1.
+		return proba / normalizer
+
+	def predict(self, X):
+		return self.classes_[np.argmax(self.predict_proba(X), axis=1)]
+
+
+def neighbors_recall(approx_indices, exact_indices):
+	"""
+	:param approx_indices: array. shape=(n_queries, k). neighbors found by an approximate index.
+	:param exact_indices: array. shape=(n_queries, k). the exact neighbors.
+	:return: float. the average fraction of the exact neighbors found (recall@k).
+	"""
+	found = [len(np.intersect1d(approx, exact)) for approx, exact in zip(approx_indices, exact_indices)]
+	return float(np.sum(found)) / exact_indices.size
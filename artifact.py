@@ -0,0 +1,214 @@
+"""
+All rights reserved to cnvrg.io
+     http://www.cnvrg.io
+
+cnvrg.io - AI library
+
+artifact.py
+==============================================================================
+Model artifacts - the trained model is saved as a directory:
+    artifact.json   the manifest - model class, hyperparameters, metrics, feature schema, library versions and the
+                    sha256 of the payload.
+    model.joblib    the model (joblib; uncompressed by default, so its arrays can be memory-mapped on load), or
+    model.ubj       the booster of an xgboost model, in xgboost's own format.
+Opening an artifact reads only the manifest; the payload is loaded on the first access to Artifact.model.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import hashlib
+import platform
+
+import numpy as np
+import joblib
+import sklearn
+
+manifest_name = 'artifact.json'
+format_version = 1
+# A model pickled by an older version of the scripts at the path of a new artifact is moved aside to this path.
+legacy_suffix = '.legacy'
+
+
+def _jsonable(value):
+	if isinstance(value, np.generic):
+		return value.item()
+	if isinstance(value, float) and np.isnan(value):
+		return None
+	if value is None or isinstance(value, (bool, int, float, str)):
+		return value
+	if isinstance(value, (list, tuple)):
+		return [_jsonable(item) for item in value]
+	if isinstance(value, dict):
+		return {str(key): _jsonable(item) for key, item in value.items()}
+	return repr(value)
+
+
+def _file_hash(path):
+	sha = hashlib.sha256()
+	with open(path, 'rb') as f:
+		for block in iter(lambda: f.read(2 ** 20), b''):
+			sha.update(block)
+	return sha.hexdigest()
+
+
+def _is_xgboost(model):
+	try:
+		from xgboost import XGBModel
+	except ImportError:
+		return False
+	return isinstance(model, XGBModel)
+
+
+def _library_versions():
+	versions = {'python': platform.python_version(), 'numpy': np.__version__, 'sklearn': sklearn.__version__,
+				'joblib': joblib.__version__}
+	if 'xgboost' in sys.modules:
+		versions['xgboost'] = sys.modules['xgboost'].__version__
+	return versions
+
+
+def is_artifact(path):
+	"""
+	:param path: string.
+	:return: boolean. whether path is an artifact directory.
+	"""
+	return os.path.isfile(os.path.join(path, manifest_name))
+
+
+def prepare_artifact_path(path):
+	"""
+	Checks that an artifact can be saved to path - the scripts call it before the training, so a bad output path fails
+	early. A model pickled by an older version of the scripts (a file) is moved aside to path + legacy_suffix.
+	:param path: string. the artifact directory.
+	:raise Exception: if path is neither free nor an artifact, and can't be moved aside.
+	"""
+	if not os.path.exists(path) or is_artifact(path):
+		return
+	legacy_path = path + legacy_suffix
+	if os.path.isfile(path) and not os.path.exists(legacy_path):
+		os.rename(path, legacy_path)
+		print("{} is a model saved by an older version, it was moved to {}.".format(path, legacy_path))
+		return
+	raise Exception("Artifact Error: {} exists and isn't a model artifact, it won't be replaced.".format(path))
+
+
+def save_artifact(model, path, metrics=None, feature_schema=None, compress=0):
+	"""
+	:param model: fitted model.
+	:param path: string. the artifact directory. An existing artifact there is replaced, an older pickled model is
+	moved aside (see prepare_artifact_path).
+	:param metrics: dict or None. the metrics of the model (ex: test_acc).
+	:param feature_schema: list of [column, dtype] or None. the features the model was trained on, in order.
+	:param compress: int. joblib compression level (0-9). 0 keeps the arrays memory-mappable. Not used by xgboost
+	models (saved in xgboost's format).
+	:return: dict. the manifest.
+	"""
+	prepare_artifact_path(path)
+	if is_artifact(path):
+		shutil.rmtree(path)
+	os.makedirs(path)
+
+	if _is_xgboost(model):
+		payload, payload_format = 'model.ubj', 'xgboost'
+		model.save_model(os.path.join(path, payload))
+	else:
+		payload, payload_format = 'model.joblib', 'joblib'
+		joblib.dump(model, os.path.join(path, payload), compress=compress)
+
+	params = model.get_params() if hasattr(model, 'get_params') else {}
+	manifest = {'format_version': format_version,
+				'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+				'model_class': '{}.{}'.format(type(model).__module__, type(model).__name__),
+				'payload': payload,
+				'payload_format': payload_format,
+				'compress': compress if payload_format == 'joblib' else None,
+				'content_hash': _file_hash(os.path.join(path, payload)),
+				'hyperparameters': _jsonable(params),
+				'metrics': _jsonable(metrics or {}),
+				'feature_schema': _jsonable(feature_schema),
+				'library_versions': _library_versions()}
+	write_manifest(path, manifest)
+	return manifest
+
+
+def write_manifest(path, manifest):
+	with open(os.path.join(path, manifest_name), 'w') as f:
+		json.dump(manifest, f, indent=2)
+
+
+def update_manifest(path, **fields):
+	"""
+	Adds fields to the manifest of an artifact (ex: the feature schema, known only to the caller of the training).
+	"""
+	manifest = Artifact(path).manifest
+	manifest.update(_jsonable(fields))
+	write_manifest(path, manifest)
+
+
+class Artifact:
+	"""
+	An artifact directory. The manifest is read on open, the model on the first access to model.
+	"""
+	def __init__(self, path, mmap_mode='r', verify=False):
+		"""
+		:param path: string. the artifact directory.
+		:param mmap_mode: string or None. joblib mmap_mode of uncompressed payloads - 'r' (default) memory-maps the
+		large arrays instead of reading them, None reads them.
+		:param verify: boolean. whether to check the payload against the content hash before loading it.
+		"""
+		if not is_artifact(path):
+			raise Exception("Artifact Error: {} is not a model artifact.".format(path))
+		self.path = path
+		self.mmap_mode = mmap_mode
+		self.verify = verify
+		with open(os.path.join(path, manifest_name)) as f:
+			self.manifest = json.load(f)
+		if self.manifest['format_version'] > format_version:
+			raise Exception("Artifact Error: Unsupported artifact format version {}.".format(self.manifest['format_version']))
+		self._model = None
+
+	@property
+	def payload_path(self):
+		return os.path.join(self.path, self.manifest['payload'])
+
+	@property
+	def feature_columns(self):
+		schema = self.manifest.get('feature_schema')
+		return [column for column, _ in schema] if schema is not None else None
+
+	def check_features(self, columns):
+		"""
+		:param columns: list of strings. the feature columns of the data to score, in order.
+		"""
+		expected = self.feature_columns
+		if expected is not None and list(columns) != expected:
+			raise Exception("Artifact Error: The model was trained on the features {}, got {}.".format(expected, list(columns)))
+
+	def verify_hash(self):
+		if _file_hash(self.payload_path) != self.manifest['content_hash']:
+			raise Exception("Artifact Error: The payload of {} doesn't match its content hash.".format(self.path))
+
+	@property
+	def model(self):
+		if self._model is None:
+			if self.verify:
+				self.verify_hash()
+			if self.manifest['payload_format'] == 'xgboost':
+				import xgboost
+				model_class = getattr(xgboost, self.manifest['model_class'].split('.')[-1])
+				self._model = model_class()
+				self._model.load_model(self.payload_path)
+			else:
+				# Compressed payloads can't be memory-mapped.
+				mmap_mode = self.mmap_mode if not self.manifest['compress'] else None
+				self._model = joblib.load(self.payload_path, mmap_mode=mmap_mode)
+		return self._model
+
+
+def load_artifact(path, mmap_mode='r', verify=False):
+	"""
+	:return: the fitted model of an artifact (see Artifact).
+	"""
+	return Artifact(path, mmap_mode=mmap_mode, verify=verify).model
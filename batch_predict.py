@@ -0,0 +1,105 @@
+"""
+All rights reserved to cnvrg.io
+     http://www.cnvrg.io
+
+cnvrg.io - AI library
+
+batch_predict.py
+==============================================================================
+Memory-bounded prediction - the query rows are predicted in batches sized so that the distance matrices of all the
+batches in flight fit a memory budget, optionally over a thread pool (the distance computations release the GIL).
+"""
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from sklearn import config_context
+from sklearn.neighbors import KNeighborsClassifier
+
+from dataset import take_rows
+
+
+def batch_rows(bytes_per_row, memory_budget_mb, workers=1):
+	"""
+	:param bytes_per_row: int. memory needed to predict a single row.
+	:param memory_budget_mb: float. memory (MB) of all the batches in flight together.
+	:param workers: int. number of batches in flight.
+	:return: int. rows per batch (at least 1).
+	"""
+	return max(1, int(memory_budget_mb * 2 ** 20 / workers // bytes_per_row))
+
+
+def iter_batch_predictions(predict, X, rows, workers=None):
+	"""
+	Streams the predictions of the batches, in order.
+	:param predict: callable. X batch -> predictions of the batch.
+	:param X: array. the query rows.
+	:param rows: int. rows per batch.
+	:param workers: int or None. number of threads. None means the batches are predicted one by one in this thread.
+	:return: generator of the batches' predictions.
+	"""
+	batches = (take_rows(X, np.arange(start, min(start + rows, len(X)))) for start in range(0, len(X), rows))
+	if workers is None or workers < 2:
+		for batch in batches:
+			yield predict(batch)
+		return
+	with ThreadPoolExecutor(max_workers=workers) as pool:
+		# At most 2 * workers batches are submitted ahead, so the memory stays bounded on long inputs.
+		pending = []
+		for batch in batches:
+			pending.append(pool.submit(predict, batch))
+			if len(pending) >= 2 * workers:
+				yield pending.pop(0).result()
+		for future in pending:
+			yield future.result()
+
+
+class BatchedKNeighborsClassifier(KNeighborsClassifier):
+	"""
+	KNeighborsClassifier whose predict/predict_proba run in memory-bounded batches of query rows (see batch_predict).
+	The fitted model is the same as KNeighborsClassifier's.
+	"""
+	def __init__(self, n_neighbors=5, weights='uniform', algorithm='auto', leaf_size=30, p=2, metric='minkowski',
+				 metric_params=None, n_jobs=None, memory_budget_mb=1024, predict_workers=None):
+		"""
+		:param memory_budget_mb: float. memory (MB) of the prediction - the distances of the query rows in flight to
+		the whole training set.
+		:param predict_workers: int or None. number of threads predicting batches. None means a single thread.
+		(the rest - see KNeighborsClassifier.)
+		"""
+		super().__init__(n_neighbors=n_neighbors, weights=weights, algorithm=algorithm, leaf_size=leaf_size, p=p,
+						 metric=metric, metric_params=metric_params, n_jobs=n_jobs)
+		self.memory_budget_mb = memory_budget_mb
+		self.predict_workers = predict_workers
+
+	def _batch_rows(self):
+		# A distance (float64) and a neighbor index (int64) per training example.
+		workers = self.predict_workers if self.predict_workers is not None else 1
+		return batch_rows(16 * self.n_samples_fit_, self.memory_budget_mb, workers)
+
+	def _batched(self, predict, X):
+		workers = self.predict_workers if self.predict_workers is not None else 1
+		rows = self._batch_rows()
+
+		def predict_batch(batch):
+			# scikit-learn's own chunking of the distances (thread local) gets the share of the batch.
+			with config_context(working_memory=self.memory_budget_mb / workers):
+				return predict(batch)
+
+		return iter_batch_predictions(predict_batch, X, rows, self.predict_workers)
+
+	def iter_predict(self, X):
+		"""
+		:return: generator of the predictions of the batches of X, in order.
+		"""
+		return self._batched(super().predict, X)
+
+	def predict(self, X):
+		# No batches to concatenate.
+		if len(X) == 0:
+			return np.empty(0, dtype=self.classes_.dtype)
+		return np.concatenate(list(self.iter_predict(X)))
+
+	def predict_proba(self, X):
+		if len(X) == 0:
+			return np.zeros((0, len(self.classes_)))
+		return np.vstack(list(self._batched(super().predict_proba, X)))
@@ -0,0 +1,122 @@
+"""
+All rights reserved to cnvrg.io
+     http://www.cnvrg.io
+
+cnvrg.io - AI library
+
+benchmark_artifacts.py
+==============================================================================
+"""
+import os
+import time
+import pickle
+import shutil
+import argparse
+import tempfile
+
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.neighbors import KNeighborsClassifier
+from xgboost import XGBClassifier
+
+from artifact import save_artifact, load_artifact
+from harness import load_dataset
+from score import load_model
+
+
+def _size(path):
+	if os.path.isfile(path):
+		return os.path.getsize(path)
+	return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names)
+
+
+def _pickle_dump(model, path):
+	with open(path, 'wb') as f:
+		pickle.dump(model, f)
+
+
+def _pickle_load(path):
+	with open(path, 'rb') as f:
+		return pickle.load(f)
+
+
+def benchmark(name, model, X, directory, repeats):
+	"""
+	Saves the model in every format and times saving, loading and the first prediction after the load (which pays
+	for the pages of memory-mapped arrays).
+	:return: list of dicts. a row of the results table per format.
+	"""
+	formats = [('pickle', _pickle_dump, _pickle_load),
+			   ('artifact', lambda m, p: save_artifact(m, p), lambda p: load_artifact(p, mmap_mode=None)),
+			   ('artifact mmap', lambda m, p: save_artifact(m, p), lambda p: load_artifact(p, mmap_mode='r')),
+			   ('artifact compress=3', lambda m, p: save_artifact(m, p, compress=3), load_artifact)]
+	expected = model.predict(X)
+	rows = []
+	for format_name, save, load in formats:
+		path = os.path.join(directory, '{}_{}'.format(name, format_name.replace(' ', '_').replace('=', '')))
+		start = time.perf_counter()
+		save(model, path)
+		save_time = time.perf_counter() - start
+
+		load_times, predict_times = [], []
+		for _ in range(repeats):
+			start = time.perf_counter()
+			loaded = load(path)
+			load_times.append(time.perf_counter() - start)
+			start = time.perf_counter()
+			predictions = loaded.predict(X)
+			predict_times.append(time.perf_counter() - start)
+		if not np.array_equal(predictions, expected):
+			raise Exception("Benchmark Error: {} loaded from {} predicts differently.".format(name, format_name))
+
+		rows.append({'model': name,
+					 'format': format_name,
+					 'size_mb': _size(path) / 2 ** 20,
+					 'save_sec': save_time,
+					 'load_sec': float(np.median(load_times)),
+					 'first_predict_sec': float(np.median(predict_times))})
+	return rows
+
+
+def main(args):
+	args.n_estimators = int(args.n_estimators)
+	args.repeats = int(args.repeats)
+
+	X, y = load_dataset(args.data)
+	if args.models is not None:
+		models = [(os.path.basename(path.rstrip('/')), load_model(path)) for path in args.models.split(',')]
+	else:
+		models = [('knn', KNeighborsClassifier().fit(X, y)),
+				  ('random_forest', RandomForestClassifier(n_estimators=args.n_estimators).fit(X, y)),
+				  ('xgb', XGBClassifier(n_estimators=args.n_estimators, missing=np.nan).fit(X, y))]
+
+	directory = tempfile.mkdtemp()
+	try:
+		rows = []
+		for name, model in models:
+			rows += benchmark(name, model, X[:1000], directory, args.repeats)
+	finally:
+		shutil.rmtree(directory)
+	table = pd.DataFrame(rows).set_index(['model', 'format'])
+	print(table.to_string(float_format='{:.4f}'.format))
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description="""Model saving/loading benchmark - bare pickle vs artifacts""")
+	parser.add_argument('--data', action='store', dest='data', required=True,
+						help="""String. path to csv, parquet or feather file: a processed data set.""")
+
+	parser.add_argument('--models', action='store', default=None, dest='models',
+						help="""String. Comma separated models (outputs of the model scripts). If not given, a knn, a
+						random forest and an xgboost model are trained over the data set.""")
+
+	parser.add_argument('--n_estimators', action='store', default="100", dest='n_estimators',
+						help="""Integer. Number of trees of the trained models (without --models). Default is 100.""")
+
+	parser.add_argument('--repeats', action='store', default="5", dest='repeats',
+						help="""Integer. Number of loads per format, the median time is reported. Default is 5.""")
+
+	args = parser.parse_args()
+
+	main(args)
@@ -0,0 +1,91 @@
+"""
+All rights reserved to cnvrg.io
+     http://www.cnvrg.io
+
+cnvrg.io - AI library
+
+benchmark_preprocess.py
+==============================================================================
+"""
+import time
+import argparse
+
+import numpy as np
+import pandas as pd
+
+from preprocess import preprocess, to_drop, con_dict, emp_length_dict
+
+
+def make_synthetic_raw(rows, seed=0):
+	"""
+	Generates a raw LendingClub-like data set with the columns preprocess.py expects.
+	:param rows: int. number of rows.
+	:param seed: int. seed of the random generator.
+	:return: data frame.
+	"""
+	rng = np.random.RandomState(seed)
+	data = pd.DataFrame()
+	data['is_bad'] = rng.randint(0, 2, rows)
+	data['loan_amnt'] = rng.randint(500, 35000, rows).astype(float)
+	data['term'] = rng.choice([' 36 months', ' 60 months'], rows)
+	data['int_rate'] = rng.uniform(0.05, 0.25, rows)
+	data['installment'] = rng.uniform(15, 1300, rows)
+	data['grade'] = rng.choice(list(con_dict.keys()), rows)
+	data['sub_grade'] = data['grade'] + rng.randint(1, 6, rows).astype(str)
+	data['emp_length'] = rng.choice(list(emp_length_dict.keys()) + ['n/a'], rows)
+	data['home_ownership'] = rng.choice(['MORTGAGE', 'NONE', 'OTHER', 'OWN', 'RENT'], rows)
+	data['annual_inc'] = rng.uniform(4000, 500000, rows)
+	data['verification_status'] = rng.choice(['VERIFIED - income', 'VERIFIED - income source', 'not verified'], rows)
+	data['dti'] = rng.uniform(0, 30, rows)
+	data['revol_bal'] = rng.randint(0, 150000, rows).astype(float)
+	data['inq_last_6mths'] = np.where(rng.uniform(size=rows) < 0.01, np.nan, rng.randint(0, 9, rows))
+	data['open_acc'] = np.where(rng.uniform(size=rows) < 0.01, np.nan, rng.randint(1, 40, rows))
+	data['revol_util'] = np.where(rng.uniform(size=rows) < 0.01, np.nan, rng.uniform(0, 100, rows))
+	for column in to_drop:
+		data[column] = rng.randint(0, 10, rows)
+	return data
+
+
+def _time_preprocess(data, vectorized, repeats):
+	timings, result = [], None
+	for _ in range(repeats):
+		copy = data.copy()
+		start = time.perf_counter()
+		result = preprocess(copy, vectorized=vectorized)
+		timings.append(time.perf_counter() - start)
+	return min(timings), result
+
+
+def main(args):
+	args.rows = int(args.rows)
+	args.repeats = int(args.repeats)
+
+	data = pd.read_csv(args.data) if args.data is not None else make_synthetic_raw(args.rows)
+	rows_num = len(data)
+
+	loop_time, loop_result = _time_preprocess(data, vectorized=False, repeats=args.repeats)
+	vec_time, vec_result = _time_preprocess(data, vectorized=True, repeats=args.repeats)
+
+	# Both paths must give the same processed data set (dtypes may differ, values must not).
+	pd.testing.assert_frame_equal(loop_result, vec_result, check_dtype=False)
+
+	print("rows: {}".format(rows_num))
+	print("loop-based:  {:.4f} sec".format(loop_time))
+	print("vectorized:  {:.4f} sec".format(vec_time))
+	print("speedup:     {:.1f}x".format(loop_time / vec_time))
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description="""Preprocessing benchmark - loop-based vs vectorized transforms""")
+	parser.add_argument('--data', action='store', default=None, dest='data',
+						help="""String. path to a raw dataset. If not given, a synthetic data set is generated.""")
+
+	parser.add_argument('--rows', action='store', default="1000000", dest='rows',
+						help="""Integer. Number of rows of the synthetic data set. Default is 1000000.""")
+
+	parser.add_argument('--repeats', action='store', default="3", dest='repeats',
+						help="""Integer. Number of repeats per path, the best time is reported. Default is 3.""")
+
+	args = parser.parse_args()
+
+	main(args)
@@ -0,0 +1,109 @@
+"""
+All rights reserved to cnvrg.io
+     http://www.cnvrg.io
+
+cnvrg.io - AI library
+
+benchmark_trees.py
+==============================================================================
+"""
+import time
+import argparse
+
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import RandomForestClassifier
+from xgboost import XGBClassifier
+
+from compiled_trees import compile_model
+from harness import load_dataset
+from score import load_model
+
+
+def _time_predict(predict, X, repeats):
+	timings, result = [], None
+	for _ in range(repeats):
+		start = time.perf_counter()
+		result = predict(X)
+		timings.append(time.perf_counter() - start)
+	return float(np.median(timings)), result
+
+
+def benchmark(name, model, X, batch_sizes, repeats, engine='auto', seed=0):
+	"""
+	Compares model.predict to the compiled model over batches of growing sizes (rows drawn from X).
+	:return: list of dicts. a row of the results table per batch size.
+	"""
+	compiled = compile_model(model, engine=engine)
+	# The first call compiles the numba kernels.
+	compiled.predict(X[:1])
+	rng = np.random.RandomState(seed)
+	rows = []
+	for batch_size in batch_sizes:
+		batch = X[rng.randint(0, len(X), batch_size)]
+		model_time, model_pred = _time_predict(model.predict, batch, repeats)
+		compiled_time, compiled_pred = _time_predict(compiled.predict, batch, repeats)
+
+		# The compiled model must give the same predictions.
+		if not np.array_equal(model_pred, compiled_pred):
+			raise Exception("Benchmark Error: The compiled {} predicts differently on a batch of {}.".format(name, batch_size))
+		proba_diff = np.abs(model.predict_proba(batch) - compiled.predict_proba(batch)).max()
+
+		rows.append({'model': name,
+					 'engine': compiled.engine,
+					 'batch_size': batch_size,
+					 'predict_ms': model_time * 1000,
+					 'compiled_ms': compiled_time * 1000,
+					 'predict_rows_per_sec': batch_size / model_time,
+					 'compiled_rows_per_sec': batch_size / compiled_time,
+					 'speedup': model_time / compiled_time,
+					 'max_proba_diff': proba_diff})
+	return rows
+
+
+def main(args):
+	args.n_estimators = int(args.n_estimators)
+	args.repeats = int(args.repeats)
+	args.batch_sizes = [int(size) for size in args.batch_sizes.split(',')]
+
+	X, y = load_dataset(args.data)
+	if args.models is not None:
+		models = [(path, load_model(path)) for path in args.models.split(',')]
+	else:
+		models = [('random_forest', RandomForestClassifier(n_estimators=args.n_estimators).fit(X, y)),
+				  ('xgb', XGBClassifier(n_estimators=args.n_estimators, missing=np.nan).fit(X, y))]
+
+	rows = []
+	for name, model in models:
+		for engine in args.engines.split(','):
+			rows += benchmark(name, model, X, args.batch_sizes, args.repeats, engine=engine)
+	table = pd.DataFrame(rows).set_index(['model', 'engine', 'batch_size'])
+	print(table.to_string(float_format='{:.4g}'.format))
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description="""Tree-ensemble inference benchmark - model.predict vs compiled_trees""")
+	parser.add_argument('--data', action='store', dest='data', required=True,
+						help="""String. path to csv, parquet or feather file: a processed data set (the batches are
+						drawn from its rows).""")
+
+	parser.add_argument('--models', action='store', default=None, dest='models',
+						help="""String. Comma separated models (random_forest.py or xgb.py outputs). If not given,
+						a random forest and an xgboost model are trained over the data set.""")
+
+	parser.add_argument('--n_estimators', action='store', default="100", dest='n_estimators',
+						help="""Integer. Number of trees of the trained models (without --models). Default is 100.""")
+
+	parser.add_argument('--batch_sizes', action='store', default="1,10,100,1000,10000,100000", dest='batch_sizes',
+						help="""String. Comma separated batch sizes. Default is 1,10,100,1000,10000,100000.""")
+
+	parser.add_argument('--engines', action='store', default="auto", dest='engines',
+						help="""String. Comma separated engines of the compiled models (numpy, numba, auto - see
+						compiled_trees.CompiledTreeEnsemble). Default is auto.""")
+
+	parser.add_argument('--repeats', action='store', default="3", dest='repeats',
+						help="""Integer. Number of repeats per batch size, the median time is reported. Default is 3.""")
+
+	args = parser.parse_args()
+
+	main(args)
@@ -0,0 +1,49 @@
+"""
+All rights reserved to cnvrg.io
+     http://www.cnvrg.io
+
+cnvrg.io - AI library
+
+booster.py
+==============================================================================
+The model saved by xgb.py --cache_dmatrix. It is kept out of xgb.py (a script, run as __main__) so the saved model
+can be loaded by score.py and serve.py.
+"""
+import numpy as np
+import xgboost
+
+
+class BoosterClassifier:
+	"""
+	sklearn-like classifier over a booster trained with xgboost.train (the model of --cache_dmatrix). It predicts raw
+	arrays (inplace_predict, no DMatrix is built) as well as DMatrices.
+	"""
+	def __init__(self, booster, classes, best_iteration=None, missing=np.nan):
+		"""
+		:param booster: xgboost.Booster. trained booster.
+		:param classes: array. the labels, sorted.
+		:param best_iteration: int or None. if given, only the trees up to it predict (early stopping).
+		:param missing: float. the value treated as missing in the predicted arrays (the missing param the booster was
+		trained with). Default is np.nan.
+		"""
+		self.booster = booster
+		self.classes_ = np.asarray(classes)
+		self.best_iteration = best_iteration
+		self.missing = missing
+
+	def get_booster(self):
+		return self.booster
+
+	def predict_proba(self, X):
+		iteration_range = (0, self.best_iteration + 1) if self.best_iteration is not None else (0, 0)
+		if isinstance(X, xgboost.DMatrix):
+			proba = self.booster.predict(X, iteration_range=iteration_range)
+		else:
+			proba = self.booster.inplace_predict(X, iteration_range=iteration_range,
+												 missing=getattr(self, 'missing', np.nan))
+		if proba.ndim == 1:
+			proba = np.column_stack([1 - proba, proba])
+		return proba
+
+	def predict(self, X):
+		return self.classes_[np.argmax(self.predict_proba(X), axis=1)]
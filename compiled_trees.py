@@ -0,0 +1,294 @@
+"""
+All rights reserved to cnvrg.io
+     http://www.cnvrg.io
+
+cnvrg.io - AI library
+
+compiled_trees.py
+==============================================================================
+Compiled tree-ensemble inference - the trees of a fitted RandomForestClassifier or XGBoost model are flattened into
+contiguous node arrays (feature, threshold, children, leaf value) and evaluated for a whole batch at once: all the
+rows descend all the trees together, a level per step, with numpy gathers instead of a per-tree traversal.
+"""
+import json
+import importlib.util
+
+import numpy as np
+
+# The numba kernels, compiled on first use (numba is optional - see CompiledTreeEnsemble engine).
+_kernels = {}
+
+
+def _numba_kernels():
+	if not _kernels:
+		import numba
+
+		@numba.njit(parallel=True, nogil=True, cache=True)
+		def leaves(X, feature, threshold, left, right, default_left, roots):
+			# Tree by tree, so the nodes of the tree stay in the cache while all the rows descend it.
+			result = np.empty((X.shape[0], roots.shape[0]), dtype=np.intp)
+			for tree in range(roots.shape[0]):
+				for row in numba.prange(X.shape[0]):
+					node = roots[tree]
+					while left[node] != node:
+						x = X[row, feature[node]]
+						if x != x:
+							node = left[node] if default_left[node] else right[node]
+						elif x <= threshold[node]:
+							node = left[node]
+						else:
+							node = right[node]
+					result[row, tree] = node
+			return result
+
+		_kernels['leaves'] = leaves
+	return _kernels
+
+
+def numba_available():
+	return importlib.util.find_spec('numba') is not None
+
+
+class CompiledTreeEnsemble:
+	"""
+	A flattened tree ensemble. The nodes of all the trees share the arrays; a leaf points to itself (and its
+	threshold is +inf).
+	"""
+	def __init__(self, feature, threshold, left, right, default_left, value, roots, max_depth, classes, link,
+				 base_margin=0., missing=np.nan, batch_rows=4096, engine='auto'):
+		"""
+		:param feature: int array. split feature of every node.
+		:param threshold: float64 array. a row goes to the left child if its feature <= threshold.
+		:param left: int array. left child of every node.
+		:param right: int array. right child of every node.
+		:param default_left: bool array. the child of rows whose feature is missing (NaN).
+		:param value: array. shape=(n_nodes, n_values). the value of the leaves.
+		:param roots: int array. root node of every tree (in the order the trees are summed).
+		:param max_depth: int. depth of the deepest tree.
+		:param classes: array. the classes of the model.
+		:param link: string. 'mean' - the probabilities are the mean of the trees' leaf values (random forest),
+		'logistic' - the sigmoid of base_margin + the sum of the trees' leaf values (binary xgboost).
+		:param base_margin: float. see link.
+		:param missing: float. the feature value treated as missing (default_left), besides NaN - the missing param of
+		the xgboost model.
+		:param batch_rows: int. number of rows descending the trees together (bounds the memory).
+		:param engine: string. 'numba' - a compiled per-row traversal over all the cores (requires numba), 'numpy' -
+		vectorized gathers, all the rows descend together, 'auto' - numba if installed, otherwise numpy.
+		"""
+		self.feature = feature
+		self.threshold = threshold
+		self.left = left
+		self.right = right
+		self.default_left = default_left
+		self.value = value
+		self.roots = roots
+		self.max_depth = max_depth
+		self.classes_ = classes
+		self.link = link
+		self.base_margin = base_margin
+		self.missing = missing
+		self.batch_rows = batch_rows
+		self.engine = engine if engine != 'auto' else ('numba' if numba_available() else 'numpy')
+		self._is_leaf = left == np.arange(len(left))
+		self._children = np.stack([left, right], axis=1)
+
+	def _leaves_numpy(self, X):
+		# Every (row, tree) pair descends until its leaf; the pairs which reached a leaf drop out of the next steps.
+		rows_num, trees_num = len(X), len(self.roots)
+		flat_X = X.ravel()
+		nodes = np.tile(self.roots, rows_num)
+		offsets = np.repeat(np.arange(rows_num, dtype=np.intp) * X.shape[1], trees_num)
+		active = np.nonzero(~self._is_leaf[nodes])[0]
+		has_missing = np.isnan(X).any()
+		while len(active):
+			node = nodes[active]
+			x = flat_X[offsets[active] + self.feature[node]]
+			go_right = ~(x <= self.threshold[node])
+			if has_missing:
+				go_right = np.where(np.isnan(x), ~self.default_left[node], go_right)
+			node = self._children[node, go_right.view(np.int8)]
+			nodes[active] = node
+			active = active[~self._is_leaf[node]]
+		return nodes.reshape(rows_num, trees_num)
+
+	def leaves(self, X):
+		"""
+		:param X: float32 array. shape=(n_rows, n_features).
+		:return: int array. shape=(n_rows, n_trees). the leaf of every row in every tree.
+		"""
+		X = np.ascontiguousarray(X, dtype=np.float32)
+		if not np.isnan(self.missing):
+			X = np.where(X == np.float32(self.missing), np.float32(np.nan), X)
+		if self.engine == 'numba':
+			return _numba_kernels()['leaves'](X, self.feature, self.threshold, self.left, self.right,
+											   self.default_left, self.roots)
+		return self._leaves_numpy(X)
+
+	def _predict_proba_batch(self, X):
+		leaves = self.leaves(X)
+		if self.link == 'mean':
+			# Summed tree by tree, in the order of the forest, then averaged (as RandomForestClassifier does).
+			proba = np.zeros((len(X), self.value.shape[1]))
+			for tree in range(len(self.roots)):
+				proba += self.value[leaves[:, tree]]
+			proba /= len(self.roots)
+			return proba
+
+		# The margin is summed in float32, tree by tree, from the base margin (as xgboost does).
+		margin = np.full(len(X), self.base_margin, dtype=np.float32)
+		for tree in range(len(self.roots)):
+			margin += self.value[leaves[:, tree], 0]
+		# exp in float64 rounded to float32 is (almost always) the correctly rounded expf xgboost uses, numpy's float32
+		# exp is not.
+		proba = np.float32(1) / (np.float32(1) + np.exp(-margin.astype(np.float64)).astype(np.float32))
+		return np.vstack((1 - proba, proba)).T
+
+	def predict_proba(self, X):
+		X = np.ascontiguousarray(X, dtype=np.float32)
+		return np.concatenate([self._predict_proba_batch(X[start:start + self.batch_rows])
+							   for start in range(0, len(X), self.batch_rows)]) if len(X) else \
+			np.zeros((0, len(self.classes_)))
+
+	def predict(self, X):
+		proba = self.predict_proba(X)
+		if self.link == 'logistic':
+			return self.classes_[(proba[:, 1] > 0.5).astype(int)]
+		return self.classes_[np.argmax(proba, axis=1)]
+
+	def save(self, path):
+		"""
+		:param path: string. path to a .npz file.
+		"""
+		np.savez(path, feature=self.feature, threshold=self.threshold, left=self.left, right=self.right,
+				 default_left=self.default_left, value=self.value, roots=self.roots, classes=self.classes_,
+				 meta=np.array(json.dumps({'max_depth': int(self.max_depth), 'link': self.link,
+										   'base_margin': float(self.base_margin), 'missing': float(self.missing)})))
+
+	@classmethod
+	def load(cls, path, engine='auto'):
+		"""
+		:param path: string. path to a .npz file written by save.
+		:param engine: string. see __init__.
+		:return: CompiledTreeEnsemble.
+		"""
+		arrays = np.load(path)
+		meta = json.loads(str(arrays['meta']))
+		return cls(arrays['feature'], arrays['threshold'], arrays['left'], arrays['right'], arrays['default_left'],
+				   arrays['value'], arrays['roots'], meta['max_depth'], arrays['classes'], meta['link'],
+				   base_margin=meta['base_margin'], missing=meta.get('missing', np.nan), engine=engine)
+
+
+def _tree_depth(left, right, root):
+	# Level by level from the root (leaves are the nodes with no children, -1).
+	depth, frontier = 0, np.array([root])
+	while True:
+		frontier = frontier[left[frontier] >= 0]
+		if len(frontier) == 0:
+			return depth
+		frontier = np.concatenate([left[frontier], right[frontier]])
+		depth += 1
+
+
+def _flatten(trees):
+	"""
+	:param trees: list of (feature, threshold, left, right, default_left, value) per tree, with the nodes numbered
+	from 0 in every tree and -1 children for leaves.
+	:return: dict of the CompiledTreeEnsemble arrays.
+	"""
+	features, thresholds, lefts, rights, default_lefts, values, roots = [], [], [], [], [], [], []
+	offset, max_depth = 0, 0
+	for feature, threshold, left, right, default_left, value in trees:
+		nodes = np.arange(len(left))
+		is_leaf = left < 0
+		max_depth = max(max_depth, _tree_depth(left, right, 0))
+		features.append(np.where(is_leaf, 0, feature))
+		thresholds.append(np.where(is_leaf, np.inf, threshold))
+		lefts.append(np.where(is_leaf, nodes, left) + offset)
+		rights.append(np.where(is_leaf, nodes, right) + offset)
+		default_lefts.append(default_left)
+		values.append(value)
+		roots.append(offset)
+		offset += len(left)
+	return {'feature': np.concatenate(features).astype(np.intp),
+			'threshold': np.concatenate(thresholds).astype(np.float64),
+			'left': np.concatenate(lefts).astype(np.intp),
+			'right': np.concatenate(rights).astype(np.intp),
+			'default_left': np.concatenate(default_lefts).astype(bool),
+			'value': np.concatenate(values),
+			'roots': np.array(roots, dtype=np.intp),
+			'max_depth': max_depth}
+
+
+def compile_forest(model):
+	"""
+	:param model: fitted RandomForestClassifier (single output).
+	:return: CompiledTreeEnsemble.
+	"""
+	trees = []
+	for estimator in model.estimators_:
+		tree = estimator.tree_
+		if tree.n_outputs != 1:
+			raise Exception("Compile Error: Multi-output forests are not supported.")
+		# The class probabilities of every node, normalized as DecisionTreeClassifier.predict_proba does.
+		value = tree.value[:, 0, :model.n_classes_].copy()
+		normalizer = value.sum(axis=1)[:, None]
+		normalizer[normalizer == 0.0] = 1.0
+		value /= normalizer
+		trees.append((tree.feature, tree.threshold, tree.children_left, tree.children_right,
+					  np.zeros(tree.node_count, dtype=bool), value))
+	return CompiledTreeEnsemble(classes=np.asarray(model.classes_), link='mean', **_flatten(trees))
+
+
+def compile_xgboost(model):
+	"""
+	:param model: fitted binary XGBClassifier (or any model with get_booster and classes_, like
+	booster.BoosterClassifier). The trees up to its best_iteration (early stopping) are compiled.
+	:return: CompiledTreeEnsemble.
+	"""
+	booster_json = json.loads(model.get_booster().save_raw('json'))['learner']
+	if booster_json['objective']['name'] != 'binary:logistic' or booster_json['gradient_booster']['name'] != 'gbtree':
+		raise Exception("Compile Error: Only binary:logistic gbtree models are supported, got {} {}.".format(
+			booster_json['objective']['name'], booster_json['gradient_booster']['name']))
+	gbtree = booster_json['gradient_booster']['model']
+	trees_json = gbtree['trees']
+	best_iteration = getattr(model, 'best_iteration', None)
+	if best_iteration is not None:
+		trees_json = trees_json[:(best_iteration + 1) * int(gbtree['gbtree_model_param']['num_parallel_tree'])]
+
+	trees = []
+	for tree in trees_json:
+		if tree['categories_nodes']:
+			raise Exception("Compile Error: Categorical splits are not supported.")
+		left = np.array(tree['left_children'])
+		# xgboost goes left if feature < threshold (float32) - the same as <= the previous float32.
+		conditions = np.array(tree['split_conditions'], dtype=np.float32)
+		threshold = np.nextafter(conditions, np.float32(-np.inf))
+		# The leaves keep their value in split_conditions.
+		value = np.where(left < 0, conditions, np.float32(0))[:, None]
+		trees.append((np.array(tree['split_indices']), threshold, left, np.array(tree['right_children']),
+					  np.array(tree['default_left'], dtype=bool), value))
+
+	# base_score is a probability, the trees are summed from its margin.
+	base_score = np.float32(float(booster_json['learner_model_param']['base_score']))
+	base_margin = -np.log(np.float32(1) / base_score - np.float32(1))
+	# The values equal to the model's missing param take the default branch, as NaN does.
+	missing = getattr(model, 'missing', None)
+	missing = np.nan if missing is None else float(missing)
+	return CompiledTreeEnsemble(classes=np.asarray(model.classes_), link='logistic', base_margin=base_margin,
+								missing=missing, **_flatten(trees))
+
+
+def compile_model(model, engine='auto'):
+	"""
+	:param model: fitted RandomForestClassifier or binary XGBoost model.
+	:param engine: string. see CompiledTreeEnsemble.
+	:return: CompiledTreeEnsemble.
+	"""
+	if hasattr(model, 'get_booster'):
+		compiled = compile_xgboost(model)
+	elif hasattr(model, 'estimators_') and hasattr(model.estimators_[0], 'tree_'):
+		compiled = compile_forest(model)
+	else:
+		raise Exception("Compile Error: {} is not a tree ensemble.".format(type(model).__name__))
+	compiled.engine = engine if engine != 'auto' else compiled.engine
+	return compiled
@@ -0,0 +1,166 @@
+"""
+All rights reserved to cnvrg.io
+     http://www.cnvrg.io
+
+cnvrg.io - AI library
+
+data_cache.py
+==============================================================================
+Content-addressed on-disk cache of the processed data sets and their splits, shared by the runs.
+An entry is keyed by the sha256 of the input file and the params of the step (see cache_key), and is a directory of
+.npy arrays (+ entry.json), loaded memory-mapped. The least recently used entries are evicted when the cache grows
+over its size limit.
+"""
+import os
+import json
+import shutil
+import hashlib
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+entry_meta_name = 'entry.json'
+hashes_name = 'hashes.json'
+
+
+def _directory_size(path):
+	return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names)
+
+
+def cache_key(*parts):
+	"""
+	:param parts: json-serializable values (ex: the hash of the input file, the name of the step and its params).
+	:return: string. sha256 of the parts.
+	"""
+	return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode()).hexdigest()
+
+
+class DataCache:
+	"""
+	A cache directory. get and put are safe across processes - an entry is written to a temporary directory and
+	renamed into place, and the memory-mapped arrays of an evicted entry stay readable until they are closed.
+	"""
+	def __init__(self, directory, max_size_mb=1024):
+		"""
+		:param directory: string. the cache directory (created if it doesn't exist).
+		:param max_size_mb: float. size limit of the entries. The least recently used ones are evicted above it.
+		"""
+		self.directory = directory
+		self.max_size = max_size_mb * 2 ** 20
+		if not os.path.exists(directory):
+			os.makedirs(directory)
+
+	def _entry_path(self, key):
+		return os.path.join(self.directory, key)
+
+	def _entries(self):
+		# The temporary directories of put start with a dot.
+		return [name for name in os.listdir(self.directory)
+				if not name.startswith('.') and os.path.isfile(os.path.join(self.directory, name, entry_meta_name))]
+
+	def file_hash(self, path):
+		"""
+		The sha256 of a file. The hashes are remembered by (path, size, mtime), so an unchanged file is read only once.
+		:param path: string.
+		:return: string.
+		"""
+		stat = os.stat(path)
+		hashes_path = os.path.join(self.directory, hashes_name)
+		hashes = {}
+		if os.path.exists(hashes_path):
+			with open(hashes_path) as f:
+				hashes = json.load(f)
+		size, mtime, digest = hashes.get(os.path.abspath(path), (None, None, None))
+		if size == stat.st_size and mtime == stat.st_mtime_ns:
+			return digest
+
+		sha = hashlib.sha256()
+		with open(path, 'rb') as f:
+			for block in iter(lambda: f.read(2 ** 20), b''):
+				sha.update(block)
+		digest = sha.hexdigest()
+		hashes[os.path.abspath(path)] = (stat.st_size, stat.st_mtime_ns, digest)
+		fd, temp_path = tempfile.mkstemp(dir=self.directory, prefix='.')
+		with os.fdopen(fd, 'w') as f:
+			json.dump(hashes, f)
+		os.replace(temp_path, hashes_path)
+		return digest
+
+	def get(self, key):
+		"""
+		:param key: string. see cache_key.
+		:return: (arrays, meta) - dict of read-only memory-mapped arrays and the dict given to put, or None if the key
+		isn't cached.
+		"""
+		path = self._entry_path(key)
+		try:
+			with open(os.path.join(path, entry_meta_name)) as f:
+				entry = json.load(f)
+			arrays = {name: np.load(os.path.join(path, name + '.npy'), mmap_mode='r', allow_pickle=False)
+					  for name in entry['arrays']}
+			# The mtime of entry.json is the last use of the entry (see evict).
+			os.utime(os.path.join(path, entry_meta_name))
+		except (IOError, OSError, ValueError):
+			# Not cached, or evicted while it was read.
+			return None
+		return arrays, entry['meta']
+
+	def put(self, key, arrays, meta=None):
+		"""
+		:param key: string. see cache_key.
+		:param arrays: dict of numeric arrays.
+		:param meta: dict or None. json-serializable values kept with the arrays.
+		"""
+		for name, array in arrays.items():
+			if np.asarray(array).dtype.kind == 'O':
+				raise Exception("Cache Error: {} is an object array, only numeric arrays are cached.".format(name))
+
+		temp_path = tempfile.mkdtemp(dir=self.directory, prefix='.')
+		try:
+			for name, array in arrays.items():
+				np.save(os.path.join(temp_path, name + '.npy'), np.ascontiguousarray(array), allow_pickle=False)
+			with open(os.path.join(temp_path, entry_meta_name), 'w') as f:
+				json.dump({'arrays': list(arrays), 'meta': meta or {}}, f)
+			os.rename(temp_path, self._entry_path(key))
+		except OSError:
+			# The same entry was written meanwhile (by a concurrent run).
+			shutil.rmtree(temp_path, ignore_errors=True)
+		self.evict()
+
+	def evict(self):
+		"""
+		Removes the least recently used entries until the cache is within its size limit.
+		"""
+		entries = []
+		for key in self._entries():
+			path = self._entry_path(key)
+			try:
+				entries.append((os.path.getmtime(os.path.join(path, entry_meta_name)), _directory_size(path), path))
+			except OSError:
+				# Evicted by a concurrent run.
+				continue
+		total_size = sum(size for _, size, _ in entries)
+		for _, size, path in sorted(entries):
+			if total_size <= self.max_size:
+				break
+			shutil.rmtree(path, ignore_errors=True)
+			total_size -= size
+
+	def get_frame(self, key):
+		"""
+		:return: (data frame, meta) or None. see put_frame.
+		"""
+		cached = self.get(key)
+		if cached is None:
+			return None
+		arrays, meta = cached
+		columns = meta.pop('columns')
+		return pd.DataFrame({col: arrays['col_{}'.format(ind)] for ind, col in enumerate(columns)}), meta
+
+	def put_frame(self, key, data, meta=None):
+		"""
+		Caches a numeric data frame, a .npy array per column (so the columns keep their dtypes).
+		"""
+		arrays = {'col_{}'.format(ind): data[col].to_numpy() for ind, col in enumerate(data.columns)}
+		self.put(key, arrays, meta=dict(meta or {}, columns=list(data.columns)))
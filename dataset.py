@@ -0,0 +1,234 @@
+"""
+All rights reserved to cnvrg.io
+     http://www.cnvrg.io
+
+cnvrg.io - AI library
+
+dataset.py
+==============================================================================
+"""
+import os
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+# File extensions of the supported formats.
+parquet_extensions = ['.parquet', '.pq']
+feather_extensions = ['.feather', '.ftr', '.arrow']
+
+
+def get_format(path):
+	"""
+	:param path: string. path to a data set file.
+	:return: string. 'parquet', 'feather' or 'csv' (by the file extension).
+	"""
+	extension = os.path.splitext(path)[1].lower()
+	if extension in parquet_extensions:
+		return 'parquet'
+	if extension in feather_extensions:
+		return 'feather'
+	return 'csv'
+
+
+# ------------- dtype schema --------------------
+# Prefixes of the one-hot columns written by preprocess.py.
+one_hot_prefixes = ('term_', 'grade_', 'home_ownership_', 'verification_status_')
+
+# Small integer columns written by preprocess.py (sub_grade: 1-5, emp_length: 0-10, is_bad: 0/1).
+small_int_columns = ['sub_grade', 'emp_length', 'is_bad']
+
+
+def get_schema(columns):
+	"""
+	The compact dtypes of the processed data set - uint8 for the one-hot and the small integer columns, float32 for
+	the rest of the features. The last column, if it is not a known one, is assumed to be the labels and is kept.
+	:param columns: list of strings. the columns of the data set.
+	:return: dict. {column: dtype}
+	"""
+	schema = {}
+	for ind, col in enumerate(columns):
+		if col.startswith(one_hot_prefixes) or col in small_int_columns:
+			schema[col] = np.uint8
+		elif ind < len(columns) - 1:
+			schema[col] = np.float32
+	return schema
+
+
+def compact_dtypes(data, report=False):
+	"""
+	Casts the data set to the dtypes of get_schema.
+	:param data: data frame. processed data set.
+	:param report: boolean. If True, prints the memory before and after the casting.
+	:return: the same data frame, with compact dtypes.
+	"""
+	before = data.memory_usage(index=False).sum()
+	data = data.astype(get_schema(list(data.columns)), copy=False)
+	if report:
+		after = data.memory_usage(index=False).sum()
+		print("Compact dtypes: {:.2f} MB -> {:.2f} MB (saved {:.2f} MB, {:.1f}%)".format(
+			before / 2 ** 20, after / 2 ** 20, (before - after) / 2 ** 20, 100. * (before - after) / max(before, 1)))
+	return data
+
+
+def to_feature_array(X):
+	"""
+	:param X: data frame. the features.
+	:return: C-contiguous float32 array - the dtype and layout sklearn's tree models and xgboost use internally, so
+	they don't copy it again.
+	"""
+	return np.ascontiguousarray(X.to_numpy(dtype=np.float32))
+
+
+def split_features_labels(data):
+	"""
+	:param data: data frame. processed data set, the last column includes the labels.
+	:return: (X, y) - C-contiguous float32 array of the features and an array of the labels.
+	"""
+	return to_feature_array(data.iloc[:, :-1]), data.iloc[:, -1].to_numpy()
+
+
+def to_memmap(X, directory, name='X_train'):
+	"""
+	Writes X once to a .npy file on local disk and reopens it as a read-only memory-mapped array, so all the
+	cross-validation folds (and fold workers in other processes) read the same physical copy via the page cache.
+	The file has a unique name (runs sharing the directory don't overwrite each other's files) and is removed by
+	remove_memmap.
+	:param X: array. the features.
+	:param directory: string. local directory for the .npy file.
+	:param name: string. prefix of the name of the .npy file.
+	:return: numpy.memmap (its filename attribute is the path of the .npy file).
+	"""
+	if not os.path.exists(directory):
+		os.makedirs(directory)
+	with tempfile.NamedTemporaryFile(dir=directory, prefix=name + '_', suffix='.npy', delete=False) as f:
+		np.save(f, np.ascontiguousarray(X))
+	return np.load(f.name, mmap_mode='r')
+
+
+def remove_memmap(X):
+	"""
+	Removes the .npy file of an array written by to_memmap (the open maps stay readable until they are closed).
+	:param X: numpy.memmap returned by to_memmap.
+	"""
+	if isinstance(X, np.memmap) and X.filename is not None and os.path.exists(X.filename):
+		os.remove(X.filename)
+
+
+def take_rows(X, index):
+	"""
+	:param X: array (or memory-mapped array).
+	:param index: array of sorted row indices.
+	:return: a view of X if the indices are one contiguous range (e.g. a KFold validation fold), otherwise a copy of
+	the gathered rows.
+	"""
+	if len(index) > 0 and index[-1] - index[0] == len(index) - 1:
+		return X[index[0]:index[-1] + 1]
+	return X[index]
+
+
+def read_dataset(path, report=True):
+	"""
+	Reads a processed data set - csv, parquet or feather (detected by the file extension), drops the index columns
+	written by pandas ('Unnamed: ...') and casts to compact dtypes.
+	:param path: string. path to the data set file.
+	:param report: boolean. see compact_dtypes.
+	:return: data frame.
+	"""
+	file_format = get_format(path)
+	if file_format == 'parquet':
+		data = pd.read_parquet(path)
+	elif file_format == 'feather':
+		data = pd.read_feather(path)
+	else:
+		data = pd.read_csv(path)
+
+	data = data.drop(columns=[col for col in data.columns if col.startswith('Unnamed')])
+	return compact_dtypes(data, report=report)
+
+
+def iter_dataset(path, chunksize):
+	"""
+	Streams a data set (raw or processed) - csv, parquet or feather - in chunks, without loading it to memory.
+	:param path: string. path to the data set file.
+	:param chunksize: int. number of rows per chunk.
+	:return: generator of data frames, indexed by their row numbers in the file.
+	"""
+	file_format = get_format(path)
+	if file_format == 'csv':
+		for chunk in pd.read_csv(path, chunksize=chunksize):
+			yield chunk
+		return
+
+	import pyarrow as pa
+	if file_format == 'parquet':
+		import pyarrow.parquet as pq
+		batches = pq.ParquetFile(path).iter_batches(batch_size=chunksize)
+	else:
+		reader = pa.ipc.open_file(pa.memory_map(path, 'r'))
+		batches = (reader.get_batch(ind) for ind in range(reader.num_record_batches))
+
+	start = 0
+	for batch in batches:
+		# Record batches of a feather file may be larger than chunksize.
+		for offset in range(0, batch.num_rows, chunksize):
+			chunk = batch.slice(offset, chunksize).to_pandas()
+			chunk.index = pd.RangeIndex(start, start + len(chunk))
+			start += len(chunk)
+			yield chunk
+
+
+def write_dataset(data, path):
+	"""
+	Writes a processed data set - csv, parquet or feather (detected by the file extension).
+	:param data: data frame. processed data set.
+	:param path: string. path to the output file.
+	"""
+	file_format = get_format(path)
+	if file_format == 'parquet':
+		compact_dtypes(data, report=True).to_parquet(path, index=False)
+	elif file_format == 'feather':
+		compact_dtypes(data, report=True).reset_index(drop=True).to_feather(path)
+	else:
+		data.to_csv(path)
+
+
+class DatasetWriter:
+	"""
+	Appends chunks of a processed data set to a single csv, parquet or feather file (streaming mode of preprocess.py).
+	"""
+	def __init__(self, path):
+		"""
+		:param path: string. path to the output file. The format is detected by the file extension.
+		"""
+		self.path = path
+		self.file_format = get_format(path)
+		self._writer = None
+		self._header = True
+		if os.path.exists(path):
+			os.remove(path)
+
+	def write(self, chunk):
+		"""
+		:param chunk: data frame. a processed chunk.
+		"""
+		if self.file_format == 'csv':
+			chunk.to_csv(self.path, mode='a', header=self._header)
+			self._header = False
+			return
+
+		import pyarrow as pa
+		table = pa.Table.from_pandas(compact_dtypes(chunk), preserve_index=False)
+		if self._writer is None:
+			if self.file_format == 'parquet':
+				import pyarrow.parquet as pq
+				self._writer = pq.ParquetWriter(self.path, table.schema)
+			else:
+				self._writer = pa.ipc.new_file(self.path, table.schema,
+												 options=pa.ipc.IpcWriteOptions(compression='lz4'))
+		self._writer.write_table(table)
+
+	def close(self):
+		if self._writer is not None:
+			self._writer.close()
+			self._writer = None
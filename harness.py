@@ -0,0 +1,431 @@
+"""
+All rights reserved to cnvrg.io
+     http://www.cnvrg.io
+
+cnvrg.io - AI library
+
+harness.py
+==============================================================================
+Shared training harness of the model scripts (knn.py, random_forest.py, xgb.py).
+A model script defines its own params and a factory - build_model(args) - and calls run(args, build_model).
+"""
+import numpy as np
+from cnvrg import Experiment
+from sklearn.metrics import accuracy_score, mean_squared_error
+from sklearn.model_selection import train_test_split, KFold
+
+from artifact import save_artifact, update_manifest, is_artifact, prepare_artifact_path
+from data_cache import DataCache, cache_key
+from dataset import read_dataset, split_features_labels, to_memmap, remove_memmap, take_rows
+from parallel_cv import cross_validate_in_parallel
+from profiling import stage, add_profile_args, cast_profile_args, start_from_args, finish_from_args
+
+import warnings
+warnings.filterwarnings(action="ignore", category=RuntimeWarning)
+warnings.filterwarnings(action='ignore', category=DeprecationWarning)
+
+
+def add_common_args(parser, output_model):
+	"""
+	Adds the params shared by all the model scripts.
+	:param parser: argparse.ArgumentParser object.
+	:param output_model: string. default name of the output model file.
+	:return: argparse.ArgumentParser object.
+	"""
+	# ----- cnvrg.io params.
+	parser.add_argument('--data', action='store', dest='data', required=True,
+						help="""String. path to csv, parquet or feather file: The data set for the classifier. Assumes the last column includes the labels. """)
+
+	parser.add_argument('--project_dir', action='store', dest='project_dir',
+						help="""--- For inner use of cnvrg.io ---""")
+
+	parser.add_argument('--output_dir', action='store', dest='output_dir',
+						help="""--- For inner use of cnvrg.io ---""")
+
+	parser.add_argument('--x_val', action='store', default="None", dest='x_val',
+						help="""Integer. Number of folds for the cross-validation. Default is None.""")
+
+	parser.add_argument('--test_size', action='store', default="0.2", dest='test_size',
+						help="""Float. The portion of the data of testing. Default is 0.2""")
+
+	parser.add_argument('--output_model', action='store', default=output_model, dest='output_model',
+						help="""String. The name of the output file which is the trained model. Default is {}""".format(output_model))
+
+	parser.add_argument('--train_eval_size', action='store', default="None", dest='train_eval_size',
+						help="""Float. (without --x_val) The training accuracy and loss are computed over a stratified
+						sample of this many rows (1 or more, ex: 1e5) or this fraction of the training set (below 1),
+						and logged with their 95%% confidence intervals. 0 skips them. Default is None (the whole
+						training set).""")
+
+	parser.add_argument('--memmap_dir', action='store', default=None, dest='memmap_dir',
+						help="""String. Local directory. If given (with --x_val), the training set is written there once
+						as a memory-mapped .npy file which all the cross-validation folds read from. Default is None.""")
+
+	parser.add_argument('--cache_dir', action='store', default=None, dest='cache_dir',
+						help="""String. Local directory of the data cache (data_cache.py). If given, the loaded data set
+						and its train/test split are cached there by the hash of --data and --test_size, so the next
+						runs over the same file skip the loading and reuse the same split. Default is None.""")
+
+	parser.add_argument('--cache_size_mb', action='store', default="1024", dest='cache_size_mb',
+						help="""Float. Size limit of --cache_dir, the least recently used entries are evicted above it.
+						Default is 1024.""")
+
+	parser.add_argument('--cv_workers', action='store', default="None", dest='cv_workers',
+						help="""Integer. Number of processes running the cross-validation folds in parallel (a clone of
+						the model per fold). The n_jobs of every fold is limited so that all the workers together use
+						no more threads than cores. Default is None (serial folds).""")
+
+	add_profile_args(parser)
+	return parser
+
+
+def _cast_common_types(args):
+	"""
+	This method performs casting to the inputs added by add_common_args.
+	:param args: argparse.ArgumentParser object.
+	:return: argparse.ArgumentParser object.
+	"""
+	# x_val.
+	if args.x_val != 'None':
+		args.x_val = int(args.x_val)
+	else:
+		args.x_val = None
+
+	# cv_workers.
+	if args.cv_workers == "None" or args.cv_workers == 'None':
+		args.cv_workers = None
+	else:
+		args.cv_workers = int(args.cv_workers)
+
+	# train_eval_size.
+	if args.train_eval_size == "None" or args.train_eval_size == 'None':
+		args.train_eval_size = None
+	else:
+		# A number of rows from 1 up (ex: 1e5), a fraction of the training set below it (0 skips).
+		args.train_eval_size = float(args.train_eval_size)
+		if args.train_eval_size >= 1 or args.train_eval_size == 0:
+			args.train_eval_size = int(args.train_eval_size)
+
+	# test_size
+	args.test_size = float(args.test_size)
+
+	# cache_size_mb.
+	args.cache_size_mb = float(args.cache_size_mb)
+
+	# profile, profile_memory.
+	args = cast_profile_args(args)
+	return args
+
+
+def load_dataset(path, return_schema=False):
+	"""
+	Loads the processed data set and checks its size.
+	:param path: string. path to csv, parquet or feather file.
+	:param return_schema: boolean. If True, the feature schema - [column, dtype] per feature - is returned too.
+	:return: (X, y) - see dataset.split_features_labels (+ the feature schema).
+	"""
+	data = read_dataset(path)
+
+	# Checking data sets sizes.
+	rows_num, cols_num = data.shape
+	if rows_num == 0:
+		raise Exception("Dataset Error: The given dataset has no examples.")
+	if cols_num < 2:
+		raise Exception("Dataset Error: Not enough columns.")
+
+	X, y = split_features_labels(data)
+	if return_schema:
+		return X, y, [[col, str(data[col].dtype)] for col in data.columns[:-1]]
+	return X, y
+
+
+def load_split(path, test_size, cache_dir=None, cache_size_mb=1024):
+	"""
+	Loads the processed data set and splits it to train and test sets - from the data cache if it has them.
+	Without a cache, every call draws a new split (as train_test_split does); with a cache, the split of a data set
+	file and test_size is drawn once and reused.
+	:param path: string. path to csv, parquet or feather file.
+	:param test_size: float. the portion of the data for testing.
+	:param cache_dir: string or None. the data cache directory (see data_cache.py).
+	:param cache_size_mb: float. size limit of the cache.
+	:return: (X_train, X_test, y_train, y_test, feature_schema) - see load_dataset.
+	"""
+	if cache_dir is None:
+		with stage('read_dataset'):
+			X, y, feature_schema = load_dataset(path, return_schema=True)
+		with stage('split'):
+			X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=test_size)
+		return X_train, X_test, y_train, y_test, feature_schema
+
+	cache = DataCache(cache_dir, max_size_mb=cache_size_mb)
+	data_hash = cache.file_hash(path)
+	data_key = cache_key(data_hash, 'dataset')
+	cached = cache.get(data_key)
+	if cached is None:
+		with stage('read_dataset'):
+			X, y, feature_schema = load_dataset(path, return_schema=True)
+		with stage('cache_put'):
+			cache.put(data_key, {'X': X, 'y': y}, meta={'feature_schema': feature_schema})
+	else:
+		arrays, meta = cached
+		X, y, feature_schema = arrays['X'], arrays['y'], meta['feature_schema']
+
+	split_key = cache_key(data_hash, 'split', test_size, len(y))
+	cached = cache.get(split_key)
+	if cached is None:
+		train_index, test_index = train_test_split(np.arange(len(y)), test_size=test_size)
+		cache.put(split_key, {'train_index': train_index, 'test_index': test_index})
+	else:
+		train_index, test_index = cached[0]['train_index'], cached[0]['test_index']
+	# The rows are gathered into memory - the arrays of the cache are read-only memory maps.
+	with stage('split'):
+		return X[train_index], X[test_index], y[train_index], y[test_index], feature_schema
+
+
+def get_model_path(project_dir, output_model_name):
+	return project_dir + "/" + output_model_name if project_dir is not None else output_model_name
+
+
+def save_model(model, project_dir, output_model_name, metrics=None):
+	"""
+	Saves the model as an artifact directory (see artifact.py) named output_model_name.
+	:param metrics: dict or None. the metrics of the model, kept in the manifest.
+	:return: string. path of the artifact.
+	"""
+	output_file_name = get_model_path(project_dir, output_model_name)
+	with stage('save_model'):
+		save_artifact(model, output_file_name, metrics=metrics)
+	return output_file_name
+
+
+def sample_training_set(y_train, sample_size, random_state=0):
+	"""
+	:param y_train: array. the labels of the training set.
+	:param sample_size: int, float or None. number of rows (int), fraction of the training set (float), 0 - no rows,
+	None - all the rows.
+	:param random_state: int. seed of the sample.
+	:return: array or None. the (sorted) row indices of a sample stratified by the labels, None means all the rows.
+	"""
+	rows_num = len(y_train)
+	if sample_size is None:
+		return None
+	if isinstance(sample_size, float):
+		sample_size = int(round(sample_size * rows_num))
+	if sample_size >= rows_num:
+		return None
+	if sample_size <= 0:
+		return np.array([], dtype=int)
+	try:
+		index, _ = train_test_split(np.arange(rows_num), train_size=sample_size, stratify=y_train,
+									random_state=random_state)
+	except ValueError:
+		# Classes too small to stratify (or a sample smaller than the number of classes) - a plain random sample.
+		index = np.random.RandomState(random_state).choice(rows_num, sample_size, replace=False)
+	return np.sort(index)
+
+
+def mean_confidence_interval(values, population_size, z=1.96):
+	"""
+	Normal approximation of the confidence interval of a mean over a sample without replacement (with the finite
+	population correction, so the interval of the whole population has no width).
+	:param values: array. the per-row values of the sample.
+	:param population_size: int. number of rows the sample was drawn from.
+	:param z: float. the normal quantile of the confidence level. Default is 1.96 (95%).
+	:return: (low, high).
+	"""
+	rows_num = len(values)
+	mean = float(np.mean(values))
+	correction = (population_size - rows_num) / (population_size - 1) if population_size > 1 else 0.
+	margin = z * np.std(values, ddof=1 if rows_num > 1 else 0) / np.sqrt(rows_num) * np.sqrt(correction)
+	return mean - margin, mean + margin
+
+
+def training_metrics(model, X_train, y_train, sample_size=None, take=take_rows):
+	"""
+	The training accuracy and loss, over the whole training set or a stratified sample of it.
+	:param model: fitted model.
+	:param X_train: the features the model predicts.
+	:param y_train: array. the labels.
+	:param sample_size: see sample_training_set.
+	:param take: callable. (X_train, index) -> the rows of X_train the model predicts. Default is dataset.take_rows.
+	:return: dict. train_acc, train_loss, their confidence intervals and the number of rows (empty if sample_size is
+	0).
+	"""
+	index = sample_training_set(y_train, sample_size)
+	if index is not None and len(index) == 0:
+		return {}
+	with stage('predict_train'):
+		if index is None:
+			y_sample, y_hat = y_train, model.predict(X_train)  # y_hat is a.k.a y_pred
+		else:
+			y_sample, y_hat = take_rows(y_train, index), model.predict(take(X_train, index))
+
+	correct = (np.asarray(y_sample) == np.asarray(y_hat)).astype(float)
+	squared_errors = (np.asarray(y_sample, dtype=float) - np.asarray(y_hat, dtype=float)) ** 2
+	metrics = {'train_acc': accuracy_score(y_sample, y_hat),
+			   'train_loss': mean_squared_error(y_sample, y_hat)}
+	if index is not None:
+		metrics['train_eval_rows'] = len(index)
+		acc_low, acc_high = mean_confidence_interval(correct, len(y_train))
+		loss_low, loss_high = mean_confidence_interval(squared_errors, len(y_train))
+		metrics['train_acc_ci_low'], metrics['train_acc_ci_high'] = max(acc_low, 0.), min(acc_high, 1.)
+		metrics['train_loss_ci_low'], metrics['train_loss_ci_high'] = max(loss_low, 0.), loss_high
+	return metrics
+
+
+def log_training_metrics(exp, metrics):
+	"""
+	:param exp: cnvrg.Experiment.
+	:param metrics: dict. see training_metrics.
+	"""
+	for name, value in metrics.items():
+		exp.log_param(name, value)
+
+
+def train_with_cross_validation(model, train_set, test_set, folds, project_dir, output_model_name, workers=None):
+	train_acc, train_loss = [], []
+	kf = KFold(n_splits=folds)
+	X, y = train_set
+	# --- Training.
+	if workers is not None and workers > 1:
+		with stage('cross_validation'):
+			train_acc, train_loss, model = cross_validate_in_parallel(model, X, y, folds, workers)
+	else:
+		for train_index, val_index in kf.split(X):
+			with stage('fold_copy'):
+				X_train, X_val = take_rows(X, train_index), take_rows(X, val_index)
+				y_train, y_val = take_rows(y, train_index), take_rows(y, val_index)
+			with stage('fit'):
+				model.fit(X_train, y_train)
+			if hasattr(model, 'n_estimators'):
+				model.n_estimators += 1
+			with stage('predict_val'):
+				y_hat = model.predict(X_val)  # y_hat is a.k.a y_pred
+			acc = accuracy_score(y_val, y_hat)
+			loss = mean_squared_error(y_val, y_hat)
+
+			train_acc.append(acc)
+			train_loss.append(loss)
+	# --- Testing.
+	X_test, y_test = test_set
+	with stage('predict_test'):
+		y_pred = model.predict(X_test)
+	test_acc = accuracy_score(y_test, y_pred)
+	test_loss = mean_squared_error(y_test, y_pred)
+
+	exp = Experiment()
+	exp.log_param("model", output_model_name)
+	exp.log_param("folds", folds)
+	exp.log_metric("train_acc", train_acc)
+	exp.log_metric("train_loss", train_loss)
+	exp.log_param("test_acc", test_acc)
+	exp.log_param("test_loss", test_loss)
+
+	# Save model.
+	save_model(model, project_dir, output_model_name,
+			   metrics={'folds': folds, 'train_acc': train_acc, 'train_loss': train_loss, 'test_acc': test_acc,
+						'test_loss': test_loss})
+	return model
+
+
+def train_without_cross_validation(model, train_set, test_set, project_dir, output_model_name, train_eval_size=None):
+	X_train, y_train = train_set
+	# --- Training.
+	with stage('fit'):
+		model.fit(X_train, y_train)
+	train_metrics = training_metrics(model, X_train, y_train, train_eval_size)
+	# --- Testing.
+	X_test, y_test = test_set
+	with stage('predict_test'):
+		y_pred = model.predict(X_test)
+	test_acc = accuracy_score(y_test, y_pred)
+	test_loss = mean_squared_error(y_test, y_pred)
+
+	exp = Experiment()
+	exp.log_param("model", output_model_name)
+	log_training_metrics(exp, train_metrics)
+	exp.log_param("test_acc", test_acc)
+	exp.log_param("test_loss", test_loss)
+
+	# Save model.
+	save_model(model, project_dir, output_model_name,
+			   metrics=dict(train_metrics, test_acc=test_acc, test_loss=test_loss))
+	return model
+
+
+def run(args, build_model, cross_validation=None, train=None):
+	"""
+	The flow of all the model scripts - loading the data set, splitting it, building the model and training it
+	(with or without cross validation).
+	:param args: argparse.ArgumentParser object (common params + the model's params, already cast).
+	:param build_model: callable. args -> sklearn-like estimator (not fitted).
+	:param cross_validation: callable or None. A model specific replacement of train_with_cross_validation (same
+	params). Default is None (train_with_cross_validation).
+	:param train: callable or None. A model specific replacement of train_without_cross_validation (same params,
+	including train_eval_size, and it returns the fitted model too).
+	Default is None (train_without_cross_validation).
+	:return: the fitted model (returned by the training hook - every hook returns the model it saved).
+	"""
+	if cross_validation is None:
+		cross_validation = train_with_cross_validation
+	if train is None:
+		train = train_without_cross_validation
+
+	args = _cast_common_types(args)
+
+	# Profiling of the stages (--profile) - reported even if the training fails. The experiment is created first, so
+	# a failure to create it can't hide the error of the training.
+	exp = Experiment() if args.profile else None
+	start_from_args(args)
+	try:
+		return _run(args, build_model, cross_validation, train)
+	finally:
+		finish_from_args(args, exp)
+
+
+def _run(args, build_model, cross_validation, train):
+	"""
+	The body of run (see run), between starting and reporting the profiler.
+	"""
+	# The output path is checked before the training, rather than failing after it.
+	prepare_artifact_path(get_model_path(args.project_dir, args.output_model))
+
+	# Loading dataset.
+	X_train, X_test, y_train, y_test, feature_schema = load_split(args.data, args.test_size, cache_dir=args.cache_dir,
+																   cache_size_mb=args.cache_size_mb)
+
+	# Memory-mapped training set - the cross-validation folds share a single copy of it.
+	if args.x_val is not None and args.memmap_dir is not None:
+		with stage('to_memmap'):
+			X_train = to_memmap(X_train, args.memmap_dir)
+
+	# Model initialization.
+	model = build_model(args)
+
+	# Training with cross validation.
+	if args.x_val is not None:
+		try:
+			model = cross_validation(model=model,
+									 train_set=(X_train, y_train),
+									 test_set=(X_test, y_test),
+									 folds=args.x_val,
+									 project_dir=args.project_dir,
+									 output_model_name=args.output_model,
+									 workers=args.cv_workers)
+		finally:
+			remove_memmap(X_train)
+
+	# Training without cross validation.
+	else:
+		model = train(model=model,
+					  train_set=(X_train, y_train),
+					  test_set=(X_test, y_test),
+					  project_dir=args.project_dir,
+					  output_model_name=args.output_model,
+					  train_eval_size=args.train_eval_size)
+
+	# The saved artifact gets the feature schema of the data set (the training hooks see only arrays).
+	model_path = get_model_path(args.project_dir, args.output_model)
+	if is_artifact(model_path):
+		update_manifest(model_path, feature_schema=feature_schema, data=args.data)
+	return model
@@ -12,34 +12,30 @@ Updated by: Omer Liberman
 knn.py
 ==============================================================================
 """
-import pickle
+import time
 import argparse
-import pandas as pd
+import functools
+
 from cnvrg import Experiment
-from sklearn.metrics import accuracy_score, mean_squared_error
+from sklearn.neighbors import KNeighborsClassifier, NearestNeighbors
+
+from ann import IVFKNeighborsClassifier, neighbors_recall
+from batch_predict import BatchedKNeighborsClassifier
+from artifact import Artifact, is_artifact
+from harness import add_common_args, run, train_without_cross_validation, get_model_path
+from profiling import stage
+from knn_index import save_index
 
-from sklearn.neighbors import KNeighborsClassifier
-from sklearn.model_selection import train_test_split, KFold
+# --algorithm values served by the approximate indexes of ann.py (the rest are KNeighborsClassifier's).
+approximate_algorithms = ['ivf']
 
-import warnings
-warnings.filterwarnings(action="ignore", category=RuntimeWarning)
-warnings.filterwarnings(action='ignore', category=DeprecationWarning)
 
 def _cast_types(args):
 	"""
-	This method performs casting to all types of inputs passed via cmd.
+	This method performs casting to the model's params passed via cmd.
 	:param args: argparse.ArgumentParser object.
 	:return: argparse.ArgumentParser object.
 	"""
-	# x_val.
-	if args.x_val != 'None':
-		args.x_val = int(args.x_val)
-	else:
-		args.x_val = None
-
-	# test_size
-	args.test_size = float(args.test_size)
-
 	# n_neighbors.
 	args.n_neighbors = int(args.n_neighbors)
 
@@ -58,139 +54,129 @@ def _cast_types(args):
 		args.n_jobs = None
 	else:
 		args.n_jobs = int(args.n_jobs)
+
+	# n_lists.
+	if args.n_lists == "None" or args.n_lists == 'None':
+		args.n_lists = None
+	else:
+		args.n_lists = int(args.n_lists)
+
+	# n_probe.
+	args.n_probe = int(args.n_probe)
+
+	# recall_sample.
+	args.recall_sample = int(args.recall_sample)
+
+	# predict_memory_mb.
+	if args.predict_memory_mb == "None" or args.predict_memory_mb == 'None':
+		args.predict_memory_mb = None
+	else:
+		args.predict_memory_mb = float(args.predict_memory_mb)
+
+	# predict_workers.
+	if args.predict_workers == "None" or args.predict_workers == 'None':
+		args.predict_workers = None
+	else:
+		args.predict_workers = int(args.predict_workers)
 	#  --- ---------------------------------------- --- #
 	return args
 
 
-def train_with_cross_validation(model, train_set, test_set, folds, project_dir, output_model_name):
-	train_acc, train_loss = [], []
-	kf = KFold(n_splits=folds)
-	X, y = train_set
-	# --- Training.
-	for train_index, val_index in kf.split(X):
-		X_train, X_val = X.iloc[train_index, :], X.iloc[val_index, :]
-		y_train, y_val = y.iloc[train_index], y.iloc[val_index]
-		model.fit(X_train, y_train)
-		model.n_estimators += 1
-		y_hat = model.predict(X_val)  # y_hat is a.k.a y_pred
-		acc = accuracy_score(y_val, y_hat)
-		loss = mean_squared_error(y_val, y_hat)
-
-		train_acc.append(acc)
-		train_loss.append(loss)
-	# --- Testing.
-	X_test, y_test = test_set
-	y_pred = model.predict(X_test)
-	test_acc = accuracy_score(y_test, y_pred)
-	test_loss = mean_squared_error(y_test, y_pred)
+def build_model(args):
+	"""
+	:param args: argparse.ArgumentParser object (cast).
+	:return: KNeighborsClassifier, batch_predict.BatchedKNeighborsClassifier or ann.IVFKNeighborsClassifier (not
+	fitted).
+	"""
+	if args.algorithm == 'ivf':
+		return IVFKNeighborsClassifier(n_neighbors=args.n_neighbors,
+		                               weights=args.weights,
+		                               p=args.p,
+		                               n_lists=args.n_lists,
+		                               n_probe=args.n_probe)
+	if args.predict_memory_mb is not None:
+		return BatchedKNeighborsClassifier(n_neighbors=args.n_neighbors,
+		                                   weights=args.weights,
+		                                   algorithm=args.algorithm,
+		                                   leaf_size=args.leaf_size,
+		                                   p=args.p,
+		                                   metric=args.metric,
+		                                   metric_params=args.metric_params,
+		                                   n_jobs=args.n_jobs,
+		                                   memory_budget_mb=args.predict_memory_mb,
+		                                   predict_workers=args.predict_workers)
+	return KNeighborsClassifier(n_neighbors=args.n_neighbors,
+	                           weights=args.weights,
+	                           algorithm=args.algorithm,
+	                           leaf_size=args.leaf_size,
+	                           p=args.p,
+	                           metric=args.metric,
+	                           metric_params=args.metric_params,
+	                           n_jobs=args.n_jobs)
+
+
+def report_recall(model, train_set, test_set, sample_size):
+	"""
+	Compares a fitted approximate model to the exact (brute force) neighbors over a batch of test queries, and logs
+	the recall@n_neighbors and the latency of the batch of both.
+	:param model: fitted ann.IVFKNeighborsClassifier.
+	:param train_set: (X_train, y_train).
+	:param test_set: (X_test, y_test).
+	:param sample_size: int. number of test queries.
+	"""
+	X_train, _ = train_set
+	X_test, _ = test_set
+	queries = X_test[:sample_size]
 
-	exp = Experiment()
-	exp.log_param("model", output_model_name)
-	exp.log_param("folds", folds)
-	exp.log_metric("train_acc", train_acc)
-	exp.log_metric("train_loss", train_loss)
-	exp.log_param("test_acc", test_acc)
-	exp.log_param("test_loss", test_loss)
-
-	# Save model.
-	output_file_name = project_dir + "/" + output_model_name if project_dir is not None else output_model_name
-	pickle.dump(model, open(output_file_name, 'wb'))
-
-
-def train_without_cross_validation(model, train_set, test_set, project_dir, output_model_name):
-	X_train, y_train = train_set
-	# --- Training.
-	model.fit(X_train, y_train)
-	y_hat = model.predict(X_train)  # y_hat is a.k.a y_pred
-
-	train_acc = accuracy_score(y_train, y_hat)
-	train_loss = mean_squared_error(y_train, y_hat)
-	# --- Testing.
-	X_test, y_test = test_set
-	y_pred = model.predict(X_test)
-	test_acc = accuracy_score(y_test, y_pred)
-	test_loss = mean_squared_error(y_test, y_pred)
+	exact = NearestNeighbors(n_neighbors=model.n_neighbors, algorithm='brute', p=model.p).fit(X_train)
+	start = time.perf_counter()
+	exact_indices = exact.kneighbors(queries, return_distance=False)
+	exact_time = time.perf_counter() - start
+
+	start = time.perf_counter()
+	approx_indices = model.kneighbors(queries, return_distance=False)
+	approx_time = time.perf_counter() - start
 
 	exp = Experiment()
-	exp.log_param("model", output_model_name)
-	exp.log_param("train_acc", train_acc)
-	exp.log_param("train_loss", train_loss)
-	exp.log_param("test_acc", test_acc)
-	exp.log_param("test_loss", test_loss)
+	exp.log_param("recall_queries", len(queries))
+	exp.log_param("ann_recall", neighbors_recall(approx_indices, exact_indices))
+	exp.log_param("ann_batch_latency", approx_time)
+	exp.log_param("exact_batch_latency", exact_time)
 
-	# Save model.
-	output_file_name = project_dir + "/" + output_model_name if project_dir is not None else output_model_name
-	pickle.dump(model, open(output_file_name, 'wb'))
+
+def train_with_recall(model, train_set, test_set, project_dir, output_model_name, sample_size, train_eval_size=None):
+	"""
+	train_without_cross_validation of an approximate model, followed by report_recall.
+	"""
+	train_without_cross_validation(model=model,
+	                               train_set=train_set,
+	                               test_set=test_set,
+	                               project_dir=project_dir,
+	                               output_model_name=output_model_name,
+	                               train_eval_size=train_eval_size)
+	with stage('recall'):
+		report_recall(model, train_set, test_set, sample_size)
+	return model
 
 
 def main(args):
 	args = _cast_types(args)
 
-	# Loading dataset.
-	data = pd.read_csv(args.data)
-	for col in data.columns:
-		if col.startswith('Unnamed'):
-			data = data.drop(columns=col, axis=1)
-
-	# Checking data sets sizes.
-	rows_num, cols_num = data.shape
-	if rows_num == 0:
-		raise Exception("Dataset Error: The given dataset has no examples.")
-	if cols_num < 2:
-		raise Exception("Dataset Error: Not enough columns.")
-
-	X = data.iloc[:, :-1]
-	y = data.iloc[:, -1]
-	X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=args.test_size)
-
-	model = KNeighborsClassifier(n_neighbors=args.n_neighbors,
-	                             weights=args.weights,
-	                             algorithm=args.algorithm,
-	                             leaf_size=args.leaf_size,
-	                             p=args.p,
-	                             metric=args.metric,
-	                             metric_params=args.metric_params,
-	                             n_jobs=args.n_jobs)
-
-	# Training with cross validation.
-	if args.x_val is not None:
-		train_with_cross_validation(model=model,
-		                            train_set=(X_train, y_train),
-		                            test_set=(X_test, y_test),
-		                            folds=args.x_val,
-		                            project_dir=args.project_dir,
-		                            output_model_name=args.output_model)
-
-	# Training without cross validation.
-	else:
-		train_without_cross_validation(model=model,
-		                               train_set=(X_train, y_train),
-		                               test_set=(X_test, y_test),
-		                               project_dir=args.project_dir,
-		                               output_model_name=args.output_model)
+	train = None
+	if args.algorithm in approximate_algorithms:
+		train = functools.partial(train_with_recall, sample_size=args.recall_sample)
+	model = run(args, build_model, train=train)
 
+	# Memory-mappable index of the fitted model (see knn_index.load_index).
+	if args.index_dir is not None:
+		model_path = get_model_path(args.project_dir, args.output_model)
+		feature_columns = Artifact(model_path).feature_columns if is_artifact(model_path) else None
+		save_index(model, args.index_dir, feature_columns=feature_columns)
 
 
-if __name__ == '__main__':
+def build_parser():
 	parser = argparse.ArgumentParser(description="""K-Nearest-Neighbors Classifier""")
-	# ----- cnvrg.io params.
-	parser.add_argument('--data', action='store', dest='data', required=True,
-	                    help="""String. path to csv file: The data set for the classifier. Assumes the last column includes the labels. """)
-
-	parser.add_argument('--project_dir', action='store', dest='project_dir',
-	                    help="""--- For inner use of cnvrg.io ---""")
-
-	parser.add_argument('--output_dir', action='store', dest='output_dir',
-	                    help="""--- For inner use of cnvrg.io ---""")
-
-	parser.add_argument('--x_val', action='store', default="None", dest='x_val',
-	                    help="""Integer. Number of folds for the cross-validation. Default is None.""")
-
-	parser.add_argument('--test_size', action='store', default="0.2", dest='test_size',
-	                    help="""Float. The portion of the data of testing. Default is 0.2""")
-
-	parser.add_argument('--output_model', action='store', default="knn_model.sav", dest='output_model',
-	                    help="""String. The name of the output file which is a trained random forests model """)
+	add_common_args(parser, output_model="knn_model.sav")
 
 	# ----- model's params.
 	parser.add_argument('--n_neighbors', action='store', default="5", dest='n_neighbors',
@@ -208,6 +194,9 @@ if __name__ == '__main__':
                         ‘ball_tree’ will use BallTree
                         ‘kd_tree’ will use KDTree
                         ‘brute’ will use a brute-force search.
+                        ‘ivf’ will use an approximate inverted file index (ann.py) - the training set is clustered
+                        into --n_lists lists and a query searches only the --n_probe nearest ones. Euclidean/Minkowski
+                        only (--metric is ignored). The recall against the exact neighbors is reported.
                         ‘auto’ will attempt to decide the most appropriate algorithm based on the values passed to fit 
                         method.""")
 
@@ -233,6 +222,37 @@ if __name__ == '__main__':
 	parser.add_argument('--n_jobs', action='store', default="1", dest='n_jobs',
 	                    help=""": --- . Default is 1""")
 
-	args = parser.parse_args()
+	parser.add_argument('--n_lists', action='store', default="None", dest='n_lists',
+	                    help=""": (--algorithm ivf) Number of lists of the index. Default is None (square root of the
+                        number of training examples)""")
+
+	parser.add_argument('--n_probe', action='store', default="8", dest='n_probe',
+	                    help=""": (--algorithm ivf) Number of lists searched per query - higher recall, slower
+                        queries. Default is 8""")
+
+	parser.add_argument('--recall_sample', action='store', default="1000", dest='recall_sample',
+	                    help=""": (--algorithm ivf) Number of test examples the recall against the exact neighbors is
+                        measured on (without cross validation). Default is 1000""")
+
+	parser.add_argument('--predict_memory_mb', action='store', default="None", dest='predict_memory_mb',
+	                    help=""": Float. If given, predictions (of the training, validation and test sets) run in batches
+                        of query rows whose distances to the training set fit this many MB (batch_predict.py). Not
+                        used with --algorithm ivf, which searches in batches of its own. Default is None (all the
+                        rows at once)""")
+
+	parser.add_argument('--predict_workers', action='store', default="None", dest='predict_workers',
+	                    help=""": Integer. (with --predict_memory_mb) Number of threads predicting batches, the memory
+                        budget is shared between them. Default is None (a single thread)""")
+
+	parser.add_argument('--index_dir', action='store', default=None, dest='index_dir',
+	                    help=""": Directory. If given, the fitted model is also saved there as an index of raw .npy
+                        arrays + manifest.json (knn_index.py), which scoring processes memory-map instead of
+                        unpickling the model. Default is None""")
+
+	return parser
+
+
+if __name__ == '__main__':
+	args = build_parser().parse_args()
 
 	main(args)
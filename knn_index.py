@@ -0,0 +1,137 @@
+"""
+All rights reserved to cnvrg.io
+     http://www.cnvrg.io
+
+cnvrg.io - AI library
+
+knn_index.py
+==============================================================================
+Persisted KNN indexes - a fitted KNeighborsClassifier or ann.IVFKNeighborsClassifier saved as a directory of raw
+.npy arrays (the training matrix, the labels and the tree / inverted lists) and a manifest.json of everything else.
+load_index memory-maps the arrays, so a scoring process starts without deserializing the training set and all the
+processes scoring with the same index share its pages.
+"""
+import os
+import json
+
+import numpy as np
+import sklearn
+from sklearn.metrics import DistanceMetric
+from sklearn.neighbors import KNeighborsClassifier, KDTree, BallTree
+
+from ann import IVFKNeighborsClassifier
+from batch_predict import BatchedKNeighborsClassifier
+
+manifest_name = 'manifest.json'
+
+# The classes of models and trees an index can hold.
+index_classes = {'KNeighborsClassifier': KNeighborsClassifier,
+				 'BatchedKNeighborsClassifier': BatchedKNeighborsClassifier,
+				 'IVFKNeighborsClassifier': IVFKNeighborsClassifier}
+tree_classes = {'KDTree': KDTree, 'BallTree': BallTree}
+
+
+def _to_json(value, name):
+	if isinstance(value, np.generic):
+		return value.item()
+	if value is None or isinstance(value, (bool, int, float, str)):
+		return value
+	if isinstance(value, dict):
+		return {key: _to_json(item, name) for key, item in value.items()}
+	raise Exception("Index Error: The attribute {} ({}) can't be saved in an index.".format(name, type(value).__name__))
+
+
+def _save_array(array, directory, name):
+	file_name = name.strip('_') + '.npy'
+	np.save(os.path.join(directory, file_name), np.ascontiguousarray(array))
+	return file_name
+
+
+def _save_tree(tree, directory):
+	# The tree state (see BinaryTree.__getstate__) - 4 arrays (data, idx_array, node_data, node_bounds), the tree's
+	# counters and its metric, which is rebuilt from the estimator's effective metric on load.
+	state = tree.__getstate__()
+	arrays = [_save_array(array, directory, 'tree_' + name)
+			  for array, name in zip(state[:4], ['data', 'idx_array', 'node_data', 'node_bounds'])]
+	counters = [int(value) for value in state[4:11]]
+	if len(state) > 12 and state[12] is not None:
+		raise Exception("Index Error: Trees with sample weights can't be saved in an index.")
+	return {'class': type(tree).__name__, 'arrays': arrays, 'counters': counters, 'state_size': len(state)}
+
+
+def _load_tree(tree_manifest, directory, model, mmap_mode):
+	arrays = [np.load(os.path.join(directory, file_name), mmap_mode=mmap_mode) for file_name in tree_manifest['arrays']]
+	metric = DistanceMetric.get_metric(model.effective_metric_, **model.effective_metric_params_)
+	state = arrays + tree_manifest['counters'] + [metric]
+	state += [None] * (tree_manifest['state_size'] - len(state))
+	tree = tree_classes[tree_manifest['class']].__new__(tree_classes[tree_manifest['class']])
+	tree.__setstate__(tuple(state))
+	return tree
+
+
+def save_index(model, directory, feature_columns=None):
+	"""
+	:param model: fitted KNeighborsClassifier, batch_predict.BatchedKNeighborsClassifier or
+	ann.IVFKNeighborsClassifier.
+	:param directory: string. the index directory (created if needed).
+	:param feature_columns: list of strings or None. the features the model was trained on, in order.
+	"""
+	class_name = type(model).__name__
+	if class_name not in index_classes:
+		raise Exception("Index Error: {} can't be saved as an index. Expected one of {}.".format(class_name, list(index_classes)))
+	if not os.path.exists(directory):
+		os.makedirs(directory)
+
+	params = model.get_params()
+	manifest = {'class': class_name,
+				'sklearn_version': sklearn.__version__,
+				'params': _to_json(params, 'params'),
+				'arrays': {},
+				'attributes': {},
+				'tree': None,
+				'feature_columns': feature_columns}
+	# The fitted state - every attribute which isn't a param.
+	for name, value in vars(model).items():
+		if name in params:
+			continue
+		if name == '_tree' and value is not None:
+			manifest['tree'] = _save_tree(value, directory)
+		elif isinstance(value, np.ndarray):
+			manifest['arrays'][name] = _save_array(value, directory, name)
+		else:
+			manifest['attributes'][name] = _to_json(value, name)
+
+	with open(os.path.join(directory, manifest_name), 'w') as f:
+		json.dump(manifest, f, indent=2)
+
+
+def index_feature_columns(directory):
+	"""
+	:param directory: string. an index directory written by save_index.
+	:return: list of strings or None. the features the model was trained on, in order (None if not recorded).
+	"""
+	with open(os.path.join(directory, manifest_name)) as f:
+		return json.load(f).get('feature_columns')
+
+
+def load_index(directory, mmap_mode='r'):
+	"""
+	:param directory: string. an index directory written by save_index.
+	:param mmap_mode: string or None. np.load mmap_mode of the arrays. 'r' - read-only memory maps (default), None -
+	read into memory.
+	:return: the fitted model.
+	"""
+	with open(os.path.join(directory, manifest_name)) as f:
+		manifest = json.load(f)
+	if manifest['sklearn_version'] != sklearn.__version__ and manifest['tree'] is not None:
+		raise Exception("Index Error: The index was saved with scikit-learn {} and can't be loaded with {}.".format(
+			manifest['sklearn_version'], sklearn.__version__))
+
+	model = index_classes[manifest['class']](**manifest['params'])
+	for name, value in manifest['attributes'].items():
+		setattr(model, name, value)
+	for name, file_name in manifest['arrays'].items():
+		setattr(model, name, np.load(os.path.join(directory, file_name), mmap_mode=mmap_mode))
+	if manifest['tree'] is not None:
+		model._tree = _load_tree(manifest['tree'], directory, model, mmap_mode)
+	return model
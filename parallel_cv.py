@@ -0,0 +1,103 @@
+"""
+All rights reserved to cnvrg.io
+     http://www.cnvrg.io
+
+cnvrg.io - AI library
+
+parallel_cv.py
+==============================================================================
+"""
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from sklearn.base import clone
+from sklearn.model_selection import KFold
+from sklearn.metrics import accuracy_score, mean_squared_error
+from threadpoolctl import threadpool_limits
+
+from dataset import take_rows
+
+# The training set of the fold workers (set once per process by _init_worker).
+_worker_data = {}
+
+
+def get_threads_per_worker(workers, thread_budget=None):
+	"""
+	:param workers: int. number of fold workers.
+	:param thread_budget: int or None. total number of threads. None means the number of cores.
+	:return: int. number of threads each worker may use, so workers * threads doesn't oversubscribe the cores.
+	"""
+	thread_budget = thread_budget if thread_budget is not None else os.cpu_count()
+	return max(1, thread_budget // workers)
+
+
+def fold_estimators(model, folds, threads):
+	"""
+	Clones the model per fold. The serial loop adds a tree between the folds (model.n_estimators += 1), so the i-th
+	clone gets n_estimators + i to fit the same model as the serial loop does.
+	:param model: sklearn estimator (not fitted).
+	:param folds: int. number of folds.
+	:param threads: int. number of threads per fold.
+	:return: list of estimators.
+	"""
+	params = model.get_params()
+	estimators = []
+	for fold in range(folds):
+		estimator = clone(model)
+		fold_params = {name: threads for name in ['n_jobs', 'nthread'] if name in params}
+		if 'n_estimators' in params:
+			fold_params['n_estimators'] = params['n_estimators'] + fold
+		estimators.append(estimator.set_params(**fold_params))
+	return estimators
+
+
+def _init_worker(X, y, threads):
+	# X is either an array or the path of a memory-mapped .npy file (all the workers share its pages).
+	if isinstance(X, str):
+		X = np.load(X, mmap_mode='r')
+	_worker_data['X'], _worker_data['y'] = X, y
+	_worker_data['limits'] = threadpool_limits(limits=threads)
+
+
+def _fit_fold(task):
+	model, train_index, val_index, return_model = task
+	X, y = _worker_data['X'], _worker_data['y']
+	model.fit(take_rows(X, train_index), take_rows(y, train_index))
+	y_hat = model.predict(take_rows(X, val_index))  # y_hat is a.k.a y_pred
+	y_val = take_rows(y, val_index)
+	acc = accuracy_score(y_val, y_hat)
+	loss = mean_squared_error(y_val, y_hat)
+	return acc, loss, (model if return_model else None)
+
+
+def cross_validate_in_parallel(model, X, y, folds, workers, thread_budget=None):
+	"""
+	Runs the KFold folds in a process pool, a clone of the model per fold.
+	:param model: sklearn estimator.
+	:param X: array or numpy.memmap (see dataset.to_memmap). the features.
+	:param y: array. the labels.
+	:param folds: int. number of folds.
+	:param workers: int. number of processes.
+	:param thread_budget: int or None. see get_threads_per_worker.
+	:return: (train_acc, train_loss, model) - lists of the folds' accuracy and loss, and the model fitted on the last
+	fold (as the serial loop leaves it).
+	"""
+	workers = min(workers, folds)
+	threads = get_threads_per_worker(workers, thread_budget)
+	estimators = fold_estimators(model, folds, threads)
+	splits = list(KFold(n_splits=folds).split(X))
+	tasks = [(estimators[fold], train_index, val_index, fold == folds - 1)
+			 for fold, (train_index, val_index) in enumerate(splits)]
+
+	X_ref = X.filename if isinstance(X, np.memmap) else X
+	with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(X_ref, y, threads)) as pool:
+		results = list(pool.map(_fit_fold, tasks))
+
+	# The fitted model keeps the thread settings it was configured with.
+	params = model.get_params()
+	fitted_model = results[-1][2]
+	fitted_model.set_params(**{name: params[name] for name in ['n_jobs', 'nthread'] if name in params})
+	train_acc = [acc for acc, _, _ in results]
+	train_loss = [loss for _, loss, _ in results]
+	return train_acc, train_loss, fitted_model
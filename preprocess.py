@@ -13,14 +13,14 @@ preprocess.py
 ==============================================================================
 """
 import os
+import json
 import argparse
 import pandas as pd
 
-parser = argparse.ArgumentParser(description="""Preprocessor""")
-parser.add_argument('--data', action='store', dest='data', required=True,
-					help="""string. path to the raw dataset.""")
-args = parser.parse_args()
-data = args.data
+from data_cache import DataCache, cache_key
+from dataset import write_dataset, DatasetWriter
+from profiling import stage, add_profile_args, cast_profile_args, start_from_args, finish_from_args
+
 
 # ---------------- Helpers --------------------
 # Helper method - converts non-numbers to 0
@@ -33,38 +33,78 @@ def cast_all_non_numbers(col):
 	for ind in range(len(col)):
 		val = 0.0
 		try:
-			val = float(col[ind])
+			val = float(col.iloc[ind])
 		except ValueError:
 			continue
 		values[ind] = val
 	return col
 
 
+# Helper method - vectorized version of cast_all_non_numbers.
+def cast_all_non_numbers_vectorized(col):
+	"""
+	:param col: data frame. shape=(col_len, 1)
+	:return: the same column as floats, non-numbers are nan (filled with 0 at the end of the preprocessing).
+	"""
+	return pd.to_numeric(col, errors="coerce")
+
+
 # Helper method - scale column.
-def scale_column(col):
+def scale_column(col, col_min=None, col_max=None):
 	"""
 	:param col: data frame. shape=(col_len, 1)
+	:param col_min: float. global minimum of the column. If None, computed from col.
+	:param col_max: float. global maximum of the column. If None, computed from col.
 	:return: the same column, but all scaled.
 	"""
 	df = col
-	df -= df.min()
-	df /= df.max()
+	if col_min is None or col_max is None:
+		df -= df.min()
+		df /= df.max()
+	else:
+		df -= col_min
+		df /= col_max - col_min
 	return df
 
 
 # Helper method - emp_length/
 def process_emp_length_col(col):
 	values = [0] * len(col)
-	terms_dict = {'< 1 year': 2, '1 year': 2, '2 years': 2, '3 years': 4, '4 years': 4, '5 years': 6, '6 years': 6,
-				  '7 years': 8, '8 years': 8, '9 years': 10, '10+ years': 10}
 	for ind in range(len(col)):
 		try:
-			values[ind] = int(terms_dict[col[ind]])
+			values[ind] = int(emp_length_dict[col.iloc[ind]])
 		except KeyError:
 			continue
 	return values
 
 
+# Helper method - vectorized version of process_emp_length_col.
+def process_emp_length_col_vectorized(col):
+	"""
+	:param col: data frame. shape=(col_len, 1)
+	:return: the column mapped by emp_length_dict, unknown values are 0.
+	"""
+	return col.map(emp_length_dict).fillna(0).astype(int)
+
+
+# Helper method - sub_grade. Ex: {A4} ->{4}
+def process_sub_grade_col(col):
+	sub_grade_col = []
+	for i in range(len(col)):
+		ch = col.iloc[i][1]
+		sub_grade_col.append(int(ch))
+	return sub_grade_col
+
+
+# Helper method - vectorized version of process_sub_grade_col.
+def process_sub_grade_col_vectorized(col):
+	"""
+	:param col: data frame. shape=(col_len, 1)
+	:return: the digit of each sub grade as int.
+	"""
+	return col.str[1].astype(int)
+
+
 # ------------- Constants --------------------
 # Features should be categorical features.
 to_dummies = ["term", "grade", "home_ownership", "verification_status"]
@@ -78,87 +118,344 @@ to_drop = ["emp_title", "pymnt_plan", "desc", "purpose", "title", "zip_code", "a
 		   "collections_12_mths_ex_med", "mths_since_last_delinq", "mths_since_last_major_derog", "policy_code",
 		   "month_issued", "year_issued"]
 
-
-# ------------- ------- --------------------
-# Read dataset.
-data = pd.read_csv(data)
-
-# Target feature.
-target_feature, is_target_feature_included, target_col = "is_bad", False, None
-if target_feature in data.columns:
-	is_target_feature_included = True
-	target_col = data[target_feature]
-	data = data.drop(columns=[target_feature], axis=1)
-
-for column in data.columns:
-	if column.startswith('Unnamed'):
-		data = data.drop(columns=column, axis=1)
-
-# Special treat.
-special = ["emp_length"]
+# Features should be cast to numbers.
+to_cast = ["inq_last_6mths", "open_acc", "revol_util"]
 
 # Converting grade column. Ex: {A} ->{1}
 con_dict = {'A': 1, 'B': 2, 'C': 3, 'D': 4, 'E': 5, 'F': 6, 'G': 7}
-data['grade'] = data['grade'].map(con_dict)
-
-# Converting sub_grade column. Ex: {A4} ->{4}
-sub_grade_col = []
-for i in range(len(data['sub_grade'])):
-	ch = data['sub_grade'][i][1]
-	sub_grade_col.append(int(ch))
-data['sub_grade'] = sub_grade_col
-
-# Converting inq_last_6mths
-new_inq_last_6mths = cast_all_non_numbers(data['inq_last_6mths'])
-data = data.drop(columns=['inq_last_6mths'], axis=1)
-data['inq_last_6mths'] = new_inq_last_6mths
-
-# Converting open_acc
-new_open_acc = cast_all_non_numbers(data['open_acc'])
-data = data.drop(columns=['open_acc'], axis=1)
-data['open_acc'] = new_open_acc
-
-# Converting revol_util
-new_revol_util = cast_all_non_numbers(data['revol_util'])
-data = data.drop(columns=['revol_util'], axis=1)
-data['revol_util'] = new_revol_util
-
-# Drop.
-data = data.drop(columns=to_drop, axis=1)
-
-# Scaling.
-for col_to_scale in to_scale:
-	scaled = scale_column(data[col_to_scale])
-	data = data.drop(columns=[col_to_scale], axis=1)
-	data[col_to_scale] = scaled
-
-# Categorical features.
-data = pd.get_dummies(data, columns=to_dummies)
-
-# Process emp_length col.
-emp_length_new = process_emp_length_col(data['emp_length'])
-data = data.drop(columns=['emp_length'], axis=1)
-data['emp_length'] = emp_length_new
-
-# Last - na dropouts.
-data = data.fillna(0)
+
+# Converting emp_length column.
+emp_length_dict = {'< 1 year': 2, '1 year': 2, '2 years': 2, '3 years': 4, '4 years': 4, '5 years': 6, '6 years': 6,
+				   '7 years': 8, '8 years': 8, '9 years': 10, '10+ years': 10}
+
+# Target feature.
+target_feature = "is_bad"
 
 final_columns = ['int_rate', 'sub_grade', 'loan_amnt', 'installment', 'annual_inc',
 				 'dti', 'revol_bal', 'inq_last_6mths', 'open_acc', 'revol_util',
 				 'term_ 36 months', 'term_ 60 months', 'grade_1', 'grade_2', 'grade_3',
-				 'grade_4', 'grade_5', 'grade_6', 'grade_7', 'home_ownership_MORTGAGE', 'home_ownership_OTHER', 'home_ownership_OWN',
-				 'home_ownership_NONE', 'home_ownership_RENT', 'verification_status_VERIFIED - income',
+				 'grade_4', 'grade_5', 'grade_6', 'grade_7', 'home_ownership_MORTGAGE', 'home_ownership_NONE',
+				 'home_ownership_OTHER', 'home_ownership_OWN', 'home_ownership_RENT', 'verification_status_VERIFIED - income',
 				 'verification_status_VERIFIED - income source',
 				 'verification_status_not verified', 'emp_length']
 
-if is_target_feature_included:
-	data[target_feature] = target_col
-	final_columns.append('is_bad')
 
-data.columns = final_columns
+# ------------- ------- --------------------
+def preprocess(data, vectorized=True, stats=None):
+	"""
+	Runs all the transformations over the raw data set.
+	:param data: data frame. The raw data set.
+	:param vectorized: boolean. If True, uses the vectorized helpers (pandas string accessors, map, to_numeric)
+	instead of the loop-based ones. Both produce the same output.
+	:param stats: dict or None. Global statistics of the whole data set (see compute_stats). If given, the scaling
+	and the dummies use them instead of the values found in data, so data might be a single chunk of the data set.
+	:return: data frame with final_columns (+ the target feature, if included).
+	"""
+	if vectorized:
+		cast_column = cast_all_non_numbers_vectorized
+		process_emp_length = process_emp_length_col_vectorized
+		process_sub_grade = process_sub_grade_col_vectorized
+	else:
+		cast_column = cast_all_non_numbers
+		process_emp_length = process_emp_length_col
+		process_sub_grade = process_sub_grade_col
+
+	# Target feature (dropped from a new frame - the caller's data is left as is).
+	is_target_feature_included, target_col = False, None
+	if target_feature in data.columns:
+		is_target_feature_included = True
+		target_col = data[target_feature]
+
+	data = data.drop(columns=[column for column in data.columns
+							  if column.startswith('Unnamed') or column == target_feature])
+
+	# Converting grade column. Ex: {A} ->{1}
+	data['grade'] = data['grade'].map(con_dict)
+
+	# Converting sub_grade column. Ex: {A4} ->{4}
+	data['sub_grade'] = process_sub_grade(data['sub_grade'])
+
+	# Converting inq_last_6mths, open_acc, revol_util (moved to the end of the data frame).
+	for col_to_cast in to_cast:
+		data[col_to_cast] = cast_column(data.pop(col_to_cast))
+
+	# Drop.
+	data = data.drop(columns=to_drop)
+
+	# Scaling.
+	for col_to_scale in to_scale:
+		if stats is None:
+			data[col_to_scale] = scale_column(data.pop(col_to_scale))
+		else:
+			data[col_to_scale] = scale_column(data.pop(col_to_scale),
+											  col_min=stats['min'][col_to_scale],
+											  col_max=stats['max'][col_to_scale])
+
+	# Categorical features.
+	if stats is not None:
+		for col_to_dummies in to_dummies:
+			data[col_to_dummies] = pd.Categorical(data[col_to_dummies],
+												  categories=stats['categories'][col_to_dummies])
+	data = pd.get_dummies(data, columns=to_dummies)
+
+	# Process emp_length col.
+	data['emp_length'] = process_emp_length(data.pop('emp_length'))
+
+	# Last - na dropouts.
+	data = data.fillna(0)
+
+	# The columns are selected by the names get_dummies gave them - a category missing from data (without stats) is
+	# an all-zeros column.
+	unknown = [col for col in data.columns if col not in final_columns]
+	if unknown:
+		raise Exception("Preprocess Error: Unexpected columns {} (unknown categories?).".format(unknown))
+	data = data.reindex(columns=final_columns, fill_value=0)
+	if is_target_feature_included:
+		data[target_feature] = target_col
+	return data
+
+
+def _collect_stats(chunks):
+	"""
+	Collects the global min/max of the columns in to_scale and the categories of the columns in to_dummies.
+	:param chunks: iterable of data frames, each includes (at least) the to_scale and to_dummies columns.
+	:return: dict. {'min': {col: float}, 'max': {col: float}, 'categories': {col: list}}
+	"""
+	stats = {'min': {}, 'max': {}, 'categories': {col: set() for col in to_dummies}}
+	for chunk in chunks:
+		chunk['grade'] = chunk['grade'].map(con_dict)
+		for col_to_cast in to_cast:
+			chunk[col_to_cast] = cast_all_non_numbers_vectorized(chunk[col_to_cast])
+
+		for col_to_scale in to_scale:
+			col_min, col_max = chunk[col_to_scale].min(), chunk[col_to_scale].max()
+			if pd.isna(col_min):
+				continue
+			stats['min'][col_to_scale] = min(float(col_min), stats['min'].get(col_to_scale, float(col_min)))
+			stats['max'][col_to_scale] = max(float(col_max), stats['max'].get(col_to_scale, float(col_max)))
+
+		for col_to_dummies in to_dummies:
+			stats['categories'][col_to_dummies].update(chunk[col_to_dummies].dropna().unique().tolist())
+
+	stats['categories'] = {col: sorted(values) for col, values in stats['categories'].items()}
+	return stats
+
 
-# Pushing the processed data set to a new cnvrg data set using cnvrg-CLI.
-if not os.path.exists('example-lendingclub'):
-	os.mkdir('example-lendingclub')
-data.to_csv('example-lendingclub/processed_data_set.csv')
-os.system("cd example-lendingclub && cnvrg data init && cnvrg data sync")
\ No newline at end of file
+def compute_stats(path, chunksize):
+	"""
+	First pass over the raw data set - collects the statistics (see _collect_stats) reading only the to_scale and
+	to_dummies columns, chunk by chunk.
+	:param path: string. path to the raw dataset.
+	:param chunksize: int. number of rows per chunk.
+	:return: dict. {'min': {col: float}, 'max': {col: float}, 'categories': {col: list}}
+	"""
+	return _collect_stats(pd.read_csv(path, usecols=to_scale + to_dummies, chunksize=chunksize))
+
+
+def preprocess_in_chunks(path, output_path, chunksize, vectorized=True, stats=None):
+	"""
+	Streaming mode - reads the raw data set chunk by chunk, preprocesses every chunk with the global statistics and
+	appends it to the output file, so the peak memory is about a single chunk.
+	:param path: string. path to the raw dataset.
+	:param output_path: string. path to the processed data set file (csv, parquet or feather, by the extension).
+	:param chunksize: int. number of rows per chunk.
+	:param vectorized: boolean. see preprocess.
+	:param stats: dict or None. see compute_stats. If None, computed by a first pass over the raw data set.
+	:return: dict. the statistics used.
+	"""
+	if stats is None:
+		stats = compute_stats(path, chunksize)
+
+	writer = DatasetWriter(output_path)
+	for chunk in pd.read_csv(path, chunksize=chunksize):
+		writer.write(preprocess(chunk, vectorized=vectorized, stats=stats))
+	writer.close()
+	return stats
+
+
+class Preprocessor:
+	"""
+	Fit-once preprocessing transformer. Fitting saves the min/max of every to_scale column and the categories of
+	every to_dummies column, so any later batch is transformed with the same scales and the same columns by a
+	single transform call.
+	"""
+	def __init__(self, vectorized=True, stats=None):
+		"""
+		:param vectorized: boolean. see preprocess.
+		:param stats: dict or None. see compute_stats. None means not fitted yet.
+		"""
+		self.vectorized = vectorized
+		self.stats = stats
+
+	def fit(self, data):
+		"""
+		:param data: data frame. The raw data set.
+		:return: self.
+		"""
+		self.stats = _collect_stats([data[to_scale + to_dummies].copy()])
+		return self
+
+	def fit_csv(self, path, chunksize):
+		"""
+		Fits over a raw csv file without loading it to memory.
+		:param path: string. path to the raw dataset.
+		:param chunksize: int. number of rows per chunk.
+		:return: self.
+		"""
+		self.stats = compute_stats(path, chunksize)
+		return self
+
+	def transform(self, data):
+		"""
+		:param data: data frame. Raw data (the whole data set, a chunk of it or a new batch).
+		:return: data frame with final_columns (+ the target feature, if included).
+		"""
+		if self.stats is None:
+			raise Exception("Preprocessor Error: The preprocessor is not fitted.")
+		return preprocess(data, vectorized=self.vectorized, stats=self.stats)
+
+	def fit_transform(self, data):
+		return self.fit(data).transform(data)
+
+	def transform_csv(self, path, output_path, chunksize):
+		"""
+		Streams a raw csv file through transform (see preprocess_in_chunks).
+		"""
+		if self.stats is None:
+			raise Exception("Preprocessor Error: The preprocessor is not fitted.")
+		preprocess_in_chunks(path, output_path, chunksize, vectorized=self.vectorized, stats=self.stats)
+
+	def save(self, path):
+		"""
+		:param path: string. path to a json file.
+		"""
+		with open(path, 'w') as f:
+			json.dump(self.stats, f)
+
+	@classmethod
+	def load(cls, path, vectorized=True):
+		"""
+		:param path: string. path to a json file written by save (or by --stats_file).
+		:param vectorized: boolean. see preprocess.
+		:return: Preprocessor.
+		"""
+		with open(path, 'r') as f:
+			return cls(vectorized=vectorized, stats=json.load(f))
+
+
+def main(args):
+	args.vectorized = (args.vectorized == "True" or args.vectorized == 'True')
+
+	# chunksize.
+	if args.chunksize == "None" or args.chunksize == 'None':
+		args.chunksize = None
+	else:
+		args.chunksize = int(args.chunksize)
+
+	# cache_size_mb.
+	args.cache_size_mb = float(args.cache_size_mb)
+
+	# profile, profile_memory.
+	args = cast_profile_args(args)
+	start_from_args(args)
+
+	# output_format.
+	if args.output_format not in ['csv', 'parquet', 'feather']:
+		raise Exception("Preprocessing Error: Unknown output format {}.".format(args.output_format))
+
+	if not os.path.exists('example-lendingclub'):
+		os.mkdir('example-lendingclub')
+	output_path = 'example-lendingclub/processed_data_set.' + args.output_format
+
+	# A fitted preprocessor (from a previous run) is reused as is - new data is transformed with the same scales and
+	# categories. Otherwise the preprocessor is fitted over the given data set.
+	if args.stats_file is not None and os.path.exists(args.stats_file):
+		preprocessor = Preprocessor.load(args.stats_file, vectorized=args.vectorized)
+	else:
+		preprocessor = Preprocessor(vectorized=args.vectorized)
+
+	if args.chunksize is not None:
+		# Streaming mode.
+		if preprocessor.stats is None:
+			with stage('fit'):
+				preprocessor.fit_csv(args.data, args.chunksize)
+		with stage('transform_csv'):
+			preprocessor.transform_csv(args.data, output_path, args.chunksize)
+	else:
+		# The processed data set of the same raw file and stats (None - fitted over the file) is taken from the cache.
+		cache, key, cached = None, None, None
+		if args.cache_dir is not None:
+			cache = DataCache(args.cache_dir, max_size_mb=args.cache_size_mb)
+			key = cache_key(cache.file_hash(args.data), 'preprocess', preprocessor.stats)
+			with stage('cache_get'):
+				cached = cache.get_frame(key)
+
+		if cached is not None:
+			data, meta = cached
+			preprocessor.stats = meta['stats']
+		else:
+			# Read dataset.
+			with stage('read_csv'):
+				data = pd.read_csv(args.data)
+			if preprocessor.stats is None:
+				with stage('fit'):
+					preprocessor.fit(data)
+			with stage('transform'):
+				data = preprocessor.transform(data)
+			if cache is not None:
+				with stage('cache_put'):
+					cache.put_frame(key, data, meta={'stats': preprocessor.stats})
+		with stage('write_dataset'):
+			write_dataset(data, output_path)
+
+	if args.stats_file is not None:
+		preprocessor.save(args.stats_file)
+
+	if args.profile:
+		# cnvrg is needed only to log the stages.
+		from cnvrg import Experiment
+		finish_from_args(args, Experiment())
+
+	# Pushing the processed data set to a new cnvrg data set using cnvrg-CLI.
+	os.system("cd example-lendingclub && cnvrg data init && cnvrg data sync")
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description="""Preprocessor""")
+	parser.add_argument('--data', action='store', dest='data', required=True,
+						help="""string. path to the raw dataset.""")
+
+	parser.add_argument('--vectorized', action='store', default="True", dest='vectorized',
+						help="""Boolean. Whether to use the vectorized column transforms instead of the loop-based 
+						helpers. Both produce the same output. Default is True.""")
+
+	parser.add_argument('--output_format', action='store', default="csv", dest='output_format',
+						help="""String. 'csv', 'parquet' or 'feather'. The format of the processed data set. The binary 
+						formats are stored with compact dtypes (float32, uint8 one-hot columns) and are much faster to 
+						load by the model scripts (requires pyarrow). Default is 'csv'.""")
+
+	parser.add_argument('--chunksize', action='store', default="None", dest='chunksize',
+						help="""Integer. If given, the raw dataset is streamed in chunks of this many rows, so the 
+						peak memory is about a single chunk. Default is None (the whole file is loaded).""")
+
+	parser.add_argument('--stats_file', action='store', default=None, dest='stats_file',
+						help="""String. Path to a json file of a fitted preprocessor (the min/max of the scaled 
+						columns and the categories of the dummies). If it exists, the data is only transformed with it 
+						(e.g. scoring a new batch); otherwise the preprocessor is fitted and written to it. 
+						Default is None.""")
+
+	parser.add_argument('--cache_dir', action='store', default=None, dest='cache_dir',
+						help="""String. Local directory of the data cache (data_cache.py). If given (without 
+						--chunksize), the processed data set is cached there by the hash of the raw dataset and the 
+						stats of the preprocessor, so preprocessing an unchanged file again only writes the output. 
+						Default is None.""")
+
+	parser.add_argument('--cache_size_mb', action='store', default="1024", dest='cache_size_mb',
+						help="""Float. Size limit of --cache_dir, the least recently used entries are evicted above it.
+						Default is 1024.""")
+
+	add_profile_args(parser)
+
+	args = parser.parse_args()
+
+	main(args)
@@ -0,0 +1,261 @@
+"""
+All rights reserved to cnvrg.io
+     http://www.cnvrg.io
+
+cnvrg.io - AI library
+
+profiling.py
+==============================================================================
+Stage profiling of the scripts - the wall time, the resident memory and (optionally) the peak of the traced python /
+numpy allocations of every stage (reading the data, fitting, predicting, saving...).
+The scripts mark their stages with `with stage('fit'):`, which does nothing unless a profiler was started (start).
+The stages are logged as experiment metrics (Profiler.log) and can be written as a Chrome trace (Profiler.write_trace,
+open in chrome://tracing or https://ui.perfetto.dev).
+"""
+import os
+import json
+import time
+import threading
+import tracemalloc
+import contextlib
+
+try:
+	import resource
+except ImportError:  # Windows.
+	resource = None
+
+# The started profiler (see start).
+_profiler = None
+
+
+def _rss_mb():
+	"""
+	:return: float. the current resident memory of the process, in MB (None if unknown).
+	"""
+	try:
+		with open('/proc/self/statm') as f:
+			return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2 ** 20
+	except (IOError, OSError, ValueError):
+		return None
+
+
+def _max_rss_mb():
+	"""
+	:return: float. the peak resident memory of the process so far, in MB (None if unknown).
+	"""
+	if resource is None:
+		return None
+	# KB on linux.
+	return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2 ** 10
+
+
+class Profiler:
+	"""
+	Records the stages of a run. Stages may be nested (ex: the folds of a cross validation) and may run in several
+	threads. The allocations peak is process-wide - stages running concurrently share it.
+	"""
+	def __init__(self, trace_memory=False):
+		"""
+		:param trace_memory: boolean. If True, the peak of the traced allocations (tracemalloc) of every stage is
+		recorded. tracemalloc slows down allocation-heavy python code.
+		"""
+		self.trace_memory = trace_memory
+		self.stages = []
+		self._origin = time.perf_counter()
+		self._local = threading.local()
+		self._lock = threading.Lock()
+		if trace_memory and not tracemalloc.is_tracing():
+			tracemalloc.start()
+
+	def _stack(self):
+		if not hasattr(self._local, 'stack'):
+			self._local.stack = []
+		return self._local.stack
+
+	@contextlib.contextmanager
+	def stage(self, name):
+		"""
+		:param name: string. the name of the stage (repeated stages, ex: fit in every fold, keep the same name).
+		"""
+		stack = self._stack()
+		frame = {'alloc_peak': 0, 'alloc_base': 0}
+		if self.trace_memory:
+			current, peak = tracemalloc.get_traced_memory()
+			if stack:
+				stack[-1]['alloc_peak'] = max(stack[-1]['alloc_peak'], peak)
+			frame['alloc_base'] = current
+			tracemalloc.reset_peak()
+		stack.append(frame)
+		rss_before = _rss_mb()
+		start = time.perf_counter()
+		try:
+			yield
+		finally:
+			end = time.perf_counter()
+			stack.pop()
+			record = {'name': name,
+					  'start': start - self._origin,
+					  'duration': end - start,
+					  'depth': len(stack),
+					  'thread': threading.get_ident(),
+					  'rss_mb': _rss_mb(),
+					  'max_rss_mb': _max_rss_mb()}
+			if rss_before is not None and record['rss_mb'] is not None:
+				record['rss_delta_mb'] = record['rss_mb'] - rss_before
+			if self.trace_memory:
+				_, peak = tracemalloc.get_traced_memory()
+				peak = max(peak, frame['alloc_peak'])
+				# The peak of the enclosing stage includes the peak of this one.
+				if stack:
+					stack[-1]['alloc_peak'] = max(stack[-1]['alloc_peak'], peak)
+				record['alloc_peak_mb'] = (peak - frame['alloc_base']) / 2 ** 20
+			with self._lock:
+				self.stages.append(record)
+
+	def summary(self):
+		"""
+		:return: dict. {stage name: {'count', 'total_sec', 'max_rss_mb', 'alloc_peak_mb' (if traced)}}, in the order
+		the stages started.
+		"""
+		summary = {}
+		for record in sorted(self.stages, key=lambda rec: rec['start']):
+			stage_summary = summary.setdefault(record['name'], {'count': 0, 'total_sec': 0., 'max_rss_mb': None})
+			stage_summary['count'] += 1
+			stage_summary['total_sec'] += record['duration']
+			if record['max_rss_mb'] is not None:
+				stage_summary['max_rss_mb'] = max(stage_summary['max_rss_mb'] or 0., record['max_rss_mb'])
+			if 'alloc_peak_mb' in record:
+				stage_summary['alloc_peak_mb'] = max(stage_summary.get('alloc_peak_mb', 0.), record['alloc_peak_mb'])
+		return summary
+
+	def log(self, exp):
+		"""
+		Logs every stage as metrics of the experiment - profile_<stage>_sec (the duration of every occurrence),
+		profile_<stage>_max_rss_mb and profile_<stage>_alloc_peak_mb (if traced).
+		:param exp: cnvrg.Experiment.
+		"""
+		for name, stage_summary in self.summary().items():
+			records = [record for record in self.stages if record['name'] == name]
+			exp.log_metric("profile_{}_sec".format(name), [record['duration'] for record in records])
+			if stage_summary['max_rss_mb'] is not None:
+				exp.log_metric("profile_{}_max_rss_mb".format(name), [record['max_rss_mb'] for record in records])
+			if 'alloc_peak_mb' in stage_summary:
+				exp.log_metric("profile_{}_alloc_peak_mb".format(name), [record['alloc_peak_mb'] for record in records])
+
+	def print_summary(self):
+		print("{:<24} {:>6} {:>10} {:>12} {:>15}".format('stage', 'count', 'total_sec', 'max_rss_mb', 'alloc_peak_mb'))
+		for name, stage_summary in self.summary().items():
+			print("{:<24} {:>6} {:>10.3f} {:>12} {:>15}".format(
+				name, stage_summary['count'], stage_summary['total_sec'],
+				'{:.1f}'.format(stage_summary['max_rss_mb']) if stage_summary['max_rss_mb'] is not None else '-',
+				'{:.1f}'.format(stage_summary['alloc_peak_mb']) if 'alloc_peak_mb' in stage_summary else '-'))
+
+	def write_trace(self, path):
+		"""
+		Writes the stages as a Chrome trace (complete events, with the memory of every stage in its args, plus a
+		counter of the resident memory).
+		:param path: string. path to a json file.
+		"""
+		pid = os.getpid()
+		events = []
+		for record in sorted(self.stages, key=lambda rec: rec['start']):
+			args = {key: record[key] for key in ('rss_mb', 'rss_delta_mb', 'max_rss_mb', 'alloc_peak_mb')
+					if record.get(key) is not None}
+			events.append({'name': record['name'], 'ph': 'X', 'pid': pid, 'tid': record['thread'],
+						   'ts': record['start'] * 1e6, 'dur': record['duration'] * 1e6, 'args': args})
+			if record['rss_mb'] is not None:
+				events.append({'name': 'rss_mb', 'ph': 'C', 'pid': pid,
+							   'ts': (record['start'] + record['duration']) * 1e6, 'args': {'rss_mb': record['rss_mb']}})
+		with open(path, 'w') as f:
+			json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+
+	def close(self):
+		if self.trace_memory and tracemalloc.is_tracing():
+			tracemalloc.stop()
+
+
+def start(trace_memory=False):
+	"""
+	Starts profiling the stages of the process.
+	:param trace_memory: boolean. see Profiler.
+	:return: Profiler.
+	"""
+	global _profiler
+	_profiler = Profiler(trace_memory=trace_memory)
+	return _profiler
+
+
+def stop():
+	"""
+	:return: Profiler or None. the started profiler (no more stages are recorded).
+	"""
+	global _profiler
+	profiler, _profiler = _profiler, None
+	if profiler is not None:
+		profiler.close()
+	return profiler
+
+
+def stage(name):
+	"""
+	:param name: string. see Profiler.stage.
+	:return: context manager. records the stage in the started profiler, does nothing if none was started.
+	"""
+	if _profiler is None:
+		return contextlib.nullcontext()
+	return _profiler.stage(name)
+
+
+def add_profile_args(parser):
+	"""
+	Adds the profiling params of the scripts.
+	:param parser: argparse.ArgumentParser object.
+	:return: argparse.ArgumentParser object.
+	"""
+	parser.add_argument('--profile', action='store', default="False", dest='profile',
+						help="""Boolean. Whether to time every stage of the run (reading the data, fitting, predicting,
+						saving...) and log the durations and the memory as profile_* metrics. Default is False.""")
+
+	parser.add_argument('--profile_memory', action='store', default="False", dest='profile_memory',
+						help="""Boolean. (with --profile) Whether to trace the allocations (tracemalloc) and log the
+						peak of every stage. Slows down allocation-heavy stages. Default is False.""")
+
+	parser.add_argument('--profile_trace', action='store', default=None, dest='profile_trace',
+						help="""String. (with --profile) Path to a json file. If given, the stages are also written
+						there as a Chrome trace (chrome://tracing or ui.perfetto.dev). Default is None.""")
+	return parser
+
+
+def cast_profile_args(args):
+	"""
+	This method performs casting to the inputs added by add_profile_args.
+	:param args: argparse.ArgumentParser object.
+	:return: argparse.ArgumentParser object.
+	"""
+	args.profile = (args.profile == "True" or args.profile == 'True')
+	args.profile_memory = (args.profile_memory == "True" or args.profile_memory == 'True')
+	return args
+
+
+def start_from_args(args):
+	"""
+	:param args: argparse.ArgumentParser object (cast by cast_profile_args).
+	:return: Profiler or None. the started profiler, if --profile.
+	"""
+	return start(trace_memory=args.profile_memory) if args.profile else None
+
+
+def finish_from_args(args, exp):
+	"""
+	Stops the profiler started by start_from_args and reports the stages (experiment metrics, a summary table and the
+	--profile_trace file).
+	:param args: argparse.ArgumentParser object.
+	:param exp: cnvrg.Experiment.
+	"""
+	profiler = stop()
+	if profiler is None:
+		return
+	profiler.log(exp)
+	profiler.print_summary()
+	if args.profile_trace is not None:
+		profiler.write_trace(args.profile_trace)
@@ -13,34 +13,24 @@ random_forest.py
 ==============================================================================
 """
 import argparse
-import pickle
-
-import pandas as pd
+import functools
 
+import numpy as np
 from cnvrg import Experiment
 from sklearn.ensemble import RandomForestClassifier
-from sklearn.model_selection import train_test_split, KFold
 from sklearn.metrics import accuracy_score, mean_squared_error
+from sklearn.model_selection import train_test_split
+
+from harness import add_common_args, run, save_model, training_metrics, log_training_metrics
+from profiling import stage
 
-import warnings
-warnings.filterwarnings(action="ignore", category=RuntimeWarning)
-warnings.filterwarnings(action='ignore', category=DeprecationWarning)
 
 def _cast_types(args):
 	"""
-	This method performs casting to all types of inputs passed via cmd.
+	This method performs casting to the model's params passed via cmd.
 	:param args: argparse.ArgumentParser object.
 	:return: argparse.ArgumentParser object.
 	"""
-	# x_val.
-	if args.x_val != 'None':
-		args.x_val = int(args.x_val)
-	else:
-		args.x_val = None
-
-	# test_size
-	args.test_size = float(args.test_size)
-
 	# n_estimators.
 	args.n_estimators = int(args.n_estimators)
 
@@ -120,151 +110,196 @@ def _cast_types(args):
 		args.class_weight = None
 	else:
 		args.class_weight = dict(args.class_weight)
+
+	# grow.
+	args.grow = (args.grow == "True" or args.grow == 'True')
+
+	# grow_batch.
+	args.grow_batch = int(args.grow_batch)
+
+	# grow_tol.
+	args.grow_tol = float(args.grow_tol)
+
+	# grow_patience.
+	args.grow_patience = int(args.grow_patience)
+
+	# grow_eval_fraction.
+	args.grow_eval_fraction = float(args.grow_eval_fraction)
+
+	# oob_eval.
+	args.oob_eval = (args.oob_eval == "True" or args.oob_eval == 'True')
+	if args.oob_eval and not args.bootstrap:
+		raise Exception("Params Error: --oob_eval requires --bootstrap True.")
+	if args.oob_eval and args.grow:
+		raise Exception("Params Error: --oob_eval can't be used with --grow.")
 	#  --- ---------------------------------------- --- #
 	return args
 
 
-def train_with_cross_validation(model, train_set, test_set, folds, project_dir, output_model_name):
-	train_acc, train_loss = [], []
-	kf = KFold(n_splits=folds)
-	X, y = train_set
-	# --- Training.
-	for train_index, val_index in kf.split(X):
-		X_train, X_val = X.iloc[train_index, :], X.iloc[val_index, :]
-		y_train, y_val = y.iloc[train_index], y.iloc[val_index]
-		model.fit(X_train, y_train)
-		model.n_estimators += 1
-		y_hat = model.predict(X_val)  # y_hat is a.k.a y_pred
-		acc = accuracy_score(y_val, y_hat)
-		loss = mean_squared_error(y_val, y_hat)
+def build_model(args):
+	"""
+	:param args: argparse.ArgumentParser object (cast).
+	:return: RandomForestClassifier (not fitted).
+	"""
+	# min_impurity_split was removed from scikit-learn (1.0) - passed only when it is set, for older versions.
+	extra_params = {}
+	if args.min_impurity_split is not None:
+		extra_params['min_impurity_split'] = args.min_impurity_split
+	return RandomForestClassifier(
+		n_estimators=args.n_estimators,
+		criterion=args.criterion,
+		max_depth=args.max_depth,
+		min_samples_split=args.min_samples_split,
+		min_samples_leaf=args.min_samples_leaf,
+		min_weight_fraction_leaf=args.min_weight_fraction_leaf,
+		max_features=args.max_features,
+		max_leaf_nodes=args.max_leaf_nodes,
+		min_impurity_decrease=args.min_impurity_decrease,
+		bootstrap=args.bootstrap,
+		oob_score=args.oob_score,
+		n_jobs=args.n_jobs,
+		random_state=args.random_state,
+		verbose=args.verbose,
+		warm_start=True,
+		class_weight=args.class_weight,
+		**extra_params
+	)
 
-		train_acc.append(acc)
-		train_loss.append(loss)
+
+def grow_forest(model, X, y, batch, tol, patience, eval_set=None):
+	"""
+	Adds trees to the forest in batches (warm_start) until its error stops improving - by less than tol for patience
+	batches in a row - or model.n_estimators trees are reached.
+	The error is the out-of-bag error when eval_set is None (bootstrap must be True), otherwise the error of eval_set.
+	:param model: RandomForestClassifier (not fitted). its n_estimators is the ceiling.
+	:param X: array. the training set features.
+	:param y: array. the training set labels.
+	:param batch: int. number of trees added per batch.
+	:param tol: float. minimal improvement of the error per batch.
+	:param patience: int. number of batches in a row without improvement before stopping.
+	:param eval_set: (X_eval, y_eval) or None.
+	:return: (model, n_trees, errors) - the fitted forest and the error curve (error after every batch).
+	"""
+	max_trees = model.n_estimators
+	n_trees, errors = [], []
+	best_error, batches_without_improvement = None, 0
+	model.set_params(warm_start=True, oob_score=eval_set is None)
+	for trees in range(batch, max_trees + batch, batch):
+		model.set_params(n_estimators=min(trees, max_trees))
+		model.fit(X, y)
+		if eval_set is None:
+			error = 1. - model.oob_score_
+		else:
+			error = 1. - accuracy_score(eval_set[1], model.predict(eval_set[0]))
+		n_trees.append(model.n_estimators)
+		errors.append(error)
+
+		if best_error is None or best_error - error >= tol:
+			best_error, batches_without_improvement = error, 0
+		else:
+			batches_without_improvement += 1
+			if batches_without_improvement >= patience:
+				break
+	return model, n_trees, errors
+
+
+def train_growing_forest(model, train_set, test_set, project_dir, output_model_name, batch, tol, patience,
+						 eval_fraction, train_eval_size=None):
+	"""
+	Training without cross validation, where the forest grows until its out-of-bag error (or, without bootstrap, the
+	error of a held-out eval_fraction of the training set) flattens. See grow_forest.
+	"""
+	X_train, y_train = train_set
+	eval_set = None
+	if not model.bootstrap:
+		X_train, X_eval, y_train, y_eval = train_test_split(X_train, y_train, test_size=eval_fraction)
+		eval_set = (X_eval, y_eval)
+	# --- Training.
+	with stage('fit'):
+		model, n_trees, errors = grow_forest(model, X_train, y_train, batch, tol, patience, eval_set=eval_set)
+	train_metrics = training_metrics(model, X_train, y_train, train_eval_size)
 	# --- Testing.
 	X_test, y_test = test_set
-	y_pred = model.predict(X_test)
+	with stage('predict_test'):
+		y_pred = model.predict(X_test)
 	test_acc = accuracy_score(y_test, y_pred)
 	test_loss = mean_squared_error(y_test, y_pred)
 
 	exp = Experiment()
 	exp.log_param("model", output_model_name)
-	exp.log_param("folds", folds)
-	exp.log_metric("train_acc", train_acc)
-	exp.log_metric("train_loss", train_loss)
+	exp.log_param("n_estimators", model.n_estimators)
+	exp.log_metric("grow_error", errors, Xs=n_trees, x_axis="trees", y_axis="oob error" if eval_set is None else "eval error")
+	log_training_metrics(exp, train_metrics)
 	exp.log_param("test_acc", test_acc)
 	exp.log_param("test_loss", test_loss)
 
 	# Save model.
-	output_file_name = project_dir + "/" + output_model_name if project_dir is not None else output_model_name
-	pickle.dump(model, open(output_file_name, 'wb'))
+	save_model(model, project_dir, output_model_name,
+			   metrics=dict(train_metrics, grow_error=errors, test_acc=test_acc, test_loss=test_loss))
+	return model
 
 
-def train_without_cross_validation(model, train_set, test_set, project_dir, output_model_name):
+def train_with_oob_evaluation(model, train_set, test_set, project_dir, output_model_name, folds=None, workers=None,
+							  train_eval_size=None):
+	"""
+	Replaces the cross validation of random forests - a single fit, evaluated by its out-of-bag predictions (every
+	example is predicted only by the trees which didn't see it in their bootstrap sample). folds, workers and
+	train_eval_size are ignored, so it can replace both train_with_cross_validation and
+	train_without_cross_validation.
+	"""
 	X_train, y_train = train_set
+	model.set_params(oob_score=True)
 	# --- Training.
-	model.fit(X_train, y_train)
-	y_hat = model.predict(X_train)  # y_hat is a.k.a y_pred
+	with stage('fit'):
+		model.fit(X_train, y_train)
+	# Examples which are in the bootstrap samples of all the trees have no out-of-bag prediction.
+	oob_decision = model.oob_decision_function_
+	has_oob = np.nan_to_num(oob_decision).sum(axis=1) > 0
+	y_hat = model.classes_[np.argmax(oob_decision[has_oob], axis=1)]  # y_hat is a.k.a y_pred
 
-	train_acc = accuracy_score(y_train, y_hat)
-	train_loss = mean_squared_error(y_train, y_hat)
+	oob_acc = accuracy_score(y_train[has_oob], y_hat)
+	oob_loss = mean_squared_error(y_train[has_oob], y_hat)
 	# --- Testing.
 	X_test, y_test = test_set
-	y_pred = model.predict(X_test)
+	with stage('predict_test'):
+		y_pred = model.predict(X_test)
 	test_acc = accuracy_score(y_test, y_pred)
 	test_loss = mean_squared_error(y_test, y_pred)
 
 	exp = Experiment()
 	exp.log_param("model", output_model_name)
-	exp.log_param("train_acc", train_acc)
-	exp.log_param("train_loss", train_loss)
+	exp.log_param("oob_acc", oob_acc)
+	exp.log_param("oob_loss", oob_loss)
+	exp.log_param("oob_coverage", has_oob.mean())
 	exp.log_param("test_acc", test_acc)
 	exp.log_param("test_loss", test_loss)
 
 	# Save model.
-	output_file_name = project_dir + "/" + output_model_name if project_dir is not None else output_model_name
-	pickle.dump(model, open(output_file_name, 'wb'))
+	save_model(model, project_dir, output_model_name,
+			   metrics={'oob_acc': oob_acc, 'oob_loss': oob_loss, 'oob_coverage': has_oob.mean(), 'test_acc': test_acc,
+						'test_loss': test_loss})
+	return model
 
 
 def main(args):
 	args = _cast_types(args)
 
-	# Loading dataset.
-	data = pd.read_csv(args.data)
-	for col in data.columns:
-		if col.startswith('Unnamed'):
-			data = data.drop(columns=col, axis=1)
-
-	# Checking data sets sizes.
-	rows_num, cols_num = data.shape
-	if rows_num == 0:
-		raise Exception("Dataset Error: The given dataset has no examples.")
-	if cols_num < 2:
-		raise Exception("Dataset Error: Not enough columns.")
-
-	# Split to X and y (train & test).
-	X = data.iloc[:, :-1]
-	y = data.iloc[:, -1]
-	X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=args.test_size)
-
-	# Model initialization.
-	model = RandomForestClassifier(
-		n_estimators=args.n_estimators,
-		criterion=args.criterion,
-		max_depth=args.max_depth,
-		min_samples_split=args.min_samples_split,
-		min_samples_leaf=args.min_samples_leaf,
-		min_weight_fraction_leaf=args.min_weight_fraction_leaf,
-		max_features=args.max_features,
-		max_leaf_nodes=args.max_leaf_nodes,
-		min_impurity_decrease=args.min_impurity_decrease,
-		min_impurity_split=args.min_impurity_split,
-		bootstrap=args.bootstrap,
-		oob_score=args.oob_score,
-		n_jobs=args.n_jobs,
-		random_state=args.random_state,
-		verbose=args.verbose,
-		warm_start=True,
-		class_weight=args.class_weight
-	)
-
-	# Training with cross validation.
-	if args.x_val is not None:
-		train_with_cross_validation(model=model,
-									train_set=(X_train, y_train),
-									test_set=(X_test, y_test),
-									folds=args.x_val,
-									project_dir=args.project_dir,
-									output_model_name=args.output_model)
+	cross_validation, train = None, None
+	if args.oob_eval:
+		cross_validation, train = train_with_oob_evaluation, train_with_oob_evaluation
+	if args.grow:
+		train = functools.partial(train_growing_forest,
+								  batch=args.grow_batch,
+								  tol=args.grow_tol,
+								  patience=args.grow_patience,
+								  eval_fraction=args.grow_eval_fraction)
+	run(args, build_model, cross_validation=cross_validation, train=train)
 
-	# Training without cross validation.
-	else:
-		train_without_cross_validation(model=model,
-										train_set=(X_train, y_train),
-										test_set=(X_test, y_test),
-										project_dir=args.project_dir,
-										output_model_name=args.output_model)
 
-
-if __name__ == '__main__':
+def build_parser():
 	parser = argparse.ArgumentParser(description="""Random Forests Classifier""")
-	# ----- cnvrg.io params.
-	parser.add_argument('--data', action='store', dest='data', required=True,
-						help="""String. path to csv file: The data set for the classifier. Assumes the last column includes the labels. """)
-
-	parser.add_argument('--project_dir', action='store', dest='project_dir',
-						help="""--- For inner use of cnvrg.io ---""")
-
-	parser.add_argument('--output_dir', action='store', dest='output_dir',
-						help="""--- For inner use of cnvrg.io ---""")
-
-	parser.add_argument('--x_val', action='store', default="None", dest='x_val',
-						help="""Integer. Number of folds for the cross-validation. Default is None.""")
-
-	parser.add_argument('--test_size', action='store', default="0.2", dest='test_size',
-						help="""Float. The portion of the data of testing. Default is 0.2""")
+	add_common_args(parser, output_model="rf_model.sav")
 
-	parser.add_argument('--output_model', action='store', default="rf_model.sav", dest='output_model',
-						help="""String. The name of the output file which is a trained random forests model. Default is RandomForestModel.sav""")
 	# ----- model's params.
 	parser.add_argument('--n_estimators', action='store', default="10", dest='n_estimators',
 						help="""int: The number of trees in the forest. Default is 10""")
@@ -352,6 +387,35 @@ if __name__ == '__main__':
                         supposed to have weight one. For multi-output problems, a list of dicts can be provided in the
                         same order as the columns of y. Default is None.""")
 
-	args = parser.parse_args()
+	parser.add_argument('--grow', action='store', default="False", dest='grow',
+						help="""Boolean. Without --x_val, grows the forest in batches of --grow_batch trees (warm_start) 
+						until its out-of-bag error (the error of a held-out --grow_eval_fraction if bootstrap is False)
+						stops improving, so n_estimators is a ceiling. The error-vs-trees curve is logged. 
+						Default is False.""")
+
+	parser.add_argument('--grow_batch', action='store', default="10", dest='grow_batch',
+						help="""Integer. Number of trees added per batch of --grow. Default is 10.""")
+
+	parser.add_argument('--grow_tol', action='store', default="0.001", dest='grow_tol',
+						help="""Float. Minimal improvement of the error per batch of --grow. Default is 0.001.""")
+
+	parser.add_argument('--grow_patience', action='store', default="2", dest='grow_patience',
+						help="""Integer. Number of batches in a row without improvement before --grow stops. 
+						Default is 2.""")
+
+	parser.add_argument('--grow_eval_fraction', action='store', default="0.1", dest='grow_eval_fraction',
+						help="""Float. The portion of the training set held out to measure the error of --grow when 
+						bootstrap is False. Default is 0.1.""")
+
+	parser.add_argument('--oob_eval', action='store', default="False", dest='oob_eval',
+						help="""Boolean. Evaluates the forest by its out-of-bag predictions - a single fit instead of 
+						the --x_val refits (and instead of predicting the whole training set without --x_val). 
+						Requires bootstrap. Default is False.""")
+
+	return parser
+
+
+if __name__ == '__main__':
+	args = build_parser().parse_args()
 
 	main(args)
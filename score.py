@@ -0,0 +1,172 @@
+"""
+All rights reserved to cnvrg.io
+     http://www.cnvrg.io
+
+cnvrg.io - AI library
+
+score.py
+==============================================================================
+Batch scoring - streams a new loan file (raw, through the fitted preprocessor of preprocess.py, or already
+processed) in chunks through a saved model, and appends the predictions of every chunk to the output file.
+"""
+import os
+import time
+import pickle
+import argparse
+
+import numpy as np
+import pandas as pd
+
+from artifact import Artifact, is_artifact
+from compiled_trees import compile_model
+from dataset import iter_dataset, to_feature_array, DatasetWriter
+from knn_index import load_index, index_feature_columns
+from preprocess import Preprocessor, target_feature
+
+
+def load_model(path, compile_trees=False, verify=False):
+	"""
+	:param path: string. a model artifact written by the model scripts (*_model.sav, see artifact.py), a knn index
+	directory (knn.py --index_dir) or a pickled model (older versions of the model scripts).
+	:param compile_trees: boolean. If True, a random forest or xgboost model is compiled (see compiled_trees.py).
+	:param verify: boolean. If True, the payload of an artifact is checked against its content hash.
+	:return: fitted model.
+	"""
+	if is_artifact(path):
+		model = Artifact(path, verify=verify).model
+	elif os.path.isdir(path):
+		return load_index(path)
+	else:
+		with open(path, 'rb') as f:
+			model = pickle.load(f)
+	return compile_model(model) if compile_trees else model
+
+
+def model_feature_columns(path):
+	"""
+	:param path: string. a model (see load_model).
+	:return: list of strings or None. the features the model was trained on, in order - recorded by the artifact or
+	the knn index. None if the model records none (pickled models).
+	"""
+	if is_artifact(path):
+		return Artifact(path).feature_columns
+	if os.path.isdir(path):
+		return index_feature_columns(path)
+	return None
+
+
+def chunk_features(chunk, preprocessor=None, columns=None):
+	"""
+	:param chunk: data frame. a chunk of raw or processed data.
+	:param preprocessor: preprocess.Preprocessor or None. If given, the chunk is raw and is transformed by it.
+	:param columns: list of strings or None. the features the model was trained on, in order (see
+	model_feature_columns). Default is None - the columns of the (transformed) chunk in their own order, without the
+	target feature, as the model scripts train on them.
+	:return: C-contiguous float32 array of the features, in the order the model was trained on.
+	"""
+	if preprocessor is not None:
+		chunk = preprocessor.transform(chunk)
+	if columns is None:
+		columns = [col for col in chunk.columns if col != target_feature and not col.startswith('Unnamed')]
+	missing = [col for col in columns if col not in chunk.columns]
+	if missing:
+		raise Exception("Scoring Error: The data has no columns {}. Raw data requires --stats_file.".format(missing))
+	return to_feature_array(chunk[columns])
+
+
+def score_chunk(model, X, index, proba=True):
+	"""
+	:param model: fitted model.
+	:param X: array. the features of the chunk.
+	:param index: the index of the chunk (its row numbers in the input file).
+	:param proba: boolean. If True, the probabilities of the classes are added to the predictions.
+	:return: data frame. 'prediction' (+ 'probability_<class>' per class).
+	"""
+	if not proba:
+		return pd.DataFrame({'prediction': model.predict(X)}, index=index)
+	probabilities = model.predict_proba(X)
+	scores = pd.DataFrame(probabilities, index=index,
+						  columns=['probability_{}'.format(cls) for cls in model.classes_])
+	scores.insert(0, 'prediction', model.classes_[np.argmax(probabilities, axis=1)])
+	return scores
+
+
+def score(model, data_path, output_path, chunksize, preprocessor=None, keep_columns=(), proba=True, columns=None):
+	"""
+	Scores a data set chunk by chunk - the peak memory is about a single chunk.
+	:param model: fitted model.
+	:param data_path: string. path to csv, parquet or feather file.
+	:param output_path: string. path to the output csv, parquet or feather file.
+	:param chunksize: int. number of rows per chunk.
+	:param preprocessor: preprocess.Preprocessor or None. see chunk_features.
+	:param keep_columns: list of strings. columns of the input copied to the output (ex: an id column).
+	:param proba: boolean. see score_chunk.
+	:param columns: list of strings or None. see chunk_features.
+	:return: int. number of rows scored.
+	"""
+	writer = DatasetWriter(output_path)
+	rows_num = 0
+	try:
+		for chunk in iter_dataset(data_path, chunksize):
+			kept = chunk[list(keep_columns)].copy()
+			scores = score_chunk(model, chunk_features(chunk, preprocessor, columns), chunk.index, proba=proba)
+			writer.write(pd.concat([kept, scores], axis=1))
+			rows_num += len(chunk)
+	finally:
+		writer.close()
+	return rows_num
+
+
+def main(args):
+	args.chunksize = int(args.chunksize)
+	args.proba = (args.proba == "True" or args.proba == 'True')
+	args.keep_columns = [col for col in args.keep_columns.split(',') if col]
+	args.compile_trees = (args.compile_trees == "True" or args.compile_trees == 'True')
+
+	model = load_model(args.model, compile_trees=args.compile_trees, verify=True)
+	preprocessor = Preprocessor.load(args.stats_file) if args.stats_file is not None else None
+
+	start = time.perf_counter()
+	rows_num = score(model, args.data, args.output, args.chunksize, preprocessor=preprocessor,
+					 keep_columns=args.keep_columns, proba=args.proba, columns=model_feature_columns(args.model))
+	duration = time.perf_counter() - start
+	print("Scored {} rows in {:.2f} seconds ({:.0f} rows per second) -> {}".format(
+		rows_num, duration, rows_num / max(duration, 1e-9), args.output))
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description="""Batch scoring with a trained model""")
+	parser.add_argument('--model', action='store', dest='model', required=True,
+						help="""String. path to a model written by knn.py, random_forest.py or xgb.py (*_model.sav), or
+						to a knn index directory (knn.py --index_dir).""")
+
+	parser.add_argument('--data', action='store', dest='data', required=True,
+						help="""String. path to csv, parquet or feather file: The loans to score. Raw (as the input
+						of preprocess.py) with --stats_file, otherwise processed (as the output of preprocess.py).""")
+
+	parser.add_argument('--stats_file', action='store', default=None, dest='stats_file',
+						help="""String. Path to the json file of the fitted preprocessor (preprocess.py --stats_file).
+						If given, the data is raw and is preprocessed chunk by chunk with it. Default is None
+						(processed data).""")
+
+	parser.add_argument('--output', action='store', default="predictions.csv", dest='output',
+						help="""String. Path to the output csv, parquet or feather file. Default is predictions.csv""")
+
+	parser.add_argument('--chunksize', action='store', default="100000", dest='chunksize',
+						help="""Integer. Number of rows scored at once. Default is 100000""")
+
+	parser.add_argument('--proba', action='store', default="True", dest='proba',
+						help="""Boolean. Whether to write the probabilities of the classes with the predictions.
+						Default is True""")
+
+	parser.add_argument('--keep_columns', action='store', default="", dest='keep_columns',
+						help="""String. Comma separated columns of the input copied to the output (ex: an id column).
+						Default is none.""")
+
+	parser.add_argument('--compile_trees', action='store', default="False", dest='compile_trees',
+						help="""Boolean. Whether to score a random forest or xgboost model with its compiled trees
+						(compiled_trees.py - the same predictions, faster). Default is False""")
+
+	args = parser.parse_args()
+
+	main(args)
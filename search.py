@@ -0,0 +1,310 @@
+"""
+All rights reserved to cnvrg.io
+     http://www.cnvrg.io
+
+cnvrg.io - AI library
+
+search.py
+==============================================================================
+"""
+import math
+import time
+import shlex
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from cnvrg import Experiment
+from sklearn.metrics import accuracy_score, mean_squared_error
+from sklearn.model_selection import train_test_split
+from threadpoolctl import threadpool_limits
+
+from artifact import update_manifest, prepare_artifact_path
+from harness import load_dataset, save_model, get_model_path
+from parallel_cv import get_threads_per_worker
+from sweep import model_scripts, build_sweep_model
+
+# Default search spaces - the scripts' params, in the format of parse_space.
+default_spaces = {
+	'knn': "n_neighbors=1:50:int,weights=uniform|distance,leaf_size=10:100:int,p=1|2",
+	'random_forest': "n_estimators=10:300:int,criterion=gini|entropy,max_depth=2:30:int,min_samples_split=2:20:int,"
+					 "min_samples_leaf=1:20:int,max_features=sqrt|log2|None",
+	'xgb': "n_estimators=50:500:int,max_depth=2:10:int,learning_rate=0.01:0.3:log,min_child_weight=1:10:int,"
+		   "gamma=0:5:int,reg_lambda=0:10:int",
+}
+
+# The training data of the trial workers (set once per process by _init_worker).
+_worker_data = {}
+
+
+def parse_space(space):
+	"""
+	:param space: string. comma separated params, each one of:
+		name=low:high:int - uniform integer in [low, high].
+		name=low:high:float - uniform float in [low, high].
+		name=low:high:log - log-uniform float in [low, high].
+		name=a|b|c - one of the values.
+	:return: dict. {name: ('choice', values) or (kind, low, high)}
+	"""
+	parsed = {}
+	for param in space.split(','):
+		name, values = param.split('=')
+		if '|' in values or ':' not in values:
+			parsed[name.strip()] = ('choice', values.split('|'))
+		else:
+			low, high, kind = values.split(':')
+			if kind not in ['int', 'float', 'log']:
+				raise Exception("Search Error: Unknown kind {} of the param {}.".format(kind, name))
+			parsed[name.strip()] = (kind, float(low), float(high))
+	return parsed
+
+
+def sample_params(space, rng):
+	"""
+	:param space: dict. see parse_space.
+	:param rng: numpy.random.RandomState.
+	:return: dict. {name: string value} - values as they are passed to the model scripts.
+	"""
+	params = {}
+	for name, spec in space.items():
+		if spec[0] == 'choice':
+			params[name] = spec[1][rng.randint(len(spec[1]))]
+		elif spec[0] == 'int':
+			params[name] = str(rng.randint(int(spec[1]), int(spec[2]) + 1))
+		elif spec[0] == 'float':
+			params[name] = repr(rng.uniform(spec[1], spec[2]))
+		else:
+			params[name] = repr(math.exp(rng.uniform(math.log(spec[1]), math.log(spec[2]))))
+	return params
+
+
+def params_to_args(params):
+	return ' '.join('--{} {}'.format(name, shlex.quote(value)) for name, value in params.items())
+
+
+def _init_worker(train_set, val_set, threads):
+	_worker_data['train_set'], _worker_data['val_set'] = train_set, val_set
+	_worker_data['threads'] = threads
+	_worker_data['limits'] = threadpool_limits(limits=threads)
+
+
+def _run_trial(task):
+	"""
+	Fits a single configuration with the given budget and scores it over the validation set.
+	:param task: (model name, params dict, resource kind, resource).
+	:return: (validation accuracy, validation loss, fit time).
+	"""
+	name, params, resource_kind, resource = task
+	X_train, y_train = _worker_data['train_set']
+	X_val, y_val = _worker_data['val_set']
+
+	model = build_sweep_model(name, params_to_args(params), data='')
+	threads = _worker_data['threads']
+	model.set_params(**{param: threads for param in ['n_jobs', 'nthread'] if param in model.get_params()})
+	if resource_kind == 'n_estimators':
+		model.set_params(n_estimators=int(resource))
+	else:
+		rows = max(2, int(len(X_train) * resource))
+		X_train, y_train = X_train[:rows], y_train[:rows]
+
+	start = time.perf_counter()
+	model.fit(X_train, y_train)
+	fit_time = time.perf_counter() - start
+	y_hat = model.predict(X_val)  # y_hat is a.k.a y_pred
+	return accuracy_score(y_val, y_hat), mean_squared_error(y_val, y_hat), fit_time
+
+
+def successive_halving(name, configs, min_resource, max_resource, eta, resource_kind, pool, bracket=0):
+	"""
+	Runs all the configs with min_resource, keeps the best 1/eta of them and multiplies the resource by eta, until a
+	single config is left or the resource reaches max_resource.
+	:return: list of dicts. a row per trial.
+	"""
+	history = []
+	resource, rung = min_resource, 0
+	configs = list(configs)
+	while True:
+		tasks = [(name, params, resource_kind, resource) for params in configs]
+		results = list(pool.map(_run_trial, tasks))
+		for params, (acc, loss, fit_time) in zip(configs, results):
+			history.append({'bracket': bracket, 'rung': rung, 'resource': resource, 'params': params_to_args(params),
+							'val_acc': acc, 'val_loss': loss, 'fit_time': fit_time})
+
+		if len(configs) <= 1 or resource >= max_resource:
+			break
+		keep = max(1, len(configs) // eta)
+		order = np.argsort([-acc for acc, _, _ in results], kind='stable')
+		configs = [configs[ind] for ind in order[:keep]]
+		# The last rung gets exactly max_resource (resource * eta might miss it by a rounding error).
+		resource = max_resource if resource * eta >= max_resource * (1 - 1e-9) else resource * eta
+		if resource_kind == 'n_estimators':
+			resource = int(round(resource))
+		rung += 1
+	return history
+
+
+def hyperband(name, space, min_resource, max_resource, eta, resource_kind, pool, rng):
+	"""
+	Runs successive halving brackets from many configs with a small resource to a few configs with max_resource.
+	:return: list of dicts. a row per trial.
+	"""
+	s_max = int(math.floor(math.log(max_resource / min_resource, eta) + 1e-9))
+	history = []
+	for s in range(s_max, -1, -1):
+		n = int(math.ceil((s_max + 1) / (s + 1) * eta ** s))
+		resource = max_resource * eta ** (-s)
+		if resource_kind == 'n_estimators':
+			resource = max(1, int(round(resource)))
+		configs = [sample_params(space, rng) for _ in range(n)]
+		history += successive_halving(name, configs, resource, max_resource, eta, resource_kind, pool, bracket=s)
+	return history
+
+
+def main(args):
+	args.n_trials = int(args.n_trials)
+	args.eta = int(args.eta)
+	args.workers = int(args.workers)
+	args.test_size = float(args.test_size)
+	args.val_size = float(args.val_size)
+	args.random_state = None if args.random_state == 'None' else int(args.random_state)
+	if args.model not in model_scripts:
+		raise Exception("Search Error: Unknown model {}. Expected one of {}.".format(args.model, list(model_scripts)))
+	if args.method not in ['halving', 'hyperband']:
+		raise Exception("Search Error: Unknown method {}.".format(args.method))
+	if args.resource not in ['fraction', 'n_estimators']:
+		raise Exception("Search Error: Unknown resource {}.".format(args.resource))
+	if args.resource == 'n_estimators' and args.model == 'knn':
+		raise Exception("Search Error: knn has no n_estimators, use --resource fraction.")
+
+	# Budgets.
+	if args.resource == 'fraction':
+		args.max_resource = 1.0 if args.max_resource == 'None' else float(args.max_resource)
+		args.min_resource = args.max_resource / args.eta ** 3 if args.min_resource == 'None' else \
+			float(args.min_resource)
+	else:
+		args.max_resource = 500 if args.max_resource == 'None' else int(args.max_resource)
+		args.min_resource = max(1, args.max_resource // args.eta ** 3) if args.min_resource == 'None' else \
+			int(args.min_resource)
+
+	space = parse_space(args.space if args.space is not None else default_spaces[args.model])
+	if args.resource == 'n_estimators':
+		space.pop('n_estimators', None)
+	rng = np.random.RandomState(args.random_state)
+
+	# The output path is checked before the search, rather than failing after it.
+	prepare_artifact_path(get_model_path(args.project_dir, args.output_model))
+
+	# Loading and splitting the data set - once for all the trials.
+	X, y, feature_schema = load_dataset(args.data, return_schema=True)
+	X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=args.test_size, random_state=args.random_state)
+	X_fit, X_val, y_fit, y_val = train_test_split(X_train, y_train, test_size=args.val_size,
+												  random_state=args.random_state)
+
+	threads = get_threads_per_worker(args.workers)
+	with ProcessPoolExecutor(max_workers=args.workers, initializer=_init_worker,
+							 initargs=((X_fit, y_fit), (X_val, y_val), threads)) as pool:
+		if args.method == 'hyperband':
+			history = hyperband(args.model, space, args.min_resource, args.max_resource, args.eta, args.resource,
+								pool, rng)
+		else:
+			configs = [sample_params(space, rng) for _ in range(args.n_trials)]
+			history = successive_halving(args.model, configs, args.min_resource, args.max_resource, args.eta,
+										 args.resource, pool)
+
+	trials = pd.DataFrame(history)
+	final_trials = trials[trials['resource'] == args.max_resource]
+	if len(final_trials) == 0:
+		final_trials = trials
+	best_args = final_trials.sort_values('val_acc', ascending=False, kind='mergesort').iloc[0]['params']
+	print(trials.sort_values(['val_acc'], ascending=False).head(10).to_string())
+
+	# The best config, with the full budget, over the whole training set.
+	model = build_sweep_model(args.model, best_args, data=args.data)
+	if args.resource == 'n_estimators':
+		model.set_params(n_estimators=args.max_resource)
+	model.fit(X_train, y_train)
+	y_pred = model.predict(X_test)
+	test_acc = accuracy_score(y_test, y_pred)
+	test_loss = mean_squared_error(y_test, y_pred)
+	print("best: {} test_acc: {:.4f} test_loss: {:.4f}".format(best_args, test_acc, test_loss))
+
+	if args.trials_output is not None:
+		trials.to_csv(args.trials_output, index=False)
+
+	exp = Experiment()
+	exp.log_param("model", args.output_model)
+	exp.log_param("search_method", args.method)
+	exp.log_param("trials", len(trials))
+	exp.log_param("best_params", best_args)
+	exp.log_param("test_acc", test_acc)
+	exp.log_param("test_loss", test_loss)
+
+	# Save model (with the feature schema of the data set, as harness.run does).
+	model_path = save_model(model, args.project_dir, args.output_model,
+							metrics={'best_params': best_args, 'test_acc': test_acc, 'test_loss': test_loss})
+	update_manifest(model_path, feature_schema=feature_schema, data=args.data)
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description="""Hyperparameter search - random search with successive halving / hyperband""")
+	parser.add_argument('--data', action='store', dest='data', required=True,
+						help="""String. path to csv, parquet or feather file: The data set for the classifier. Assumes the last column includes the labels. """)
+
+	parser.add_argument('--project_dir', action='store', dest='project_dir',
+						help="""--- For inner use of cnvrg.io ---""")
+
+	parser.add_argument('--output_dir', action='store', dest='output_dir',
+						help="""--- For inner use of cnvrg.io ---""")
+
+	parser.add_argument('--model', action='store', default="xgb", dest='model',
+						help="""String. knn, random_forest or xgb. Default is xgb.""")
+
+	parser.add_argument('--space', action='store', default=None, dest='space',
+						help="""String. The search space, comma separated params of the model script: name=low:high:int,
+						name=low:high:float, name=low:high:log or name=a|b|c. Default is the built-in space of the model.""")
+
+	parser.add_argument('--method', action='store', default="halving", dest='method',
+						help="""String. 'halving' (successive halving over --n_trials random configs) or 'hyperband'.
+						Default is halving.""")
+
+	parser.add_argument('--n_trials', action='store', default="27", dest='n_trials',
+						help="""Integer. Number of random configs of successive halving. Default is 27.""")
+
+	parser.add_argument('--resource', action='store', default="fraction", dest='resource',
+						help="""String. The budget grown per rung - 'fraction' (of the training data) or 'n_estimators'.
+						Default is fraction.""")
+
+	parser.add_argument('--min_resource', action='store', default="None", dest='min_resource',
+						help="""Float or Integer. The budget of the first rung. Default is max_resource / eta^3.""")
+
+	parser.add_argument('--max_resource', action='store', default="None", dest='max_resource',
+						help="""Float or Integer. The budget of the last rung. Default is 1.0 (fraction) or 500
+						(n_estimators).""")
+
+	parser.add_argument('--eta', action='store', default="3", dest='eta',
+						help="""Integer. 1/eta of the configs are kept per rung and the budget is multiplied by eta.
+						Default is 3.""")
+
+	parser.add_argument('--workers', action='store', default="4", dest='workers',
+						help="""Integer. Number of processes running trials. The threads of every trial are limited so
+						that all the workers together use no more threads than cores. Default is 4.""")
+
+	parser.add_argument('--test_size', action='store', default="0.2", dest='test_size',
+						help="""Float. The portion of the data of testing. Default is 0.2""")
+
+	parser.add_argument('--val_size', action='store', default="0.2", dest='val_size',
+						help="""Float. The portion of the training data the trials are scored on. Default is 0.2""")
+
+	parser.add_argument('--random_state', action='store', default="None", dest='random_state',
+						help="""Integer. Seed of the sampling of the configs and of the splits. Default is None.""")
+
+	parser.add_argument('--trials_output', action='store', default=None, dest='trials_output',
+						help="""String. Path to a csv file for all the trials. Default is None.""")
+
+	parser.add_argument('--output_model', action='store', default="search_model.sav", dest='output_model',
+						help="""String. The name of the output file which is the best trained model. Default is search_model.sav""")
+
+	args = parser.parse_args()
+
+	main(args)
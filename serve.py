@@ -0,0 +1,467 @@
+"""
+All rights reserved to cnvrg.io
+     http://www.cnvrg.io
+
+cnvrg.io - AI library
+
+serve.py
+==============================================================================
+Local scoring server - a long-running asyncio HTTP server (over TCP or a Unix socket) which keeps the models in an
+LRU cache and coalesces concurrent requests of the same model into micro-batches.
+
+    POST /predict  {"model": "xgb_model.sav", "features": [...] | {"int_rate": ..., ...}}
+                   {"model": "xgb_model.sav", "loan": {<raw loan columns>}}    (requires --stats_file)
+                   -> {"prediction": ..., "probabilities": {"<class>": ...}}
+    GET  /stats    -> requests, latency percentiles (p50/p99), batches and the cached models.
+"""
+import os
+import json
+import time
+import asyncio
+import argparse
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from artifact import is_artifact, manifest_name
+from preprocess import Preprocessor
+from score import load_model, model_feature_columns, chunk_features
+
+reasons = {200: 'OK', 400: 'Bad Request', 403: 'Forbidden', 404: 'Not Found', 500: 'Internal Server Error'}
+
+
+class LatencyStats:
+	"""
+	Latencies of the last requests (a sliding window) and their percentiles.
+	"""
+	def __init__(self, window=10000):
+		self.latencies = deque(maxlen=window)
+		self.requests = 0
+		self.errors = 0
+
+	def add(self, seconds, error=False):
+		self.latencies.append(seconds)
+		self.requests += 1
+		self.errors += int(error)
+
+	def percentile(self, q):
+		"""
+		:param q: float. percentile in [0, 100].
+		:return: float or None. the percentile of the window in milliseconds (None if empty).
+		"""
+		if not self.latencies:
+			return None
+		return float(np.percentile(np.fromiter(self.latencies, dtype=float), q)) * 1000
+
+	def summary(self):
+		return {'requests': self.requests,
+				'errors': self.errors,
+				'p50_ms': self.percentile(50),
+				'p99_ms': self.percentile(99),
+				'max_ms': self.percentile(100)}
+
+
+class MicroBatcher:
+	"""
+	Coalesces the requests of a model - a request waits at most max_wait_ms for others, and up to max_batch requests
+	are predicted by a single predict_proba call (in the prediction thread pool, so the event loop keeps serving).
+	"""
+	def __init__(self, model, executor, preprocessor=None, max_batch=64, max_wait_ms=2., columns=None):
+		"""
+		:param model: fitted model.
+		:param executor: concurrent.futures executor the predictions run in.
+		:param preprocessor: preprocess.Preprocessor or None. transforms the raw loans of the requests.
+		:param max_batch: int. maximal number of requests per batch.
+		:param max_wait_ms: float. maximal time (ms) the first request of a batch waits for more requests.
+		:param columns: list of strings or None. the features the model was trained on, in order (see
+		score.model_feature_columns). Default is None - the features of a request are taken in their own order.
+		"""
+		self.model = model
+		self.columns = columns
+		# The number of features of a request (list), if known.
+		self.n_features = len(columns) if columns is not None else getattr(model, 'n_features_in_', None)
+		self.executor = executor
+		self.preprocessor = preprocessor
+		self.max_batch = max_batch
+		self.max_wait = max_wait_ms / 1000.
+		self.queue = asyncio.Queue()
+		self.batches = 0
+		self.batched_requests = 0
+		self._task = asyncio.ensure_future(self._run())
+
+	async def predict(self, row, raw=False):
+		"""
+		:param row: features (list in the order of columns or dict by column) or a raw loan (dict).
+		:param raw: boolean. whether row is a raw loan.
+		:return: (prediction, probabilities) of the row.
+		"""
+		future = asyncio.get_event_loop().create_future()
+		await self.queue.put((row, raw, future))
+		return await future
+
+	def _row_features(self, row, raw):
+		"""
+		:return: float32 array. the features of a single request (see predict).
+		"""
+		if raw or isinstance(row, dict):
+			if not isinstance(row, dict):
+				raise ValueError("Request Error: A raw loan is a dict of its columns.")
+			return chunk_features(pd.DataFrame([row]), self.preprocessor if raw else None, self.columns)[0]
+		features = np.asarray(row, dtype=np.float32)
+		if features.ndim != 1 or (self.n_features is not None and features.size != self.n_features):
+			raise ValueError("Request Error: Expected {} features, got {}.".format(self.n_features, features.size))
+		return features
+
+	def _batch_features(self, rows, raw):
+		"""
+		:return: list. the features of every request, or the error it caused.
+		"""
+		# Dicts (and raw loans) with the same keys are transformed as a single data frame (dicts with other keys would
+		# get NaN columns); if any of them is bad, they are transformed one by one, so only the bad ones fail.
+		if len(rows) > 1 and all(isinstance(row, dict) and row.keys() == rows[0].keys() for row in rows):
+			try:
+				return list(chunk_features(pd.DataFrame(rows), self.preprocessor if raw else None, self.columns))
+			except Exception:
+				pass
+		features = []
+		for row in rows:
+			try:
+				features.append(self._row_features(row, raw))
+			except Exception as error:
+				features.append(error if isinstance(error, ValueError) else ValueError("Request Error: {}".format(error)))
+		return features
+
+	def _predict_batch(self, items):
+		"""
+		:param items: list of (row, raw, future).
+		:return: list. the probabilities of every request, or the error it caused.
+		"""
+		results = [None] * len(items)
+		# Raw loans, dicts and lists of features are transformed separately, then predicted together.
+		groups = OrderedDict()
+		for pos, (row, raw, _) in enumerate(items):
+			groups.setdefault((raw, isinstance(row, dict)), []).append(pos)
+		for (raw, _), positions in groups.items():
+			for pos, features in zip(positions, self._batch_features([items[pos][0] for pos in positions], raw)):
+				results[pos] = features
+
+		valid = [pos for pos, features in enumerate(results) if not isinstance(features, Exception)]
+		if not valid:
+			return results
+		try:
+			probabilities = self.model.predict_proba(np.stack([results[pos] for pos in valid]))
+		except Exception:
+			# Predicted one by one, so an error fails only its own request.
+			probabilities = []
+			for pos in valid:
+				try:
+					probabilities.append(self.model.predict_proba(results[pos][None, :])[0])
+				except Exception as error:
+					probabilities.append(error)
+		for pos, row_probabilities in zip(valid, probabilities):
+			results[pos] = row_probabilities
+		return results
+
+	async def _run(self):
+		loop = asyncio.get_event_loop()
+		while True:
+			items = [await self.queue.get()]
+			if items[0] is None:
+				return
+			deadline = loop.time() + self.max_wait
+			closing = False
+			while len(items) < self.max_batch:
+				timeout = deadline - loop.time()
+				try:
+					item = self.queue.get_nowait() if timeout <= 0 else await asyncio.wait_for(self.queue.get(), timeout)
+				except (asyncio.QueueEmpty, asyncio.TimeoutError):
+					break
+				if item is None:
+					closing = True
+					break
+				items.append(item)
+
+			self.batches += 1
+			self.batched_requests += len(items)
+			try:
+				results = await loop.run_in_executor(self.executor, self._predict_batch, items)
+				for (_, _, future), probabilities in zip(items, results):
+					if future.done():
+						continue
+					if isinstance(probabilities, Exception):
+						future.set_exception(probabilities)
+					else:
+						prediction = self.model.classes_[int(np.argmax(probabilities))]
+						future.set_result((prediction, probabilities))
+			except Exception as error:
+				for _, _, future in items:
+					if not future.done():
+						future.set_exception(error)
+			if closing:
+				return
+
+	def close(self):
+		"""
+		Stops the batcher once the queued requests are predicted.
+		"""
+		self.queue.put_nowait(None)
+
+
+class ModelCache:
+	"""
+	LRU cache of the served models, keyed by (path, mtime) - a model file which is rewritten (a retrained model) is
+	loaded again on its next request. Every cached model has its own MicroBatcher.
+	Loading a model unpickles it, so only the models inside model_dir and the allowed paths are served.
+	"""
+	def __init__(self, max_models, executor, preprocessor=None, max_batch=64, max_wait_ms=2., compile_trees=False,
+				 model_dir=None, allowed=()):
+		"""
+		:param model_dir: string or None. the directory of the served models - the model of a request is a path
+		relative to it.
+		:param allowed: list of strings. paths of models served in addition to (or without) model_dir.
+		"""
+		self.model_dir = os.path.realpath(model_dir) if model_dir is not None else None
+		self.allowed = set(os.path.realpath(path) for path in allowed)
+		self.max_models = max_models
+		self.executor = executor
+		self.preprocessor = preprocessor
+		self.max_batch = max_batch
+		self.max_wait_ms = max_wait_ms
+		self.compile_trees = compile_trees
+		self.entries = OrderedDict()
+		self.loads = 0
+		self._loading = {}
+
+	def _load(self, path):
+		return load_model(path, compile_trees=self.compile_trees), model_feature_columns(path)
+
+	def resolve(self, name):
+		"""
+		:param name: string. the model of a request.
+		:return: string. the real path of the model.
+		:raise PermissionError: if the model is neither inside model_dir nor allowed.
+		"""
+		if name in self.allowed or os.path.realpath(name) in self.allowed:
+			return os.path.realpath(name)
+		if self.model_dir is not None and not os.path.isabs(name):
+			path = os.path.realpath(os.path.join(self.model_dir, name))
+			if path != self.model_dir and os.path.commonpath([path, self.model_dir]) == self.model_dir:
+				return path
+		raise PermissionError(name)
+
+	async def get(self, name):
+		"""
+		:param name: string. model artifact (or knn index directory, see score.load_model), relative to model_dir or
+		an allowed path.
+		:return: MicroBatcher of the model.
+		"""
+		path = self.resolve(name)
+		if not os.path.exists(path):
+			raise FileNotFoundError(path)
+		# An artifact is rewritten as a whole, its manifest last.
+		mtime = os.path.getmtime(os.path.join(path, manifest_name) if is_artifact(path) else path)
+		key = (os.path.abspath(path), mtime)
+		if key in self.entries:
+			self.entries.move_to_end(key)
+			return self.entries[key]
+
+		# Concurrent requests of a model which isn't cached yet share a single load.
+		if key not in self._loading:
+			self._loading[key] = asyncio.get_event_loop().run_in_executor(self.executor, self._load, path)
+		try:
+			model, columns = await self._loading[key]
+		finally:
+			self._loading.pop(key, None)
+		if key in self.entries:
+			return self.entries[key]
+		self.loads += 1
+
+		# Older versions of the same file are dropped, then the least recently used models.
+		for old_key in [old_key for old_key in self.entries if old_key[0] == key[0]]:
+			self.entries.pop(old_key).close()
+		while len(self.entries) >= self.max_models:
+			self.entries.popitem(last=False)[1].close()
+		self.entries[key] = MicroBatcher(model, self.executor, self.preprocessor, self.max_batch, self.max_wait_ms,
+										 columns=columns)
+		return self.entries[key]
+
+	def summary(self):
+		return {'loads': self.loads,
+				'models': [{'path': path,
+							'mtime': mtime,
+							'batches': batcher.batches,
+							'mean_batch_size': batcher.batched_requests / max(batcher.batches, 1)}
+						   for (path, mtime), batcher in self.entries.items()]}
+
+
+class ScoringServer:
+	"""
+	A minimal HTTP/1.1 server (keep-alive, JSON bodies) over asyncio streams.
+	"""
+	def __init__(self, cache, latency_window=10000):
+		self.cache = cache
+		self.stats = LatencyStats(latency_window)
+
+	async def handle_predict(self, request):
+		if 'model' not in request or ('features' not in request and 'loan' not in request):
+			return 400, {'error': "Expected a 'model' and 'features' or 'loan'."}
+		raw = 'loan' in request
+		if raw and self.cache.preprocessor is None:
+			return 400, {'error': "Raw loans require the server to run with --stats_file."}
+		try:
+			batcher = await self.cache.get(request['model'])
+		except PermissionError:
+			return 403, {'error': "The model {} isn't served.".format(request['model'])}
+		except FileNotFoundError:
+			return 404, {'error': "No model {}.".format(request['model'])}
+
+		row = request['loan'] if raw else request['features']
+		if not raw and isinstance(row, list) and batcher.n_features is not None and len(row) != batcher.n_features:
+			return 400, {'error': "Expected {} features, got {}.".format(batcher.n_features, len(row))}
+		try:
+			prediction, probabilities = await batcher.predict(row, raw=raw)
+		except ValueError as error:
+			return 400, {'error': str(error)}
+		return 200, {'prediction': prediction.item() if isinstance(prediction, np.generic) else prediction,
+					 'probabilities': {str(cls): float(p) for cls, p in zip(batcher.model.classes_, probabilities)}}
+
+	async def route(self, method, path, body):
+		if method == 'GET' and path == '/stats':
+			stats = self.stats.summary()
+			stats.update(self.cache.summary())
+			return 200, stats
+		if method == 'POST' and path == '/predict':
+			try:
+				request = json.loads(body.decode() or '{}')
+			except ValueError:
+				return 400, {'error': "Invalid JSON."}
+			return await self.handle_predict(request)
+		return 404, {'error': "No route {} {}.".format(method, path)}
+
+	async def handle_connection(self, reader, writer):
+		try:
+			while True:
+				request_line = await reader.readline()
+				if not request_line.strip():
+					break
+				method, path = request_line.decode().split()[:2]
+				headers = {}
+				while True:
+					line = await reader.readline()
+					if not line.strip():
+						break
+					name, _, value = line.decode().partition(':')
+					headers[name.strip().lower()] = value.strip()
+				body = await reader.readexactly(int(headers.get('content-length', 0)))
+
+				start = time.perf_counter()
+				try:
+					status, response = await self.route(method, path, body)
+				except Exception as error:
+					status, response = 500, {'error': str(error)}
+				if path == '/predict':
+					self.stats.add(time.perf_counter() - start, error=status != 200)
+
+				payload = json.dumps(response).encode()
+				writer.write("HTTP/1.1 {} {}\r\nContent-Type: application/json\r\nContent-Length: {}\r\n\r\n".format(
+					status, reasons[status], len(payload)).encode() + payload)
+				await writer.drain()
+				if headers.get('connection', '').lower() == 'close':
+					break
+		except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+			pass
+		finally:
+			writer.close()
+
+
+async def serve(server, host='127.0.0.1', port=8080, socket_path=None):
+	"""
+	:param server: ScoringServer.
+	:param host: string. TCP host (without socket_path).
+	:param port: int. TCP port (without socket_path).
+	:param socket_path: string or None. If given, the server listens on this Unix socket instead of TCP.
+	"""
+	if socket_path is not None:
+		if os.path.exists(socket_path):
+			os.remove(socket_path)
+		listener = await asyncio.start_unix_server(server.handle_connection, path=socket_path)
+		print("Serving on unix socket {}".format(socket_path))
+	else:
+		listener = await asyncio.start_server(server.handle_connection, host=host, port=port)
+		print("Serving on http://{}:{}".format(host, port))
+	async with listener:
+		await listener.serve_forever()
+
+
+def main(args):
+	args.port = int(args.port)
+	args.max_models = int(args.max_models)
+	args.max_batch = int(args.max_batch)
+	args.max_wait_ms = float(args.max_wait_ms)
+	args.predict_threads = int(args.predict_threads)
+	args.compile_trees = (args.compile_trees == "True" or args.compile_trees == 'True')
+
+	preload = [path for path in args.preload.split(',') if path]
+	if args.model_dir is None and not preload:
+		raise Exception("Serving Error: No models to serve, --model_dir or --preload is required.")
+
+	preprocessor = Preprocessor.load(args.stats_file) if args.stats_file is not None else None
+
+	async def start():
+		# The cache (and its batchers) are created in the event loop they run in.
+		executor = ThreadPoolExecutor(max_workers=args.predict_threads)
+		cache = ModelCache(args.max_models, executor, preprocessor, args.max_batch, args.max_wait_ms,
+						   compile_trees=args.compile_trees, model_dir=args.model_dir, allowed=preload)
+		for path in preload:
+			await cache.get(path)
+		await serve(ScoringServer(cache), args.host, args.port, args.socket)
+
+	asyncio.run(start())
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description="""Scoring server""")
+	parser.add_argument('--host', action='store', default="127.0.0.1", dest='host',
+						help="""String. Host to listen on. Default is 127.0.0.1""")
+
+	parser.add_argument('--port', action='store', default="8080", dest='port',
+						help="""Integer. Port to listen on. Default is 8080""")
+
+	parser.add_argument('--socket', action='store', default=None, dest='socket',
+						help="""String. Path of a Unix socket to listen on instead of host:port. Default is None.""")
+
+	parser.add_argument('--max_models', action='store', default="4", dest='max_models',
+						help="""Integer. Number of models kept in memory (least recently used are evicted). Default is 4""")
+
+	parser.add_argument('--max_batch', action='store', default="64", dest='max_batch',
+						help="""Integer. Maximal number of requests predicted together. Default is 64""")
+
+	parser.add_argument('--max_wait_ms', action='store', default="2", dest='max_wait_ms',
+						help="""Float. Maximal time (ms) a request waits for others to be batched with. Bounds the
+						latency added by the batching. Default is 2""")
+
+	parser.add_argument('--predict_threads', action='store', default="1", dest='predict_threads',
+						help="""Integer. Number of threads running the predictions and the model loads. Default is 1""")
+
+	parser.add_argument('--stats_file', action='store', default=None, dest='stats_file',
+						help="""String. Path to the json file of the fitted preprocessor (preprocess.py --stats_file),
+						required for requests of raw loans. Default is None.""")
+
+	parser.add_argument('--compile_trees', action='store', default="False", dest='compile_trees',
+						help="""Boolean. Whether random forest and xgboost models are served by their compiled trees
+						(compiled_trees.py - the same predictions, lower single-request latency). Default is False""")
+
+	parser.add_argument('--model_dir', action='store', default=None, dest='model_dir',
+						help="""String. Directory of the served models - the "model" of a request is a path relative to
+						it, and models outside it are refused (loading a model unpickles it). Default is None (only the
+						--preload models are served).""")
+
+	parser.add_argument('--preload', action='store', default="", dest='preload',
+						help="""String. Comma separated model files loaded on start. They are served (by the same paths)
+						even outside --model_dir. Default is none.""")
+
+	args = parser.parse_args()
+
+	main(args)
@@ -0,0 +1,123 @@
+"""
+All rights reserved to cnvrg.io
+     http://www.cnvrg.io
+
+cnvrg.io - AI library
+
+sweep.py
+==============================================================================
+"""
+import time
+import shlex
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+from sklearn.metrics import accuracy_score, mean_squared_error
+from sklearn.model_selection import train_test_split
+
+import knn
+import xgb
+import random_forest
+from harness import load_dataset
+
+# The model scripts the sweep can train.
+model_scripts = {'knn': knn, 'random_forest': random_forest, 'xgb': xgb}
+
+
+def build_sweep_model(name, model_args, data):
+	"""
+	Builds a model the same way its script does, from the script's params.
+	:param name: string. one of model_scripts.
+	:param model_args: string. the model's params as they are passed to its script (ex: "--n_neighbors 7").
+	:param data: string. path of the data set (required by the scripts' parsers).
+	:return: sklearn-like estimator (not fitted).
+	"""
+	script = model_scripts[name]
+	args = script.build_parser().parse_args(['--data', data] + shlex.split(model_args))
+	return script.build_model(script._cast_types(args))
+
+
+def fit_and_score(name, model, train_set, test_set):
+	"""
+	:return: dict. a row of the comparison table.
+	"""
+	X_train, y_train = train_set
+	X_test, y_test = test_set
+
+	start = time.perf_counter()
+	model.fit(X_train, y_train)
+	fit_time = time.perf_counter() - start
+
+	start = time.perf_counter()
+	y_pred = model.predict(X_test)
+	predict_time = time.perf_counter() - start
+
+	return {'model': name,
+			'test_acc': accuracy_score(y_test, y_pred),
+			'test_loss': mean_squared_error(y_test, y_pred),
+			'fit_time': fit_time,
+			'predict_time': predict_time}
+
+
+def sweep(models, train_set, test_set, workers):
+	"""
+	Trains the models concurrently (threads, so all of them share the same in-memory train and test matrices).
+	:param models: list of (name, estimator).
+	:param train_set: (X_train, y_train).
+	:param test_set: (X_test, y_test).
+	:param workers: int. number of models trained at the same time.
+	:return: data frame. the comparison table.
+	"""
+	with ThreadPoolExecutor(max_workers=workers) as pool:
+		rows = list(pool.map(lambda named_model: fit_and_score(named_model[0], named_model[1], train_set, test_set),
+							 models))
+	return pd.DataFrame(rows).set_index('model')
+
+
+def main(args):
+	args.test_size = float(args.test_size)
+	args.models = args.models.split(',')
+	for name in args.models:
+		if name not in model_scripts:
+			raise Exception("Sweep Error: Unknown model {}. Expected one of {}.".format(name, list(model_scripts)))
+	args.workers = int(args.workers) if args.workers != 'None' else len(args.models)
+
+	# Loading and splitting the data set - once for all the models.
+	X, y = load_dataset(args.data)
+	X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=args.test_size)
+
+	models = [(name, build_sweep_model(name, getattr(args, name + '_args'), args.data)) for name in args.models]
+	table = sweep(models, (X_train, y_train), (X_test, y_test), args.workers)
+
+	print(table.to_string(float_format='{:.4f}'.format))
+	if args.output is not None:
+		table.to_csv(args.output)
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description="""Multi-model sweep - trains several models over one split of the data set""")
+	parser.add_argument('--data', action='store', dest='data', required=True,
+						help="""String. path to csv, parquet or feather file: The data set for the classifiers. Assumes the last column includes the labels. """)
+
+	parser.add_argument('--test_size', action='store', default="0.2", dest='test_size',
+						help="""Float. The portion of the data of testing. Default is 0.2""")
+
+	parser.add_argument('--models', action='store', default="knn,random_forest,xgb", dest='models',
+						help="""String. Comma separated list of the models to train (knn, random_forest, xgb).
+						Default is knn,random_forest,xgb""")
+
+	parser.add_argument('--workers', action='store', default="None", dest='workers',
+						help="""Integer. Number of models trained concurrently. Default is None (all of them).""")
+
+	for name in model_scripts:
+		parser.add_argument('--{}_args'.format(name), action='store', default="", dest='{}_args'.format(name),
+							help="""String. The params of {0} as passed to {0}.py (ex: "--n_jobs 4"). Default is the
+							defaults of {0}.py""".format(name))
+
+	parser.add_argument('--output', action='store', default=None, dest='output',
+						help="""String. Path to a csv file for the comparison table. Default is None.""")
+
+	args = parser.parse_args()
+
+	main(args)
@@ -0,0 +1,100 @@
+"""
+All rights reserved to cnvrg.io
+     http://www.cnvrg.io
+
+cnvrg.io - AI library
+
+test_compiled_trees.py
+==============================================================================
+The compiled models predict as the models they were compiled from (python -m pytest).
+"""
+import numpy as np
+import pytest
+import xgboost
+from sklearn.datasets import make_classification
+from sklearn.ensemble import RandomForestClassifier
+from xgboost import XGBClassifier
+
+from booster import BoosterClassifier
+from compiled_trees import compile_model, numba_available, CompiledTreeEnsemble
+
+engines = ['numpy', pytest.param('numba', marks=pytest.mark.skipif(not numba_available(), reason="numba isn't installed"))]
+
+
+def _data(nan_fraction=0., zero_fraction=0., seed=0):
+	X, y = make_classification(n_samples=2000, n_features=12, n_informative=6, random_state=seed)
+	X = X.astype(np.float32)
+	rng = np.random.RandomState(seed)
+	X[rng.rand(*X.shape) < nan_fraction] = np.nan
+	X[rng.rand(*X.shape) < zero_fraction] = 0.
+	return X[:1500], y[:1500], X[1500:]
+
+
+def _assert_same_predictions(model, X, engine, atol=1e-6):
+	compiled = compile_model(model, engine=engine)
+	np.testing.assert_allclose(compiled.predict_proba(X), model.predict_proba(X), rtol=0, atol=atol)
+	np.testing.assert_array_equal(compiled.predict(X), model.predict(X))
+
+
+@pytest.mark.parametrize('engine', engines)
+def test_random_forest(engine):
+	X, y, X_test = _data()
+	model = RandomForestClassifier(n_estimators=20, random_state=0).fit(X, y)
+	_assert_same_predictions(model, X_test, engine, atol=1e-12)
+
+
+@pytest.mark.parametrize('engine', engines)
+def test_xgboost(engine):
+	X, y, X_test = _data()
+	model = XGBClassifier(n_estimators=30, max_depth=4).fit(X, y)
+	_assert_same_predictions(model, X_test, engine)
+
+
+@pytest.mark.parametrize('engine', engines)
+def test_xgboost_nan(engine):
+	X, y, X_test = _data(nan_fraction=0.1)
+	model = XGBClassifier(n_estimators=30, max_depth=4).fit(X, y)
+	_assert_same_predictions(model, X_test, engine)
+
+
+@pytest.mark.parametrize('engine', engines)
+def test_xgboost_missing_value(engine):
+	X, y, X_test = _data(zero_fraction=0.2)
+	model = XGBClassifier(n_estimators=30, max_depth=4, missing=0.).fit(X, y)
+	_assert_same_predictions(model, X_test, engine)
+
+
+@pytest.mark.parametrize('engine', engines)
+def test_xgboost_early_stopping(engine):
+	X, y, X_test = _data(nan_fraction=0.05)
+	model = XGBClassifier(n_estimators=200, learning_rate=0.3, early_stopping_rounds=5)
+	model.fit(X[:1200], y[:1200], eval_set=[(X[1200:], y[1200:])], verbose=False)
+	assert model.best_iteration + 1 < model.get_booster().num_boosted_rounds()
+	_assert_same_predictions(model, X_test, engine)
+
+
+@pytest.mark.parametrize('engine', engines)
+def test_xgboost_base_score(engine):
+	X, y, X_test = _data()
+	model = XGBClassifier(n_estimators=30, max_depth=4, base_score=0.3).fit(X, y)
+	_assert_same_predictions(model, X_test, engine)
+
+
+@pytest.mark.parametrize('engine', engines)
+def test_booster_classifier(engine):
+	X, y, X_test = _data(zero_fraction=0.2)
+	dtrain = xgboost.DMatrix(X[:1200], y[:1200], missing=0.)
+	deval = xgboost.DMatrix(X[1200:], y[1200:], missing=0.)
+	booster = xgboost.train({'objective': 'binary:logistic', 'max_depth': 4}, dtrain, num_boost_round=100,
+							evals=[(deval, 'eval')], early_stopping_rounds=5, verbose_eval=False)
+	model = BoosterClassifier(booster, np.unique(y), best_iteration=booster.best_iteration, missing=0.)
+	_assert_same_predictions(model, X_test, engine)
+
+
+def test_save_load(tmp_path):
+	X, y, X_test = _data(zero_fraction=0.2)
+	model = XGBClassifier(n_estimators=30, max_depth=4, missing=0.).fit(X, y)
+	path = str(tmp_path / 'compiled.npz')
+	compile_model(model).save(path)
+	loaded = CompiledTreeEnsemble.load(path, engine='numpy')
+	np.testing.assert_allclose(loaded.predict_proba(X_test), model.predict_proba(X_test), rtol=0, atol=1e-6)
@@ -0,0 +1,39 @@
+"""
+All rights reserved to cnvrg.io
+     http://www.cnvrg.io
+
+cnvrg.io - AI library
+
+test_preprocess.py
+==============================================================================
+The vectorized column transforms of preprocess.py produce the same output as the loop-based ones (python -m pytest).
+"""
+import pandas as pd
+import pytest
+
+from benchmark_preprocess import make_synthetic_raw
+from preprocess import preprocess, Preprocessor
+
+
+@pytest.fixture
+def raw():
+	return make_synthetic_raw(3000, seed=1)
+
+
+def test_vectorized_equals_loop(raw):
+	pd.testing.assert_frame_equal(preprocess(raw.copy(), vectorized=True), preprocess(raw.copy(), vectorized=False))
+
+
+def test_vectorized_equals_loop_with_stats(raw):
+	stats = Preprocessor().fit(raw).stats
+	pd.testing.assert_frame_equal(preprocess(raw.copy(), vectorized=True, stats=stats),
+								  preprocess(raw.copy(), vectorized=False, stats=stats))
+
+
+def test_vectorized_equals_loop_on_chunks(raw):
+	# The chunks of the streaming mode are indexed by their row numbers in the file, not from 0.
+	stats = Preprocessor().fit(raw).stats
+	for start in range(0, len(raw), 1000):
+		chunk = raw.iloc[start:start + 1000]
+		pd.testing.assert_frame_equal(preprocess(chunk.copy(), vectorized=True, stats=stats),
+									  preprocess(chunk.copy(), vectorized=False, stats=stats))
@@ -13,33 +13,29 @@ xgb.py
 ==============================================================================
 """
 import argparse
-import pickle
+import functools
 
-import pandas as pd
+import numpy as np
+import xgboost
 from cnvrg import Experiment
+from xgboost import XGBClassifier
 from sklearn.metrics import accuracy_score, mean_squared_error
+from sklearn.model_selection import KFold, train_test_split
 
-from xgboost import XGBClassifier
-from sklearn.model_selection import train_test_split, KFold
+from booster import BoosterClassifier
+from dataset import take_rows
+from harness import add_common_args, run, save_model, training_metrics, log_training_metrics
+from profiling import stage
 
-import warnings
-warnings.filterwarnings(action="ignore", category=RuntimeWarning)
-warnings.filterwarnings(action='ignore', category=DeprecationWarning)
 
 def _cast_types(args):
 	"""
-	This method performs casting to all types of inputs passed via cmd.
+	This method performs casting to the model's params passed via cmd.
 	:param args: argparse.ArgumentParser object.
 	:return: argparse.ArgumentParser object.
 	"""
-	# x_val.
-	if args.x_val != 'None':
-		args.x_val = int(args.x_val)
-	else:
-		args.x_val = None
-
-	# test_size
-	args.test_size = float(args.test_size)
+	# max_depth.
+	args.max_depth = int(args.max_depth)
 
 	# learning_rate.
 	args.learning_rate = float(args.learning_rate)
@@ -101,24 +97,246 @@ def _cast_types(args):
 	else:
 		args.seed = int(args.seed)
 
-	# missing.
+	# missing. (None - NaN, xgboost rejects None)
 	if args.missing == "None" or args.missing == 'None':
-		args.missing = None
+		args.missing = np.nan
+	else:
+		args.missing = float(args.missing)
+
+	# incremental.
+	args.incremental = (args.incremental == "True" or args.incremental == 'True')
+
+	# early_stopping_rounds.
+	if args.early_stopping_rounds == "None" or args.early_stopping_rounds == 'None':
+		args.early_stopping_rounds = None
+	else:
+		args.early_stopping_rounds = int(args.early_stopping_rounds)
+
+	# eval_fraction.
+	args.eval_fraction = float(args.eval_fraction)
+
+	# max_bin.
+	args.max_bin = int(args.max_bin)
+
+	# cache_dmatrix.
+	args.cache_dmatrix = (args.cache_dmatrix == "True" or args.cache_dmatrix == 'True')
+	if args.cache_dmatrix and args.incremental:
+		raise Exception("Params Error: --cache_dmatrix can't be used with --incremental.")
 
 	return args
 
 
-def train_with_cross_validation(model, train_set, test_set, folds, project_dir, output_model_name):
+def build_model(args):
+	"""
+	:param args: argparse.ArgumentParser object (cast).
+	:return: XGBClassifier (not fitted).
+	"""
+	return XGBClassifier(
+		max_depth=args.max_depth,
+		learning_rate=args.learning_rate,
+		n_estimators=args.n_estimators,
+		silent=args.silent,
+		objective=args.objective,
+		booster=args.booster,
+		n_jobs=args.n_jobs,
+		nthread=args.nthread,
+		gamma=args.gamma,
+		min_child_weight=args.min_child_weight,
+		max_delta_step=args.max_delta_step,
+		subsample=args.subsample,
+		colsample_bytree=args.colsample_bytree,
+		colsample_bylevel=args.colsample_bylevel,
+		reg_alpha=args.reg_alpha,
+		reg_lambda=args.reg_lambda,
+		scale_pos_weight=args.scale_pos_weight,
+		base_score=args.base_score,
+		random_state=args.random_state,
+		seed=args.seed,
+		missing=args.missing,
+		tree_method=args.tree_method,
+		max_bin=args.max_bin
+	)
+
+
+def train_with_incremental_cross_validation(model, train_set, test_set, folds, project_dir, output_model_name,
+											 early_stopping_rounds=None, eval_fraction=0.1, workers=None):
+	"""
+	Cross validation with a single, growing booster - every fold continues boosting from the booster of the previous
+	fold (xgb_model=) by up to n_estimators / folds rounds over the training rows of the fold. So the total boosting
+	work is about n_estimators rounds instead of folds * n_estimators.
+	Every fold's booster has already been trained on the validation rows of the next folds, so the folds are evaluated
+	(and early stopped) on a fixed eval set - eval_fraction of the training set, held out of all the folds. These are
+	the scores of the growing booster on the same rows, not cross validation estimates, so they are logged as
+	eval_acc_per_round / eval_loss_per_round.
+	The folds depend on each other, so workers is ignored.
+	"""
+	eval_acc, eval_loss, val_curves = [], [], []
+	kf = KFold(n_splits=folds)
+	X, y = train_set
+	X, X_eval, y, y_eval = train_test_split(X, y, test_size=eval_fraction)
+	model.set_params(n_estimators=max(1, model.n_estimators // folds), early_stopping_rounds=early_stopping_rounds)
+	booster = None
+	# --- Training.
+	for train_index, _ in kf.split(X):
+		with stage('fold_copy'):
+			X_train, y_train = take_rows(X, train_index), take_rows(y, train_index)
+		with stage('fit'):
+			model.fit(X_train, y_train, eval_set=[(X_eval, y_eval)], xgb_model=booster, verbose=False)
+		booster = model.get_booster()
+		if early_stopping_rounds is not None:
+			# The next fold continues from the best iteration of this one.
+			booster = booster[:model.best_iteration + 1]
+		val_curves.append(list(model.evals_result()['validation_0'].values())[0])
+		with stage('predict_val'):
+			y_hat = model.predict(X_eval)  # y_hat is a.k.a y_pred
+		acc = accuracy_score(y_eval, y_hat)
+		loss = mean_squared_error(y_eval, y_hat)
+
+		eval_acc.append(acc)
+		eval_loss.append(loss)
+	# The saved model - the booster of the last fold (it predicts with its best iteration, if early stopped).
+	boosting_rounds = model.get_booster().num_boosted_rounds()
+	# --- Testing.
+	X_test, y_test = test_set
+	with stage('predict_test'):
+		y_pred = model.predict(X_test)
+	test_acc = accuracy_score(y_test, y_pred)
+	test_loss = mean_squared_error(y_test, y_pred)
+
+	exp = Experiment()
+	exp.log_param("model", output_model_name)
+	exp.log_param("folds", folds)
+	exp.log_param("eval_fraction", eval_fraction)
+	exp.log_param("boosting_rounds", boosting_rounds)
+	if early_stopping_rounds is not None:
+		exp.log_param("best_iteration", model.best_iteration)
+	exp.log_metric("eval_acc_per_round", eval_acc)
+	exp.log_metric("eval_loss_per_round", eval_loss)
+	for fold, curve in enumerate(val_curves):
+		exp.log_metric("val_curve_fold_{}".format(fold), curve)
+	exp.log_param("test_acc", test_acc)
+	exp.log_param("test_loss", test_loss)
+
+	# Save model.
+	save_model(model, project_dir, output_model_name,
+			   metrics={'folds': folds, 'boosting_rounds': boosting_rounds, 'eval_acc_per_round': eval_acc,
+						'eval_loss_per_round': eval_loss, 'test_acc': test_acc, 'test_loss': test_loss})
+	return model
+
+
+def train_with_early_stopping(model, train_set, test_set, project_dir, output_model_name, early_stopping_rounds,
+							  eval_fraction, train_eval_size=None):
+	"""
+	Training without cross validation, which stops boosting once the loss of a held-out eval set (eval_fraction of
+	the training set) hasn't improved for early_stopping_rounds rounds. The model predicts with its best iteration.
+	"""
+	X_train, y_train = train_set
+	X_train, X_eval, y_train, y_eval = train_test_split(X_train, y_train, test_size=eval_fraction)
+	model.set_params(early_stopping_rounds=early_stopping_rounds)
+	# --- Training.
+	with stage('fit'):
+		model.fit(X_train, y_train, eval_set=[(X_eval, y_eval)], verbose=False)
+	train_metrics = training_metrics(model, X_train, y_train, train_eval_size)
+	# --- Testing.
+	X_test, y_test = test_set
+	with stage('predict_test'):
+		y_pred = model.predict(X_test)
+	test_acc = accuracy_score(y_test, y_pred)
+	test_loss = mean_squared_error(y_test, y_pred)
+
+	exp = Experiment()
+	exp.log_param("model", output_model_name)
+	exp.log_param("eval_fraction", eval_fraction)
+	exp.log_param("best_iteration", model.best_iteration)
+	exp.log_param("boosting_rounds", model.get_booster().num_boosted_rounds())
+	exp.log_metric("eval_curve", list(model.evals_result()['validation_0'].values())[0])
+	log_training_metrics(exp, train_metrics)
+	exp.log_param("test_acc", test_acc)
+	exp.log_param("test_loss", test_loss)
+
+	# Save model.
+	save_model(model, project_dir, output_model_name,
+			   metrics=dict(train_metrics, best_iteration=model.best_iteration, test_acc=test_acc, test_loss=test_loss))
+	return model
+
+
+class DMatrixCache:
+	"""
+	Builds the DMatrix of the training set once - a QuantileDMatrix for tree_method='hist', so the data is quantized
+	to max_bin bins once and no float copy of it is kept. The DMatrices of the folds and of the test set are built
+	from it: slices of it, or (for 'hist') QuantileDMatrices which reuse its quantile cuts instead of sketching again.
+	"""
+	def __init__(self, model, X, y):
+		"""
+		:param model: XGBClassifier. its tree_method, max_bin, n_jobs and missing are used.
+		:param X: array. the training set features.
+		:param y: array. the training set labels.
+		"""
+		params = model.get_xgb_params()
+		self.X, self.y = X, y
+		self.max_bin = params.get('max_bin') or 256
+		self.nthread = params.get('n_jobs')
+		self.missing = np.nan if model.missing is None else model.missing
+		self.quantized = params.get('tree_method') == 'hist'
+		if self.quantized:
+			self.train = xgboost.QuantileDMatrix(X, y, max_bin=self.max_bin, missing=self.missing, nthread=self.nthread)
+		else:
+			self.train = xgboost.DMatrix(X, y, missing=self.missing, nthread=self.nthread)
+
+	def rows(self, index):
+		"""
+		:param index: array of row indices of the training set.
+		:return: DMatrix of these rows.
+		"""
+		if self.quantized:
+			return xgboost.QuantileDMatrix(take_rows(self.X, index), take_rows(self.y, index), ref=self.train,
+										   max_bin=self.max_bin, missing=self.missing, nthread=self.nthread)
+		return self.train.slice(index)
+
+	def matrix(self, X, y=None):
+		"""
+		:param X: array. features of other data (ex: the test set).
+		:param y: array or None. labels.
+		:return: DMatrix of X (quantized with the training set cuts, for 'hist').
+		"""
+		if self.quantized:
+			return xgboost.QuantileDMatrix(X, y, ref=self.train, max_bin=self.max_bin, missing=self.missing,
+										   nthread=self.nthread)
+		return xgboost.DMatrix(X, y, missing=self.missing, nthread=self.nthread)
+
+
+def train_booster(model, dtrain, evals=(), early_stopping_rounds=None):
+	"""
+	:param model: XGBClassifier. its params and n_estimators are used.
+	:param dtrain: DMatrix.
+	:return: xgboost.Booster.
+	"""
+	return xgboost.train(model.get_xgb_params(), dtrain, num_boost_round=model.n_estimators, evals=evals,
+						 early_stopping_rounds=early_stopping_rounds, verbose_eval=False)
+
+
+def train_with_cross_validation_dmatrix_cache(model, train_set, test_set, folds, project_dir, output_model_name,
+											  workers=None):
+	"""
+	train_with_cross_validation over a DMatrixCache - the training set is converted (and quantized, for 'hist') once
+	and the folds and the test set reuse it. The cache is in-process, so workers is ignored.
+	"""
 	train_acc, train_loss = [], []
 	kf = KFold(n_splits=folds)
 	X, y = train_set
+	with stage('dmatrix'):
+		cache = DMatrixCache(model, X, y)
+	classes = np.unique(y)
 	# --- Training.
 	for train_index, val_index in kf.split(X):
-		X_train, X_val = X.iloc[train_index, :], X.iloc[val_index, :]
-		y_train, y_val = y.iloc[train_index], y.iloc[val_index]
-		model.fit(X_train, y_train)
+		with stage('fold_copy'):
+			dtrain, dval = cache.rows(train_index), cache.rows(val_index)
+		with stage('fit'):
+			booster = train_booster(model, dtrain)
 		model.n_estimators += 1
-		y_hat = model.predict(X_val)  # y_hat is a.k.a y_pred
+		with stage('predict_val'):
+			y_hat = BoosterClassifier(booster, classes, missing=cache.missing).predict(dval)  # y_hat is a.k.a y_pred
+		y_val = take_rows(y, val_index)
 		acc = accuracy_score(y_val, y_hat)
 		loss = mean_squared_error(y_val, y_hat)
 
@@ -126,7 +344,9 @@ def train_with_cross_validation(model, train_set, test_set, folds, project_dir,
 		train_loss.append(loss)
 	# --- Testing.
 	X_test, y_test = test_set
-	y_pred = model.predict(X_test)
+	classifier = BoosterClassifier(booster, classes, missing=cache.missing)
+	with stage('predict_test'):
+		y_pred = classifier.predict(cache.matrix(X_test))
 	test_acc = accuracy_score(y_test, y_pred)
 	test_loss = mean_squared_error(y_test, y_pred)
 
@@ -139,121 +359,81 @@ def train_with_cross_validation(model, train_set, test_set, folds, project_dir,
 	exp.log_param("test_loss", test_loss)
 
 	# Save model.
-	output_file_name = project_dir + "/" + output_model_name if project_dir is not None else output_model_name
-	pickle.dump(model, open(output_file_name, 'wb'))
+	save_model(classifier, project_dir, output_model_name,
+			   metrics={'folds': folds, 'train_acc': train_acc, 'train_loss': train_loss, 'test_acc': test_acc,
+						'test_loss': test_loss})
+	return classifier
 
 
-def train_without_cross_validation(model, train_set, test_set, project_dir, output_model_name):
+def train_with_dmatrix_cache(model, train_set, test_set, project_dir, output_model_name, early_stopping_rounds=None,
+							 eval_fraction=0.1, train_eval_size=None):
+	"""
+	train_without_cross_validation (or train_with_early_stopping, if early_stopping_rounds is given) over a
+	DMatrixCache - the training set is converted (and quantized, for 'hist') once and reused by the training
+	accuracy check, and the eval and test sets share its quantile cuts.
+	"""
 	X_train, y_train = train_set
+	evals = ()
+	if early_stopping_rounds is not None:
+		X_train, X_eval, y_train, y_eval = train_test_split(X_train, y_train, test_size=eval_fraction)
+	with stage('dmatrix'):
+		cache = DMatrixCache(model, X_train, y_train)
+		if early_stopping_rounds is not None:
+			evals = [(cache.matrix(X_eval, y_eval), 'validation_0')]
 	# --- Training.
-	model.fit(X_train, y_train)
-	y_hat = model.predict(X_train)  # y_hat is a.k.a y_pred
-
-	train_acc = accuracy_score(y_train, y_hat)
-	train_loss = mean_squared_error(y_train, y_hat)
+	with stage('fit'):
+		booster = train_booster(model, cache.train, evals=evals, early_stopping_rounds=early_stopping_rounds)
+	classifier = BoosterClassifier(booster, np.unique(y_train),
+								   best_iteration=booster.best_iteration if early_stopping_rounds is not None else None,
+								   missing=cache.missing)
+	train_metrics = training_metrics(classifier, cache.train, y_train, train_eval_size,
+									 take=lambda dtrain, index: cache.rows(index))
 	# --- Testing.
 	X_test, y_test = test_set
-	y_pred = model.predict(X_test)
+	with stage('predict_test'):
+		y_pred = classifier.predict(cache.matrix(X_test))
 	test_acc = accuracy_score(y_test, y_pred)
 	test_loss = mean_squared_error(y_test, y_pred)
 
 	exp = Experiment()
 	exp.log_param("model", output_model_name)
-	exp.log_param("train_acc", train_acc)
-	exp.log_param("train_loss", train_loss)
+	if early_stopping_rounds is not None:
+		exp.log_param("eval_fraction", eval_fraction)
+		exp.log_param("best_iteration", booster.best_iteration)
+		exp.log_param("boosting_rounds", booster.num_boosted_rounds())
+	log_training_metrics(exp, train_metrics)
 	exp.log_param("test_acc", test_acc)
 	exp.log_param("test_loss", test_loss)
 
 	# Save model.
-	output_file_name = project_dir + "/" + output_model_name if project_dir is not None else output_model_name
-	pickle.dump(model, open(output_file_name, 'wb'))
+	save_model(classifier, project_dir, output_model_name,
+			   metrics=dict(train_metrics, test_acc=test_acc, test_loss=test_loss))
+	return classifier
+
 
 def main(args):
 	args = _cast_types(args)
 
-	# Loading data set.
-	data = pd.read_csv(args.data)
-	for col in data.columns:
-		if col.startswith('Unnamed'):
-			data = data.drop(columns=col, axis=1)
-
-	# Checking data sets sizes.
-	rows_num, cols_num = data.shape
-	if rows_num == 0:
-		raise Exception("Library Error: The given dataset has no examples.")
-	if cols_num < 2:
-		raise Exception("Dataset Error: Not enough columns.")
-
-	# Split to X and y.
-	X = data.iloc[:, :-1]
-	y = data.iloc[:, -1]
-
-	X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=args.test_size)
-
-	# Model initialization.
-	model = XGBClassifier(
-		max_depth=args.max_depth,
-		learning_rate=args.learning_rate,
-		n_estimators=args.n_estimators,
-		silent=args.silent,
-		objective=args.objective,
-		booster=args.booster,
-		n_jobs=args.n_jobs,
-		nthread=args.nthread,
-		gamma=args.gamma,
-		min_child_weight=args.min_child_weight,
-		max_delta_step=args.max_delta_step,
-		subsample=args.subsample,
-		colsample_bytree=args.colsample_bytree,
-		colsample_bylevel=args.colsample_bylevel,
-		reg_alpha=args.reg_alpha,
-		reg_lambda=args.reg_lambda,
-		scale_pos_weight=args.scale_pos_weight,
-		base_score=args.base_score,
-		random_state=args.random_state,
-		seed=args.seed,
-		missing=args.missing
-	)
-
-	# Training with cross validation.
-	if args.x_val is not None:
-		train_with_cross_validation(model=model,
-									train_set=(X_train, y_train),
-									test_set=(X_test, y_test),
-									folds=args.x_val,
-									project_dir=args.project_dir,
-									output_model_name=args.output_model)
-
-	# Training without cross validation.
-	else:
-		train_without_cross_validation(model=model,
-										train_set=(X_train, y_train),
-										test_set=(X_test, y_test),
-										project_dir=args.project_dir,
-										output_model_name=args.output_model)
-
-
-if __name__ == '__main__':
+	cross_validation, train = None, None
+	if args.incremental:
+		cross_validation = functools.partial(train_with_incremental_cross_validation,
+											 early_stopping_rounds=args.early_stopping_rounds,
+											 eval_fraction=args.eval_fraction)
+	if args.early_stopping_rounds is not None:
+		train = functools.partial(train_with_early_stopping,
+								  early_stopping_rounds=args.early_stopping_rounds,
+								  eval_fraction=args.eval_fraction)
+	if args.cache_dmatrix:
+		cross_validation = train_with_cross_validation_dmatrix_cache
+		train = functools.partial(train_with_dmatrix_cache,
+								  early_stopping_rounds=args.early_stopping_rounds,
+								  eval_fraction=args.eval_fraction)
+	run(args, build_model, cross_validation=cross_validation, train=train)
+
+
+def build_parser():
 	parser = argparse.ArgumentParser(description="""xgboost Classifier""")
-
-	# ----- cnvrg.io params.
-	parser.add_argument('--data', action='store', dest='data', required=True,
-	                    help="""String. path to csv file: The data set for the classifier. Assumes the last column includes the labels. """)
-
-	parser.add_argument('--project_dir', action='store', dest='project_dir',
-	                    help="""--- For inner use of cnvrg.io ---""")
-
-	parser.add_argument('--output_dir', action='store', dest='output_dir',
-	                    help="""--- For inner use of cnvrg.io ---""")
-
-	parser.add_argument('--x_val', action='store', default="None", dest='x_val',
-	                    help="""Integer. Number of folds for the cross-validation. Default is None.""")
-
-	parser.add_argument('--test_size', action='store', default="0.2", dest='test_size',
-	                    help="""Float. The portion of the data of testing. Default is 0.2""")
-
-	parser.add_argument('--output_model', action='store', default="xgb_model.sav", dest='output_model',
-	                    help="""String. The name of the output file which is a trained random forests model """)
+	add_common_args(parser, output_model="xgb_model.sav")
 
 	# ----- model's params.
 	parser.add_argument('--max_depth', action='store', default="3", dest='max_depth',
@@ -318,8 +498,43 @@ if __name__ == '__main__':
 						help=""": --- . Default is None""")
 	# Type
 	parser.add_argument('--missing', action='store', default="None", dest='missing',
-						help=""": --- . Default is None""")
+						help="""Float. The value treated as missing. Default is None (NaN).""")
+
+	parser.add_argument('--tree_method', action='store', default="auto", dest='tree_method',
+						help="""String. 'auto', 'exact', 'approx' or 'hist'. The tree construction algorithm. 'hist' 
+						buckets the features into max_bin bins and is much faster on large data sets. 
+						Default is 'auto'""")
 
-	args = parser.parse_args()
+	parser.add_argument('--max_bin', action='store', default="256", dest='max_bin',
+						help="""Integer. Maximal number of bins per feature of tree_method 'hist'. Default is 256""")
+
+	parser.add_argument('--cache_dmatrix', action='store', default="False", dest='cache_dmatrix',
+						help="""Boolean. Builds the DMatrix of the training set once (a QuantileDMatrix, quantized once, 
+						for tree_method 'hist') and reuses it for all the folds, the training accuracy and the test 
+						predictions, training with xgboost.train. The saved model is then a BoosterClassifier over the 
+						booster. Default is False.""")
+
+	parser.add_argument('--incremental', action='store', default="False", dest='incremental',
+						help="""Boolean. With --x_val, every fold continues boosting from the booster of the previous 
+						fold (up to n_estimators / x_val rounds per fold) instead of refitting all the trees. The folds 
+						are evaluated on a fixed eval set (--eval_fraction of the training set, held out of all the 
+						folds): its accuracy and loss after every fold are logged as eval_acc_per_round and 
+						eval_loss_per_round, and its curve of every fold. Default is False.""")
+
+	parser.add_argument('--early_stopping_rounds', action='store', default="None", dest='early_stopping_rounds',
+						help="""Integer. Boosting stops after this many rounds without improvement of the eval set 
+						(--eval_fraction of the training set) and the best iteration is kept. With --x_val it applies 
+						to --incremental only, where the next fold continues from the best iteration. Default is None 
+						(n_estimators rounds).""")
+
+	parser.add_argument('--eval_fraction', action='store', default="0.1", dest='eval_fraction',
+						help="""Float. The portion of the training set held out as the eval set of 
+						--early_stopping_rounds and of --incremental. Default is 0.1""")
+
+	return parser
+
+
+if __name__ == '__main__':
+	args = build_parser().parse_args()
 
 	main(args)